@@ -0,0 +1,72 @@
+"""Reading every volume of an acquisition through tifffile against mapping
+the buffers straight from the first buffer's data offset.
+
+Usage: python benchmarks/bench_buffer_reads.py [--buffers N]
+                                              [--shape VPB Z C Y X]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import tifffile
+
+from snouty_viewer.im_loader import ImPathInfo, _load_buffer, load_buffer
+
+
+def make_buffers(path, num_buffers, shape):
+    os.makedirs(os.path.join(path, "data"))
+    os.makedirs(os.path.join(path, "metadata"))
+    vols_per_buffer, num_z, num_c = shape[:3]
+    channels = [str(488 + ch) for ch in range(num_c)]
+    with open(os.path.join(path, "metadata", "000000.txt"), "w") as f:
+        f.write(f"volumes_per_buffer: {vols_per_buffer}\n")
+        f.write(f"channels_per_slice: {channels}\n")
+        f.write(f"slices_per_volume: {num_z}\n")
+    buffer = np.random.randint(0, 1000, shape).astype(np.uint16)
+    for idx in range(num_buffers):
+        tifffile.imwrite(os.path.join(path, "data", f"{idx:06d}.tif"), buffer)
+
+
+def read_all(im_path_info, layout):
+    _load_buffer.cache_clear()
+    total = 0
+    for im_path in im_path_info.data_tifs:
+        im_buffer = load_buffer(
+            im_path,
+            im_path_info.vols_per_buffer,
+            im_path_info.num_channels,
+            layout,
+        )
+        total += int(im_buffer[..., -1, -1].sum())
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--buffers", type=int, default=200)
+    parser.add_argument(
+        "--shape", type=int, nargs=5, default=(1, 200, 2, 72, 256)
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        make_buffers(tmp_dir, args.buffers, tuple(args.shape))
+        im_path_info = ImPathInfo(tmp_dir)
+        for name, layout in [
+            ("tifffile", None),
+            ("offset", im_path_info.buffer_layout),
+        ]:
+            best = np.inf
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                read_all(im_path_info, layout)
+                best = min(best, time.perf_counter() - start)
+            per_buffer = best / args.buffers * 1e3
+            print(f"{name:>8}: {per_buffer:7.3f} ms per buffer")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Throughput of the deshear kernel against the original per-z loop.
+
+Usage: python benchmarks/bench_deshear.py [--shape T C Z Y X] [--memmap]
+                                         [--workers N]
+"""
+import argparse
+import functools
+import os
+import tempfile
+import time
+
+import numpy as np
+import tifffile
+
+from snouty_viewer.deshear import deshear_volume, run_tasks, split_volumes
+
+
+def per_z_deshear(data, im_desheared, scan_step_size_px):
+    # the original ImInfo._deshear_channel: channel by channel, one strided
+    # slice-assign per z-plane across all timepoints
+    num_t, num_c, num_z, num_y, num_x = data.shape
+    for ch in range(num_c):
+        for z in range(num_z):
+            deshear_shift = int(np.rint(z * scan_step_size_px))
+            im_desheared[
+                :, ch, z, deshear_shift : (deshear_shift + num_y), :
+            ] = data[:, ch, z, :, :]
+
+
+def kernel_deshear(data, im_desheared, scan_step_size_px, workers=1):
+    num_t, num_c, num_z, num_y, num_x = data.shape
+    max_deshear_shift = im_desheared.shape[3] - num_y
+    volumes = [(t, ch) for t in range(num_t) for ch in range(num_c)]
+    run_tasks(
+        lambda t, ch, z_slice: deshear_volume(
+            data[t, ch],
+            scan_step_size_px,
+            max_deshear_shift,
+            im_desheared[t, ch],
+            zero_fill=False,
+            z_slice=z_slice,
+        ),
+        split_volumes(volumes, num_z, workers),
+        workers,
+    )
+
+
+def allocate(shape, dtype, path=None):
+    if path is None:
+        return np.zeros(shape, dtype)
+    tifffile.imwrite(
+        path,
+        shape=shape,
+        dtype=dtype,
+        bigtiff=True,
+        metadata={"axes": "TCZYX"},
+    )
+    # keep the singleton axes, tifffile would squeeze them
+    return tifffile.memmap(path, mode="r+").reshape(shape)
+
+
+def run(fn, data, scan_step_size_px, out_shape, path, repeats):
+    best = np.inf
+    for _ in range(repeats):
+        im_desheared = allocate(out_shape, data.dtype, path)
+        start = time.perf_counter()
+        fn(data, im_desheared, scan_step_size_px)
+        if path is not None:
+            im_desheared.flush()
+        best = min(best, time.perf_counter() - start)
+        del im_desheared
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--shape", type=int, nargs=5, default=(4, 2, 100, 256, 512)
+    )
+    parser.add_argument("--dtype", default="uint16")
+    parser.add_argument("--step", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--memmap", action="store_true", help="write into an ome.tif memmap"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="threads for the kernel"
+    )
+    args = parser.parse_args()
+
+    shape = tuple(args.shape)
+    data = np.random.randint(0, 1000, shape).astype(args.dtype)
+    max_deshear_shift = args.step * (shape[2] - 1)
+    out_shape = shape[:3] + (shape[3] + max_deshear_shift, shape[4])
+    gb = data.nbytes / 1e9
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = None
+        if args.memmap:
+            path = os.path.join(tmp_dir, "deskewed.ome.tif")
+        print(f"shape {shape} {args.dtype}, {gb:.2f} GB in")
+        runs = [("per-z", per_z_deshear), ("kernel", kernel_deshear)]
+        if args.workers != 1:
+            runs.append(
+                (
+                    f"kernel x{args.workers}",
+                    functools.partial(kernel_deshear, workers=args.workers),
+                )
+            )
+        for name, fn in runs:
+            seconds = run(fn, data, args.step, out_shape, path, args.repeats)
+            print(f"{name:>10}: {seconds:7.3f} s  {gb / seconds:6.2f} GB/s")
+
+
+if __name__ == "__main__":
+    main()
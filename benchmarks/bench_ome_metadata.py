@@ -0,0 +1,97 @@
+"""Per-file overhead of allocating an OME-TIFF with its metadata.
+
+Compares the original write / read back / parse / rewrite round trip of the
+OME-XML through ome_types with building the metadata up front.
+
+Usage: python benchmarks/bench_ome_metadata.py [--files N] [--shape T C Z Y X]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import tifffile
+
+from snouty_viewer.im_loader import (
+    allocate_memory_return_memmap,
+    time_increment,
+)
+
+SNOUTY_METADATA = {
+    "channels_per_slice": "['488', '561']",
+    "sample_px_um": "0.4",
+    "voxel_aspect_ratio": "2.5",
+    "volumes_per_s": "10",
+    "buffer_time_s": "1",
+    "delay_s": "None",
+    "description": "benchmark",
+}
+
+
+def round_trip_allocate(axes, shape, snouty_metadata, save_path, dtype):
+    # the original allocate_memory_return_memmap
+    import ome_types
+
+    tifffile.imwrite(
+        save_path,
+        shape=shape,
+        dtype=dtype,
+        bigtiff=True,
+        metadata={"axes": axes},
+    )
+    ome_xml = tifffile.tiffcomment(save_path)
+    ome = ome_types.from_xml(ome_xml)
+    px_size = float(snouty_metadata["sample_px_um"])
+    ome.images[0].pixels.physical_size_x = px_size
+    ome.images[0].pixels.physical_size_y = px_size
+    ome.images[0].pixels.physical_size_z = px_size * float(
+        snouty_metadata["voxel_aspect_ratio"]
+    )
+    ome.images[0].pixels.time_increment = time_increment(snouty_metadata)
+    ome.images[0].description = snouty_metadata["description"]
+    tifffile.tiffcomment(save_path, ome.to_xml())
+    return tifffile.memmap(save_path, mode="r+")
+
+
+def import_seconds(module):
+    # in a fresh interpreter, as the first file of a batch pays for it
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start)"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code])
+    return float(output)
+
+
+def run(fn, shape, num_files, tmp_dir):
+    start = time.perf_counter()
+    for idx in range(num_files):
+        save_path = os.path.join(tmp_dir, f"{fn.__name__}-{idx}.ome.tif")
+        im = fn("TCZYX", shape, SNOUTY_METADATA, save_path, "uint16")
+        del im
+    return (time.perf_counter() - start) / num_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument(
+        "--shape", type=int, nargs=5, default=(1, 2, 50, 128, 128)
+    )
+    args = parser.parse_args()
+    shape = tuple(args.shape)
+
+    print(f"import ome_types: {import_seconds('ome_types') * 1e3:8.1f} ms")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, fn in [
+            ("round trip", round_trip_allocate),
+            ("up front", allocate_memory_return_memmap),
+        ]:
+            seconds = run(fn, shape, args.files, tmp_dir)
+            print(f"{name:>10}: {seconds * 1e3:8.2f} ms per file")
+
+
+if __name__ == "__main__":
+    main()
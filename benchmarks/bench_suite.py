@@ -0,0 +1,246 @@
+"""Timings, throughput and peak memory of the reader, deshear and writer
+stages on synthetic Snouty directories.
+
+Every case runs in a fresh process, so its peak RSS is its own (setup such as
+loading the data it writes included). Throughput is the size of the skewed
+input over the best time.
+
+Usage: python benchmarks/bench_suite.py [--buffers N] [--volumes-per-buffer N]
+                                       [--channels N] [--shape Z Y X]
+                                       [--dtype DTYPE] [--workers N]
+                                       [--repeats N] [--cases NAME ...]
+                                       [--json PATH]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tifffile
+
+CASES = (
+    "open",
+    "load_full",
+    "deshear",
+    "deshear_lazy",
+    "write_ome_tif",
+    "write_ome_zarr",
+    "batch_ome_tif",
+    "batch_ome_zarr",
+)
+
+
+def make_acquisition(path, num_buffers, vols_per_buffer, num_c, shape, dtype):
+    # the same metadata the tests write, buffers are (VPB, Z, C, Y, X) with
+    # the 8 header rows included in Y
+    num_z, num_y, num_x = shape
+    os.makedirs(os.path.join(path, "data"))
+    os.makedirs(os.path.join(path, "metadata"))
+    channels = [str(488 + 73 * ch) for ch in range(num_c)]
+    needed_metadata = [
+        f"volumes_per_buffer: {vols_per_buffer}",
+        f"channels_per_slice: {channels}",
+        f"slices_per_volume: {num_z}",
+        "scan_step_size_px: 2",
+        "sample_px_um: 0.4",
+        "voxel_aspect_ratio: 2.5",
+        "volumes_per_s: 10",
+        "buffer_time_s: 1",
+        "delay_s: None",
+        "description: benchmark",
+    ]
+    with open(os.path.join(path, "metadata", "000000.txt"), "w") as f:
+        f.write("\n".join(needed_metadata) + "\n")
+    rng = np.random.default_rng(0)
+    buffer_shape = (vols_per_buffer, num_z, num_c, num_y + 8, num_x)
+    info = np.iinfo(dtype) if np.dtype(dtype).kind in "ui" else None
+    high = min(info.max, 4096) if info is not None else 1.0
+    for idx in range(num_buffers):
+        buffer = (rng.random(buffer_shape) * high).astype(dtype)
+        tifffile.imwrite(os.path.join(path, "data", f"{idx:06d}.tif"), buffer)
+
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _setup(case, snouty_dir, out_dir, workers):
+    # returns the function to time, everything it needs is loaded up front
+    from snouty_viewer import _writer
+    from snouty_viewer.batch import deskew_and_save
+    from snouty_viewer.deshear import ImInfo, PseudoImage
+    from snouty_viewer.im_loader import (
+        ImPathInfo,
+        _acquisition_cache,
+        load_full,
+        load_lazy,
+    )
+
+    def _open():
+        _acquisition_cache.clear()
+        index = os.path.join(snouty_dir, ".snouty_index")
+        if os.path.exists(index):
+            os.remove(index)
+        return load_lazy(ImPathInfo(snouty_dir))
+
+    if case == "open":
+        return _open
+    im_path_info = ImPathInfo(snouty_dir)
+    if case == "load_full":
+        return lambda: load_full(im_path_info, out_dir)
+    if case.startswith("batch_"):
+        output_format = case[len("batch_") :].replace("_", ".")
+        return lambda: deskew_and_save(
+            snouty_dir,
+            out_dir,
+            workers=workers,
+            resume=False,
+            output_format=output_format,
+        )
+
+    def _im_info():
+        return ImInfo(
+            PseudoImage(load_lazy(im_path_info)[0]), im_path_info.im_shape
+        )
+
+    if case == "deshear":
+        return lambda: _im_info().deshear_all_channels(
+            batch=True, workers=workers
+        )
+    if case == "deshear_lazy":
+        # what browsing every timepoint of a lazy layer costs
+        def _deshear_lazy():
+            im_info = _im_info()
+            im_info.deshear_all_channels(
+                show_multi=True, lazy=True, workers=workers
+            )
+            return np.asarray(im_info.displayed_images[0][0])
+
+        return _deshear_lazy
+    im_info = _im_info()
+    im_info.deshear_all_channels(batch=True, workers=workers)
+    attributes = {
+        "name": "benchmark",
+        "metadata": {"snouty_metadata": im_path_info.metadata},
+    }
+    if case == "write_ome_tif":
+        path = os.path.join(out_dir, "benchmark.ome.tif")
+        return lambda: _writer.write_single_image(
+            path, im_info.im_desheared, attributes
+        )
+    path = os.path.join(out_dir, "benchmark.ome.zarr")
+    return lambda: _writer.write_ome_zarr(
+        path, im_info.im_desheared, attributes
+    )
+
+
+def _clear(out_dir):
+    for name in os.listdir(out_dir):
+        path = os.path.join(out_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def run_case(case, snouty_dir, workers, repeats, results):
+    # reports back through the queue, a case that fails or lacks an
+    # optional dependency (zarr) is reported instead of hanging the suite
+    try:
+        with tempfile.TemporaryDirectory() as out_dir:
+            fn = _setup(case, snouty_dir, out_dir, workers)
+            best = np.inf
+            for _ in range(repeats):
+                start = time.perf_counter()
+                fn()
+                best = min(best, time.perf_counter() - start)
+                _clear(out_dir)
+    except ImportError as e:
+        results.put({"skipped": str(e)})
+        return
+    except Exception as e:
+        results.put({"error": repr(e)})
+        return
+    results.put({"seconds": best, "peak_rss": peak_rss()})
+
+
+def measure(case, snouty_dir, workers, repeats):
+    # a fresh process per case, so the peak RSS isn't that of an earlier one
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(
+        target=run_case, args=(case, snouty_dir, workers, repeats, results)
+    )
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--buffers", type=int, default=4)
+    parser.add_argument("--volumes-per-buffer", type=int, default=2)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument(
+        "--shape",
+        type=int,
+        nargs=3,
+        default=(64, 128, 256),
+        metavar=("Z", "Y", "X"),
+        help="skewed volume shape, without the header rows",
+    )
+    parser.add_argument("--dtype", default="uint16")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--json", help="also save the results here")
+    args = parser.parse_args()
+
+    # single and multi channel, a single timepoint and all of them
+    acquisitions = {}
+    for num_c in sorted({1, args.channels}):
+        acquisitions[(num_c, 1)] = (1, 1)
+        num_t = args.buffers * args.volumes_per_buffer
+        acquisitions[(num_c, num_t)] = (args.buffers, args.volumes_per_buffer)
+    itemsize = np.dtype(args.dtype).itemsize
+    header = f"{'case':>15} {'T':>4} {'C':>2} {'s':>8} {'MB/s':>8}"
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"{header} {'RSS MB':>8}")
+        for (num_c, num_t), (num_buffers, vpb) in acquisitions.items():
+            snouty_dir = os.path.join(tmp_dir, f"acq-c{num_c}-t{num_t}")
+            make_acquisition(
+                snouty_dir, num_buffers, vpb, num_c, args.shape, args.dtype
+            )
+            nbytes = num_t * num_c * int(np.prod(args.shape)) * itemsize
+            for case in args.cases:
+                result = measure(case, snouty_dir, args.workers, args.repeats)
+                row = {"case": case, "num_t": num_t, "num_c": num_c}
+                row.update(result)
+                rows.append(row)
+                if "seconds" not in result:
+                    message = result.get("skipped") or result["error"]
+                    print(f"{case:>15} {num_t:>4} {num_c:>2} {message}")
+                    continue
+                row["mb_per_s"] = nbytes / result["seconds"] / 1e6
+                print(
+                    f"{case:>15} {num_t:>4} {num_c:>2} "
+                    f"{result['seconds']:8.3f} {row['mb_per_s']:8.1f} "
+                    f"{result['peak_rss'] / 1e6:8.1f}"
+                )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
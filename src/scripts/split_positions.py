@@ -1,10 +1,28 @@
+import errno
 import os
 import re
 import shutil
 
+from snouty_viewer._parallel import run_tasks
+
+# how files are put into the position splits: copy duplicates them, the
+# others take no extra space (reflink only on filesystems with copy-on-write
+# clones such as Btrfs or XFS), falling back to copy where the filesystem
+# can't link them
+TRANSFER_MODES = ("copy", "hardlink", "symlink", "reflink")
+# Linux ioctl cloning the content of one file into another
+FICLONE = 0x40049409
+
 
 # Takes in a directory (hierarchy pos 1) of directories (hierarchy pos 2)
-def process_directory(directory, output_directory=None):
+def process_directory(
+    directory, output_directory=None, mode="copy", workers=1
+):
+    if mode not in TRANSFER_MODES:
+        raise ValueError(
+            f"Unknown transfer mode {mode!r}, expected one of "
+            f"{TRANSFER_MODES}"
+        )
     if output_directory is None:
         output_directory = directory
     # Create a new directory for position splits at hierarchy pos 1
@@ -14,17 +32,38 @@ def process_directory(directory, output_directory=None):
     os.makedirs(new_directory, exist_ok=True)
 
     # Iterate through all subdirectories at hierarchy pos 2
+    transfers = []
     for subdir in os.scandir(directory):
         if subdir.is_dir() and not subdir.name.endswith("-position_splits"):
             # Iterate through timepoints of each hierarchy pos 2 directory
-            process_subdir(subdir, new_directory)
+            transfers.extend(subdir_transfers(subdir, new_directory))
+    # files are transferred in parallel, the I/O releases the GIL
+    run_tasks(
+        transfer_file,
+        [(src, dst, mode) for src, dst in transfers],
+        workers,
+    )
+
+
+def process_subdir(subdir, new_directory, mode="copy", workers=1):
+    run_tasks(
+        transfer_file,
+        [
+            (src, dst, mode)
+            for src, dst in subdir_transfers(subdir, new_directory)
+        ],
+        workers,
+    )
 
 
-def process_subdir(subdir, new_directory):
+def subdir_transfers(subdir, new_directory):
+    # creates the timepoint directories and returns the (source, destination)
+    # of every file to put in them
     timepoint_pattern = re.compile(
         r"(\d+)_position(\d+)_timepoint(\d+)_burst(\d+)"
     )
     timepoint_directories = {}
+    transfers = []
 
     # For each of the three folders
     for folder in ["data", "metadata", "preview"]:
@@ -55,10 +94,45 @@ def process_subdir(subdir, new_directory):
                         )
                         timepoint_directories[timepoint] = dst_dir
 
-                    # Copy the file to the destination directory
-                    shutil.copy2(
-                        os.path.join(folder_path, file),
-                        os.path.join(
-                            timepoint_directories[timepoint], folder, file
-                        ),
+                    transfers.append(
+                        (
+                            os.path.join(folder_path, file),
+                            os.path.join(
+                                timepoint_directories[timepoint], folder, file
+                            ),
+                        )
                     )
+    return transfers
+
+
+def transfer_file(src, dst, mode="copy"):
+    # rerunning replaces what an earlier run put there, also a link to src
+    # itself, which copy2 would refuse to copy onto
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == "copy":
+        shutil.copy2(src, dst)
+        return dst
+    try:
+        if mode == "hardlink":
+            os.link(src, dst)
+        elif mode == "symlink":
+            os.symlink(os.path.abspath(src), dst)
+        else:
+            reflink(src, dst)
+    except OSError:
+        # e.g. another filesystem, or one without links or clones
+        if os.path.lexists(dst):
+            os.remove(dst)
+        shutil.copy2(src, dst)
+    return dst
+
+
+def reflink(src, dst):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, "reflinks need Linux", src)
+    with open(src, "rb") as f_src, open(dst, "wb") as f_dst:
+        fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+    shutil.copystat(src, dst)
@@ -1,6 +1,27 @@
 __version__ = "0.2.1"
 
-from ._reader import napari_get_reader
-from ._widget import native_view
+__all__ = (
+    "batch_deskew",
+    "deskew_and_save",
+    "napari_get_reader",
+    "native_view",
+)
 
-__all__ = ("napari_get_reader", "native_view")
+# resolved on first access, so the headless API (and the snouty-deskew
+# command) never import napari, Qt or magicgui
+_LAZY_ATTRIBUTES = {
+    "batch_deskew": "snouty_viewer.batch",
+    "deskew_and_save": "snouty_viewer.batch",
+    "napari_get_reader": "snouty_viewer._reader",
+    "native_view": "snouty_viewer._widget",
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,24 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# no third-party imports, so scripts that only move files can use these too
+
+
+def resolve_workers(workers):
+    # follows the num_t convention: -1 means use everything available
+    if workers is None or workers < 1:
+        return os.cpu_count() or 1
+    return workers
+
+
+def run_tasks(fn, tasks, workers=1):
+    workers = resolve_workers(workers)
+    if workers == 1 or len(tasks) < 2:
+        for task in tasks:
+            fn(*task)
+        return None
+    # numpy (and file I/O) releases the GIL, so threads are enough
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(lambda task: fn(*task), tasks):
+            pass
+    return None
@@ -1,16 +1,136 @@
+import json
 import os.path
 
-from snouty_viewer.im_loader import ImPathInfo, load_full
+# napari asks every reader plugin about every path it opens, so this module
+# only imports what is needed to answer; numpy, tifffile and zarr are
+# imported once a file is actually read
+from snouty_viewer.positions import split_virtual_path
+
+DESKEWED_SUFFIXES = (".ome.tif", ".ome.zarr")
 
 
 def napari_get_reader(path):
     path = os.path.abspath(path)
-    if not os.path.isdir(path):
+    if path.rstrip(os.sep).endswith(DESKEWED_SUFFIXES):
+        if is_deskewed_output(path.rstrip(os.sep)):
+            return deskewed_reader_function
+        return None
+    # a position of an acquisition directory, see positions.virtual_path
+    try:
+        snouty_dir = split_virtual_path(path)[0]
+    except ValueError:
+        return None
+    if not os.path.isdir(snouty_dir):
         return None
     return reader_function
 
 
+def is_deskewed_output(path):
+    # only the outputs of this plugin, named deskewed-* by the batch and
+    # carrying the Snouty metadata in OME-Zarr, other OME files are left to
+    # the readers that can open them
+    if os.path.basename(path).startswith("deskewed"):
+        return True
+    if not path.endswith(".ome.zarr"):
+        return False
+    for name in (".zattrs", "zarr.json"):
+        try:
+            with open(os.path.join(path, name)) as f:
+                attrs = json.load(f)
+        except (OSError, ValueError):
+            continue
+        # zarr v3 keeps the attributes in the array metadata
+        return "snouty_metadata" in attrs.get("attributes", attrs)
+    return False
+
+
 def reader_function(path):
+    from snouty_viewer.im_loader import ImPathInfo, load_lazy
+    from snouty_viewer.positions import load_index
+
+    # an acquisition of several positions opens as one layer per position
+    snouty_dir, position, timepoint = split_virtual_path(path)
+    if position is None and timepoint is None:
+        index = load_index(snouty_dir)
+        if len(index.positions()) > 1:
+            return [
+                load_lazy(ImPathInfo(position_path))[0]
+                for position_path in index.virtual_paths("position")
+            ]
     im_path_info = ImPathInfo(path)
-    im_tuple = load_full(im_path_info)
+    im_tuple = load_lazy(im_path_info)
     return im_tuple
+
+
+def open_levels(path, mode="r"):
+    import numpy as np
+    import tifffile
+
+    from snouty_viewer.im_loader import memmap_levels
+    from snouty_viewer.ome_zarr import open_ome_zarr
+
+    # pyramid levels of a deskewed output, full resolution first
+    if path.rstrip(os.sep).endswith(".ome.zarr"):
+        return open_ome_zarr(path, mode=mode)
+    # the writer saves layers as TZCYX and the batch as TCZYX, so every level
+    # is put in TCZYX order, as a view that keeps it memory-mapped
+    with tifffile.TiffFile(path) as tif:
+        level_axes = [level.axes for level in tif.series[0].levels]
+    levels = memmap_levels(path, mode=mode)
+    for idx, axes in enumerate(level_axes):
+        order = [axis for axis in "TCZYX" if axis in axes]
+        levels[idx] = np.transpose(
+            levels[idx], [axes.index(axis) for axis in order]
+        )
+    return levels
+
+
+def levels_data(levels):
+    # napari takes a list of arrays for a multiscale image
+    if len(levels) > 1:
+        return levels, {"multiscale": True}
+    return levels[0], {}
+
+
+def deskewed_reader_function(path):
+    import tifffile
+
+    from snouty_viewer.ome_metadata import read_snouty_metadata
+    from snouty_viewer.ome_zarr import read_attrs
+
+    path = os.path.abspath(path).rstrip(os.sep)
+    try:
+        levels = open_levels(path)
+    except ValueError:
+        # e.g. a compressed OME-TIFF, which can't be memory-mapped; returning
+        # None lets napari try its other readers
+        return None
+    data, add_kwargs = levels_data(levels)
+    metadata = {"path": path}
+    if path.endswith(".ome.zarr"):
+        attrs = read_attrs(path)
+        if "snouty_metadata" in attrs:
+            metadata["snouty_metadata"] = attrs["snouty_metadata"]
+        multiscales = attrs["multiscales"][0]
+        transform = multiscales["datasets"][0]["coordinateTransformations"]
+        scale = tuple(transform[0]["scale"][2:])
+        name = multiscales.get("name", "")
+    else:
+        with tifffile.TiffFile(path) as tif:
+            ome_xml = tif.ome_metadata
+        snouty_metadata = read_snouty_metadata(ome_xml)
+        if snouty_metadata is not None:
+            metadata["snouty_metadata"] = snouty_metadata
+        ome = tifffile.xml2dict(ome_xml)["OME"]
+        image = ome["Image"]
+        if isinstance(image, list):
+            image = image[0]
+        pixels = image["Pixels"]
+        scale = tuple(
+            float(pixels.get(f"PhysicalSize{axis}", 1)) for axis in "ZYX"
+        )
+        name = ""
+    add_kwargs["name"] = name or os.path.basename(path).split(".")[0]
+    add_kwargs["metadata"] = metadata
+    add_kwargs["scale"] = scale
+    return [(data, add_kwargs, "image")]
@@ -0,0 +1,377 @@
+import os
+
+import numpy as np
+import pytest
+import tifffile
+
+from snouty_viewer._tests.utils import expected_deskewed, make_snouty_dir
+from snouty_viewer.batch import batch_deskew, list_subdirectories, parse_size
+
+
+def test_parse_size():
+    assert parse_size(None) is None
+    assert parse_size(1000) == 1000
+    assert parse_size("8GB") == 8 * 1024**3
+    assert parse_size("1.5 MiB") == int(1.5 * 1024**2)
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_batch_deskew_reports_failures(tmp_path, processes):
+    buffers = {
+        name: [np.random.randint(0, 1000, (1, 4, 1, 16, 10)).astype(np.uint16)]
+        for name in ["acq0", "acq1"]
+    }
+    for name, acq_buffers in buffers.items():
+        make_snouty_dir(tmp_path / "in" / name, acq_buffers)
+    # a Snouty-looking directory without any buffers
+    make_snouty_dir(tmp_path / "in" / "broken", [buffers["acq0"][0]])
+    os.remove(tmp_path / "in" / "broken" / "data" / "000000.tif")
+    path_out = tmp_path / "out"
+    path_out.mkdir()
+
+    progress = []
+    results, failures = batch_deskew(
+        sorted(list_subdirectories(str(tmp_path / "in"))),
+        str(path_out),
+        processes=processes,
+        max_memory="1MB",
+        progress=lambda *args: progress.append(args),
+    )
+
+    assert [os.path.basename(d) for d in failures] == ["broken"]
+    assert len(results) == 2
+    assert sorted(num_done for _, _, num_done, _ in progress) == [1, 2, 3]
+    for name, acq_buffers in buffers.items():
+        np.testing.assert_array_equal(
+            tifffile.imread(str(path_out / f"deskewed-{name}.ome.tif")),
+            np.squeeze(expected_deskewed(acq_buffers)),
+        )
+
+
+def test_batch_deskew_resumes(tmp_path, monkeypatch):
+    from snouty_viewer.deshear import ImInfo
+
+    buffers = [
+        np.random.randint(0, 1000, (2, 4, 2, 16, 10)).astype(np.uint16)
+        for _ in range(2)
+    ]
+    make_snouty_dir(tmp_path / "in" / "acq", buffers, channels=("488", "561"))
+    snouty_dirs = list_subdirectories(str(tmp_path / "in"))
+    path_out = tmp_path / "out"
+    path_out.mkdir()
+    save_path = str(path_out / "deskewed-acq.ome.tif")
+
+    # crash while writing the third timepoint
+    deshear_timepoints = ImInfo.deshear_timepoints
+
+    def crash_at_t2(self, timepoints, *args):
+        if 2 in timepoints:
+            raise RuntimeError("power cut")
+        deshear_timepoints(self, timepoints, *args)
+
+    monkeypatch.setattr(ImInfo, "deshear_timepoints", crash_at_t2)
+    results, failures = batch_deskew(snouty_dirs, str(path_out))
+    assert list(failures) == snouty_dirs
+    monkeypatch.setattr(ImInfo, "deshear_timepoints", deshear_timepoints)
+
+    # mark the finished timepoints, a resumed run mustn't touch them again
+    written = tifffile.memmap(save_path, mode="r+")
+    written[:2] = 7
+    written.flush()
+    del written
+
+    results, failures = batch_deskew(snouty_dirs, str(path_out))
+    assert results == {snouty_dirs[0]: save_path}
+    expected = expected_deskewed(buffers)
+    deskewed = tifffile.imread(save_path)
+    assert (deskewed[:2] == 7).all()
+    np.testing.assert_array_equal(deskewed[2:], expected[2:])
+    assert not os.path.exists(f"{save_path}.progress.json")
+
+    # a finished directory is skipped, until its buffers change
+    mtime = os.path.getmtime(save_path)
+    batch_deskew(snouty_dirs, str(path_out))
+    assert os.path.getmtime(save_path) == mtime
+    tifffile.imwrite(
+        str(tmp_path / "in" / "acq" / "data" / "000001.tif"), buffers[0]
+    )
+    batch_deskew(snouty_dirs, str(path_out))
+    np.testing.assert_array_equal(
+        tifffile.imread(save_path),
+        expected_deskewed([buffers[0], buffers[0]]),
+    )
+
+
+def test_batch_deskew_redoes_other_options(tmp_path, monkeypatch):
+    from snouty_viewer.deshear import ImInfo
+
+    buffers = [np.random.randint(0, 1000, (2, 4, 1, 16, 10)).astype(np.uint16)]
+    make_snouty_dir(tmp_path / "in" / "acq", buffers)
+    snouty_dirs = list_subdirectories(str(tmp_path / "in"))
+    path_out = tmp_path / "out"
+    path_out.mkdir()
+    save_path = str(path_out / "deskewed-acq.ome.tif")
+    batch_deskew(snouty_dirs, str(path_out))
+
+    # a finished output isn't kept for a different dtype or binning
+    results, _ = batch_deskew(snouty_dirs, str(path_out), dtype="float32")
+    assert results == {snouty_dirs[0]: save_path}
+    assert tifffile.imread(save_path).dtype == np.float32
+    batch_deskew(snouty_dirs, str(path_out), dtype="float32", bin_xy=2)
+    assert tifffile.imread(save_path).shape[-1] == 5
+
+    # nor is another format, whose output doesn't exist yet
+    results, _ = batch_deskew(
+        snouty_dirs, str(path_out), output_format="ome.zarr"
+    )
+    assert results[snouty_dirs[0]].endswith(".ome.zarr")
+    assert os.path.isdir(results[snouty_dirs[0]])
+
+    # and an interrupted output is restarted, not continued, with other ones
+    deshear_timepoints = ImInfo.deshear_timepoints
+
+    def crash_at_t1(self, timepoints, *args):
+        if 1 in timepoints:
+            raise RuntimeError("power cut")
+        deshear_timepoints(self, timepoints, *args)
+
+    monkeypatch.setattr(ImInfo, "deshear_timepoints", crash_at_t1)
+    batch_deskew(snouty_dirs, str(path_out), max_memory=1)
+    monkeypatch.setattr(ImInfo, "deshear_timepoints", deshear_timepoints)
+    assert os.path.exists(f"{save_path}.progress.json")
+    written = tifffile.memmap(save_path, mode="r+")
+    written[:1] = 7
+    written.flush()
+    del written
+    batch_deskew(snouty_dirs, str(path_out), dtype="float32")
+    assert tifffile.imread(save_path).dtype == np.float32
+    np.testing.assert_array_equal(
+        tifffile.imread(save_path), np.squeeze(expected_deskewed(buffers))
+    )
+
+
+def test_batch_deskew_ome_zarr(tmp_path):
+    zarr = pytest.importorskip("zarr")
+
+    buffers = [np.random.randint(1, 1000, (2, 4, 2, 16, 10)).astype(np.uint16)]
+    make_snouty_dir(
+        tmp_path / "in" / "acq",
+        buffers,
+        channels=("488", "561"),
+        scan_step_size_px=6,
+    )
+    path_out = tmp_path / "out"
+    path_out.mkdir()
+
+    results, failures = batch_deskew(
+        list_subdirectories(str(tmp_path / "in")),
+        str(path_out),
+        workers=2,
+        output_format="ome.zarr",
+        chunks=(2, 8, 8),
+    )
+
+    assert not failures
+    save_path = str(path_out / "deskewed-acq.ome.zarr")
+    assert list(results.values()) == [save_path]
+    im = zarr.open_array(f"{save_path}/0", mode="r")
+    assert im.chunks == (1, 1, 2, 8, 8)
+    np.testing.assert_array_equal(
+        im[:], expected_deskewed(buffers, scan_step_size_px=6)
+    )
+    # chunks holding only deshear padding are never written
+    num_chunks = np.prod([-(-s // c) for s, c in zip(im.shape, im.chunks)])
+    chunk_files = [
+        path
+        for path in (path_out / "deskewed-acq.ome.zarr" / "0").rglob("*")
+        if path.is_file() and not path.name.startswith(".")
+    ]
+    assert len(chunk_files) < num_chunks
+
+
+@pytest.mark.parametrize("output_format", ["ome.tif", "ome.zarr"])
+def test_batch_deskew_pyramid(tmp_path, output_format):
+    if output_format == "ome.zarr":
+        pytest.importorskip("zarr")
+    from snouty_viewer import napari_get_reader
+
+    buffers = [np.random.randint(1, 1000, (2, 4, 2, 42, 24)).astype(np.uint16)]
+    make_snouty_dir(tmp_path / "in" / "acq", buffers, channels=("488", "561"))
+    path_out = tmp_path / "out"
+    path_out.mkdir()
+
+    results, failures = batch_deskew(
+        list_subdirectories(str(tmp_path / "in")),
+        str(path_out),
+        output_format=output_format,
+        pyramid_levels=3,
+    )
+
+    assert not failures
+    save_path = str(path_out / f"deskewed-acq.{output_format}")
+    reader = napari_get_reader(save_path)
+    [(levels, add_kwargs, layer_type)] = reader(save_path)
+    assert add_kwargs["multiscale"]
+    np.testing.assert_allclose(add_kwargs["scale"], [1.0, 0.4, 0.4])
+    expected = expected_deskewed(buffers)
+    assert [level.shape[-2:] for level in levels] == [
+        expected.shape[-2:],
+        (20, 12),
+        (10, 6),
+    ]
+    np.testing.assert_array_equal(levels[0][:], expected)
+    level_1 = expected.reshape(2, 2, 4, 20, 2, 12, 2).mean(axis=(-3, -1))
+    np.testing.assert_array_equal(levels[1][:], np.rint(level_1))
+
+
+@pytest.mark.parametrize("output_format", ["ome.tif", "ome.zarr"])
+def test_batch_deskew_max_memory(tmp_path, output_format):
+    if output_format == "ome.zarr":
+        pytest.importorskip("zarr")
+    from snouty_viewer import napari_get_reader
+
+    buffers = [np.random.randint(1, 1000, (2, 8, 2, 24, 16)).astype(np.uint16)]
+    make_snouty_dir(tmp_path / "in" / "acq", buffers, channels=("488", "561"))
+    levels = {}
+    for max_memory in [None, 10_000]:
+        path_out = tmp_path / f"out-{max_memory}"
+        path_out.mkdir()
+        # a budget smaller than a timepoint splits it into z-bands
+        results, failures = batch_deskew(
+            list_subdirectories(str(tmp_path / "in")),
+            str(path_out),
+            workers=2,
+            max_memory=max_memory,
+            output_format=output_format,
+            chunks=(2, 8, 8),
+            pyramid_levels=3,
+        )
+        assert not failures
+        [save_path] = results.values()
+        [(data, _, _)] = napari_get_reader(save_path)(save_path)
+        levels[max_memory] = [np.asarray(level[:]) for level in data]
+
+    np.testing.assert_array_equal(levels[None][0], expected_deskewed(buffers))
+    for level, expected in zip(levels[10_000], levels[None]):
+        np.testing.assert_array_equal(level, expected)
+
+
+def test_batch_deskew_isotropic(tmp_path):
+    from snouty_viewer import napari_get_reader
+    from snouty_viewer.deshear import deshear_resample
+
+    buffers = [np.random.randint(1, 1000, (2, 4, 1, 16, 10)).astype(np.uint16)]
+    make_snouty_dir(tmp_path / "in" / "acq", buffers, scan_step_size_px=1.5)
+    path_out = tmp_path / "out"
+    path_out.mkdir()
+
+    results, failures = batch_deskew(
+        list_subdirectories(str(tmp_path / "in")),
+        str(path_out),
+        subpixel=True,
+        isotropic=True,
+    )
+
+    assert not failures
+    [save_path] = results.values()
+    [(data, add_kwargs, _)] = napari_get_reader(save_path)(save_path)
+    # 4 planes 2.5 pixels apart resampled to 1 pixel, a 4.5 row shear
+    assert data.shape == (2, 8, 8 + 5, 10)
+    np.testing.assert_allclose(add_kwargs["scale"], [0.4, 0.4, 0.4])
+    volume = np.squeeze(buffers[0][1], axis=1)[:, 8:]
+    np.testing.assert_array_equal(
+        data[1], deshear_resample(volume, 1.5, 13, z_scale=2.5)
+    )
+
+
+def test_batch_deskew_coverslip(tmp_path):
+    pytest.importorskip("zarr")
+    from snouty_viewer import napari_get_reader
+    from snouty_viewer.coverslip import rotate_to_coverslip
+
+    buffers = [np.random.randint(1, 1000, (2, 4, 1, 16, 10)).astype(np.uint16)]
+    make_snouty_dir(tmp_path / "in" / "acq", buffers)
+    path_out = tmp_path / "out"
+    path_out.mkdir()
+
+    # a budget below a timepoint, so the volumes are written in z-bands
+    results, failures = batch_deskew(
+        list_subdirectories(str(tmp_path / "in")),
+        str(path_out),
+        output_format="ome.zarr",
+        max_memory=2000,
+        coverslip=True,
+    )
+
+    assert not failures
+    [save_path] = results.values()
+    [(data, add_kwargs, _)] = napari_get_reader(save_path)(save_path)
+    volume = np.squeeze(buffers[0][1], axis=1)[:, 8:]
+    expected = rotate_to_coverslip(volume, 2, 2.5)
+    # OME-Zarr outputs keep their channel axis
+    assert data.shape == (2, 1) + expected.shape
+    np.testing.assert_allclose(add_kwargs["scale"], [0.4, 0.4, 0.4])
+    np.testing.assert_array_equal(data[1, 0], expected)
+
+
+def test_batch_deskew_crop(tmp_path):
+    from snouty_viewer import napari_get_reader
+
+    buffers = [np.random.randint(1, 1000, (2, 4, 1, 16, 10)).astype(np.uint16)]
+    make_snouty_dir(tmp_path / "in" / "acq", buffers)
+    path_out = tmp_path / "out"
+    path_out.mkdir()
+
+    results, failures = batch_deskew(
+        list_subdirectories(str(tmp_path / "in")),
+        str(path_out),
+        crop="t=1:2,x=2:8",
+        auto_crop=True,
+    )
+
+    assert not failures
+    [save_path] = results.values()
+    [(data, _, _)] = napari_get_reader(save_path)(save_path)
+    # planes shifted by up to 6 rows of 8 share rows 6 and 7
+    assert data.shape == (4, 2, 6)
+    expected = expected_deskewed(buffers)[1]
+    np.testing.assert_array_equal(data, expected[0, :, 6:8, 2:8])
+
+
+@pytest.mark.parametrize("output_format", ["ome.tif", "ome.zarr"])
+def test_batch_deskew_binned_uint8(tmp_path, output_format):
+    if output_format == "ome.zarr":
+        pytest.importorskip("zarr")
+    from snouty_viewer import napari_get_reader
+    from snouty_viewer.reduction import bin_band, convert, sample_limits
+
+    buffers = [np.random.randint(1, 1000, (3, 4, 1, 16, 10)).astype(np.uint16)]
+    make_snouty_dir(tmp_path / "in" / "acq", buffers)
+    path_out = tmp_path / "out"
+    path_out.mkdir()
+
+    results, failures = batch_deskew(
+        list_subdirectories(str(tmp_path / "in")),
+        str(path_out),
+        output_format=output_format,
+        max_memory=2000,
+        bin_z=2,
+        bin_xy=2,
+        dtype="uint8",
+        percentiles=(1, 99),
+    )
+
+    assert not failures
+    [save_path] = results.values()
+    [(data, add_kwargs, _)] = napari_get_reader(save_path)(save_path)
+    data = np.asarray(data).reshape(3, 2, 7, 5)
+    assert data.dtype == np.uint8
+    np.testing.assert_allclose(add_kwargs["scale"], [2.0, 0.8, 0.8])
+    # scaled from the first, middle and last timepoints
+    raw = np.squeeze(buffers[0], axis=2)[..., 8:, :]
+    limits = sample_limits(raw, (1, 99))
+    binned = bin_band(expected_deskewed(buffers)[2, 0, :, :14], 2, 2)
+    expected = convert(binned, np.uint8, limits)
+    np.testing.assert_array_equal(data[2], expected)
@@ -0,0 +1,32 @@
+from snouty_viewer.chunking import block_length, plan_blocks
+
+
+def test_block_length():
+    assert block_length(10, 100) == 10
+    assert block_length(10, 100, max_memory=350) == 3
+    assert block_length(10, 100, max_memory=350, multiple=2) == 2
+    # never fewer than one multiple, even over budget
+    assert block_length(10, 100, max_memory=50, multiple=4) == 4
+    assert block_length(3, 100, max_memory=10**6) == 3
+
+
+def test_plan_blocks():
+    # one block per timepoint without a budget
+    assert plan_blocks(3, 8, 100) == [
+        (slice(t, t + 1), slice(0, 8)) for t in range(3)
+    ]
+    # timepoints are grouped while they fit
+    assert plan_blocks(5, 8, 100, max_memory=250) == [
+        (slice(0, 2), slice(0, 8)),
+        (slice(2, 4), slice(0, 8)),
+        (slice(4, 5), slice(0, 8)),
+    ]
+    assert plan_blocks(5, 8, 100, max_memory=250, start_t=3) == [
+        (slice(3, 5), slice(0, 8)),
+    ]
+    # a timepoint that doesn't fit is split into aligned z-bands
+    assert plan_blocks(2, 8, 800, max_memory=300, z_multiple=2) == [
+        (slice(t, t + 1), z_slice)
+        for t in range(2)
+        for z_slice in [slice(0, 2), slice(2, 4), slice(4, 6), slice(6, 8)]
+    ]
@@ -0,0 +1,53 @@
+import json
+import subprocess
+import sys
+
+import numpy as np
+import tifffile
+
+from snouty_viewer._tests.utils import expected_deskewed, make_snouty_dir
+from snouty_viewer.cli import main
+
+
+def test_cli_deskews_directories(tmp_path, capsys):
+    buffers = {
+        name: [np.random.randint(0, 1000, (1, 4, 1, 16, 10)).astype(np.uint16)]
+        for name in ["acq0", "acq1"]
+    }
+    for name, acq_buffers in buffers.items():
+        make_snouty_dir(tmp_path / "in" / name, acq_buffers)
+    path_out = tmp_path / "out"
+    path_out.mkdir()
+
+    # a directory of acquisitions, or acquisitions directly
+    assert main([str(tmp_path / "in"), "-o", str(path_out), "-w", "2"]) == 0
+    out = capsys.readouterr().out
+    assert "[2/2]" in out
+    # followed by where the time went
+    assert "deshear" in out and "wall time" in out
+    for name, acq_buffers in buffers.items():
+        np.testing.assert_array_equal(
+            tifffile.imread(str(path_out / f"deskewed-{name}.ome.tif")),
+            np.squeeze(expected_deskewed(acq_buffers)),
+        )
+    stats_path = tmp_path / "stats.json"
+    profile_path = tmp_path / "run.prof"
+    args = ["-q", "--no-resume", "--stats", str(stats_path)]
+    args += ["--profile", str(profile_path)]
+    assert main([str(tmp_path / "in" / "acq0")] + args) == 0
+    with open(stats_path) as f:
+        stages = json.load(f)["stages"]
+    assert stages["deshear"]["bytes"] == 4 * (8 + 2 * 3) * 10 * 2
+    assert profile_path.exists()
+    assert (tmp_path / "in" / "acq0" / "deskewed-acq0.ome.tif").exists()
+    assert main([str(tmp_path / "out")]) == 1
+
+
+def test_cli_does_not_import_napari():
+    code = (
+        "import sys, snouty_viewer.cli; "
+        "print(sorted({m.split('.')[0] for m in sys.modules} & "
+        "{'napari', 'magicgui', 'qtpy', 'PyQt5'}))"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code], text=True)
+    assert output.strip() == "[]"
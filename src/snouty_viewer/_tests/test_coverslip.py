@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from snouty_viewer.coverslip import (
+    coverslip_rows,
+    coverslip_shape,
+    rotate_to_coverslip,
+    tilt,
+)
+
+
+def linear_volume(num_z, num_y, num_x, step, aspect):
+    # a raw volume of 0.5 z + 0.25 y + x in coverslip coordinates, which
+    # bilinear interpolation reproduces exactly
+    angle = tilt(step, aspect)
+    z, y, x = np.meshgrid(
+        np.arange(num_z), np.arange(num_y), np.arange(num_x), indexing="ij"
+    )
+    z_out = y * np.sin(angle)
+    y_out = z * aspect / np.sin(angle) + y * np.cos(angle)
+    return (0.5 * z_out + 0.25 * y_out + x).astype(np.float32)
+
+
+@pytest.mark.parametrize("step, aspect", [(2, 2.5), (1.5, 3), (3, 1)])
+def test_rotate_to_coverslip_linear(step, aspect):
+    num_z, num_y, num_x = 6, 12, 3
+    im_volume = linear_volume(num_z, num_y, num_x, step, aspect)
+
+    im_rotated = rotate_to_coverslip(im_volume, step, aspect)
+
+    assert im_rotated.shape[:2] == coverslip_shape(num_z, num_y, step, aspect)
+    assert im_rotated.shape[2] == num_x
+    angle = tilt(step, aspect)
+    k, j, x = np.meshgrid(*map(np.arange, im_rotated.shape), indexing="ij")
+    z_raw = (j * np.sin(angle) - k * np.cos(angle)) / aspect
+    inside = (z_raw > -1e-6) & (z_raw < num_z - 1 + 1e-6)
+    np.testing.assert_allclose(
+        im_rotated[inside], (0.5 * k + 0.25 * j + x)[inside], atol=1e-4
+    )
+    np.testing.assert_array_equal(im_rotated[~inside], 0)
+
+
+def test_rotate_to_coverslip_bands():
+    im_volume = np.random.randint(0, 1000, (5, 14, 4)).astype(np.uint16)
+    im_rotated = rotate_to_coverslip(im_volume, 2, 2.5)
+
+    bands = [
+        rotate_to_coverslip(im_volume, 2, 2.5, slice(start, start + 3))
+        for start in range(0, im_rotated.shape[0], 3)
+    ]
+
+    assert im_rotated.dtype == np.uint16
+    np.testing.assert_array_equal(np.concatenate(bands), im_rotated)
+
+
+def test_rotate_to_coverslip_rows():
+    # a band of rows is the same rows of the whole planes
+    im_volume = np.random.randint(0, 1000, (20, 30, 5)).astype(np.uint16)
+    im_rotated = rotate_to_coverslip(im_volume, 2, 2.5)
+    for z_slice, y_slice in [
+        (slice(2, 7), slice(5, 12)),
+        (slice(10, 20), slice(20, 45)),
+        (slice(None), slice(30, None)),
+    ]:
+        np.testing.assert_array_equal(
+            rotate_to_coverslip(im_volume, 2, 2.5, z_slice, y_slice),
+            im_rotated[z_slice, y_slice],
+        )
+    im_volume = np.ones((6, 14, 2), np.float32)
+    im_rotated = rotate_to_coverslip(im_volume, 2, 2.5)
+    for z_slice in [slice(None), slice(2, 7)]:
+        start, stop = coverslip_rows(6, 14, 2, 2.5, z_slice)
+        covered = np.all(np.isclose(im_rotated[z_slice], 1), axis=(0, 2))
+        assert covered[start:stop].all()
+        assert not covered[:start].any() and not covered[stop:].any()
@@ -0,0 +1,262 @@
+import numpy as np
+import pytest
+
+from snouty_viewer.deshear import (
+    ImInfo,
+    covered_rows,
+    deshear_band,
+    deshear_resample,
+    deshear_volume,
+    resampled_shape,
+)
+
+
+def reference_deshear(im_volume, scan_step_size_px):
+    num_z, num_y, num_x = im_volume.shape
+    max_deshear_shift = int(np.rint(scan_step_size_px * (num_z - 1)))
+    im_desheared = np.zeros(
+        (num_z, num_y + max_deshear_shift, num_x), im_volume.dtype
+    )
+    for z in range(num_z):
+        shift = int(np.rint(z * scan_step_size_px))
+        im_desheared[z, shift : (shift + num_y), :] = im_volume[z]
+    return im_desheared
+
+
+@pytest.mark.parametrize("scan_step_size_px", [0, 1, 3, 1.5])
+@pytest.mark.parametrize("num_z", [1, 2, 7])
+def test_deshear_volume_matches_reference(scan_step_size_px, num_z):
+    im_volume = np.random.randint(1, 1000, (num_z, 9, 5)).astype(np.uint16)
+    expected = reference_deshear(im_volume, scan_step_size_px)
+    max_deshear_shift = expected.shape[1] - 9
+
+    np.testing.assert_array_equal(
+        deshear_volume(im_volume, scan_step_size_px, max_deshear_shift),
+        expected,
+    )
+
+    # writing into a dirty output has to clear the padding
+    im_desheared = np.full(expected.shape, 7, np.uint16)
+    deshear_volume(
+        im_volume, scan_step_size_px, max_deshear_shift, im_desheared
+    )
+    np.testing.assert_array_equal(im_desheared, expected)
+
+    # non-contiguous outputs (e.g. a channel of a TCZYX array) work too
+    im_desheared = np.full((2,) + expected.shape, 7, np.uint16)[..., ::2]
+    deshear_volume(
+        im_volume[..., ::2],
+        scan_step_size_px,
+        max_deshear_shift,
+        im_desheared[1],
+    )
+    np.testing.assert_array_equal(im_desheared[1], expected[..., ::2])
+
+
+def interpolated_deshear(im_volume, scan_step_size_px):
+    # each column shifted by np.interp, zero outside the plane
+    num_z, num_y, num_x = im_volume.shape
+    num_y_out = resampled_shape(num_z, num_y, scan_step_size_px)[1]
+    im_desheared = np.zeros((num_z, num_y_out, num_x))
+    padded = np.pad(im_volume.astype(float), [(0, 0), (1, 1), (0, 0)])
+    for z in range(num_z):
+        positions = np.arange(num_y_out) - z * scan_step_size_px + 1
+        for x in range(num_x):
+            im_desheared[z, :, x] = np.interp(
+                positions, np.arange(num_y + 2), padded[z, :, x], right=0
+            )
+    return im_desheared
+
+
+@pytest.mark.parametrize("scan_step_size_px", [0, 1, 3])
+def test_deshear_resample_integer_steps_match(scan_step_size_px):
+    im_volume = np.random.randint(1, 1000, (7, 9, 5)).astype(np.uint16)
+    num_y_out = resampled_shape(7, 9, scan_step_size_px)[1]
+    np.testing.assert_array_equal(
+        deshear_resample(im_volume, scan_step_size_px, num_y_out),
+        reference_deshear(im_volume, scan_step_size_px),
+    )
+
+
+@pytest.mark.parametrize("scan_step_size_px", [0.5, 1.3, 2.75])
+def test_deshear_resample_subpixel(scan_step_size_px):
+    im_volume = np.random.random((6, 9, 4)).astype(np.float32)
+    num_y_out = resampled_shape(6, 9, scan_step_size_px)[1]
+    expected = interpolated_deshear(im_volume, scan_step_size_px)
+    np.testing.assert_allclose(
+        deshear_resample(im_volume, scan_step_size_px, num_y_out),
+        expected,
+        atol=1e-5,
+    )
+    # a band of planes is the same planes of the whole volume
+    np.testing.assert_allclose(
+        deshear_resample(
+            im_volume, scan_step_size_px, num_y_out, z_slice=slice(2, 4)
+        ),
+        expected[2:4],
+        atol=1e-5,
+    )
+
+
+def test_deshear_resample_isotropic():
+    # planes of a constant value z, unsheared, so output plane k is k / 2.5
+    im_volume = np.broadcast_to(
+        np.arange(5, dtype=np.float32)[:, None, None], (5, 3, 2)
+    )
+    assert resampled_shape(5, 3, 0, z_scale=2.5) == (11, 3)
+    im_resampled = deshear_resample(im_volume, 0, 3, z_scale=2.5)
+    np.testing.assert_allclose(im_resampled[:, 1, 1], np.arange(11) / 2.5)
+    # integer outputs are rounded
+    im_resampled = deshear_resample(
+        (im_volume * 10).astype(np.uint16), 0, 3, z_scale=2.5
+    )
+    np.testing.assert_array_equal(
+        im_resampled[:, 0, 0], np.rint(np.arange(11) * 4)
+    )
+
+
+@pytest.mark.parametrize("scan_step_size_px", [2, 1.3])
+def test_deshear_y_slice(scan_step_size_px):
+    # a band of rows is the same rows of the whole planes
+    im_volume = np.random.randint(1, 1000, (6, 9, 4)).astype(np.uint16)
+    num_y_out = resampled_shape(6, 9, scan_step_size_px, 1.5)[1]
+    expected = deshear_resample(im_volume, scan_step_size_px, num_y_out, 1.5)
+    for y_slice in [slice(0, 5), slice(4, 11), slice(12, num_y_out)]:
+        np.testing.assert_array_equal(
+            deshear_resample(
+                im_volume,
+                scan_step_size_px,
+                num_y_out,
+                1.5,
+                slice(1, 6),
+                y_slice,
+            ),
+            expected[1:6, y_slice],
+        )
+    expected = reference_deshear(im_volume, 2)
+    np.testing.assert_array_equal(
+        deshear_band(im_volume, 2, 10, slice(1, 4), slice(3, 12)),
+        expected[1:4, 3:12],
+    )
+
+
+@pytest.mark.parametrize("scan_step_size_px", [2, 1.3])
+def test_covered_rows(scan_step_size_px):
+    num_y_out = resampled_shape(6, 12, scan_step_size_px, 1.5)[1]
+    im_volume = np.ones((6, 12, 2), np.float32)
+    im_desheared = deshear_resample(
+        im_volume, scan_step_size_px, num_y_out, 1.5
+    )
+    for z_slice in [slice(None), slice(2, 5)]:
+        start, stop = covered_rows(6, 12, scan_step_size_px, 1.5, z_slice)
+        covered = np.all(np.isclose(im_desheared[z_slice], 1), axis=(0, 2))
+        # every covered row, and only those
+        assert covered[start:stop].all()
+        assert not covered[:start].any() and not covered[stop:].any()
+
+
+def test_im_info_crop():
+    from snouty_viewer.deshear import PseudoImage
+
+    data = np.random.randint(1, 1000, (3, 2, 4, 8, 10)).astype(np.uint16)
+    metadata = {
+        "scan_step_size_px": "2",
+        "voxel_aspect_ratio": "2.5",
+        "sample_px_um": "0.4",
+        "channels_per_slice": "['488', '561']",
+    }
+    im = PseudoImage(
+        (data, {"metadata": {"snouty_metadata": metadata}, "name": "acq"})
+    )
+    im_info = ImInfo(im)
+    im_info.deshear_all_channels(batch=True)
+    full = im_info.im_desheared
+
+    im_info = ImInfo(im, crop="t=1:,c=1:2,z=1:3,x=2:7", auto_crop=True)
+    # planes 1 and 2 are shifted by 2 and 4 rows, so share rows 4 to 10
+    assert im_info.im_desheared_shape == (2, 1, 2, 6, 5)
+    assert im_info.wavelengths == ["561"]
+    assert im_info.metadata["snouty_metadata"]["channels_per_slice"] == (
+        "['561']"
+    )
+    np.testing.assert_allclose(im_info.translate, (2.5 * 0.4, 4 * 0.4, 0.8))
+    im_info.deshear_all_channels(batch=True)
+    np.testing.assert_array_equal(
+        im_info.im_desheared, full[1:, 1, 1:3, 4:10, 2:7]
+    )
+    # lazily too
+    im_info = ImInfo(im, crop={"C": (1, 2), "Y": (3, 9)})
+    im_info.deshear_all_channels(batch=True, lazy=True, show_multi=True)
+    np.testing.assert_array_equal(
+        np.asarray(im_info.displayed_images[0][0][2, 0]),
+        full[2, 1, :, 3:9],
+    )
+
+
+@pytest.mark.parametrize("subpixel", [False, True])
+@pytest.mark.parametrize("coverslip", [False, True])
+def test_im_info_auto_crop_matches_full(subpixel, coverslip):
+    from snouty_viewer.deshear import PseudoImage
+
+    data = np.random.randint(0, 1000, (20, 30, 5)).astype(np.uint16)
+    metadata = {"scan_step_size_px": "1.3", "voxel_aspect_ratio": "2.5"}
+    im = PseudoImage(
+        (data, {"metadata": {"snouty_metadata": metadata}, "name": "acq"})
+    )
+    kwargs = {"subpixel": subpixel, "coverslip": coverslip}
+    im_info = ImInfo(im, **kwargs)
+    im_info.deshear_all_channels(batch=True)
+    full = im_info.im_desheared
+
+    im_info = ImInfo(im, crop="z=3:-2,x=1:4", auto_crop=True, **kwargs)
+    im_info.deshear_all_channels(batch=True)
+    z_slice, y_slice, x_slice = im_info.roi[2:]
+    assert y_slice.start > 0
+    np.testing.assert_array_equal(
+        im_info.im_desheared, full[z_slice, y_slice, x_slice]
+    )
+
+
+def test_im_info_binned_lazy():
+    from snouty_viewer.deshear import PseudoImage
+
+    data = np.random.randint(1, 1000, (2, 5, 8, 11)).astype(np.uint16)
+    metadata = {"scan_step_size_px": "1", "sample_px_um": "0.4"}
+    im = PseudoImage(
+        (data, {"metadata": {"snouty_metadata": metadata}, "name": "acq"})
+    )
+    kwargs = {"bin_z": 2, "bin_xy": 3, "bin_method": "sum", "dtype": "uint8"}
+    im_info = ImInfo(im, **kwargs)
+    # leftover planes, rows and columns are dropped
+    assert im_info.im_desheared_shape == (2, 1, 2, 4, 3)
+    np.testing.assert_allclose(im_info.scale, (0.8, 1.2, 1.2))
+    assert len(im_info.limits) == 1
+    im_info.deshear_all_channels(batch=True)
+    lazy_info = ImInfo(im, **kwargs)
+    lazy_info.deshear_all_channels(lazy=True)
+    [(lazy, add_kwargs, _)] = lazy_info.displayed_images
+    assert lazy.dtype == np.uint8
+    np.testing.assert_array_equal(np.asarray(lazy[1]), im_info.im_desheared[1])
+
+
+def test_im_info_summed_uint8_keeps_range():
+    from snouty_viewer.deshear import PseudoImage
+
+    data = np.random.randint(0, 1000, (2, 6, 8, 12)).astype(np.uint16)
+    metadata = {"scan_step_size_px": "1"}
+    im = PseudoImage(
+        (data, {"metadata": {"snouty_metadata": metadata}, "name": "acq"})
+    )
+    outputs = {}
+    for bin_method in ["mean", "sum"]:
+        im_info = ImInfo(
+            im, bin_z=2, bin_xy=2, bin_method=bin_method, dtype="uint8"
+        )
+        im_info.deshear_all_channels(batch=True)
+        outputs[bin_method] = im_info.im_desheared
+    # the limits of sums are those of the means times the bin size
+    assert im_info.limits[0][1] > 8 * 900
+    np.testing.assert_allclose(
+        outputs["sum"].astype(int), outputs["mean"].astype(int), atol=1
+    )
+    assert (outputs["sum"] < 255).mean() > 0.9
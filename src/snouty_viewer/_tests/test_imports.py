@@ -0,0 +1,56 @@
+import subprocess
+import sys
+
+import pytest
+
+# napari imports the reader on every file it opens, and the package itself
+# to find its manifest, so neither may pull these in
+HEAVY_MODULES = {
+    "magicgui",
+    "napari",
+    "numpy",
+    "ome_types",
+    "qtpy",
+    "tifffile",
+    "zarr",
+}
+# cumulative import time, far above what the light modules take but below a
+# single heavy dependency
+IMPORT_BUDGET_US = 100_000
+
+
+def import_times(module):
+    # {module: cumulative microseconds} of everything `import module` loads,
+    # leaving out what the interpreter imported at startup
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        if name == "site":
+            times = {}
+            continue
+        try:
+            times[name] = int(cumulative)
+        except ValueError:
+            # the header line
+            continue
+    return times
+
+
+@pytest.mark.parametrize(
+    "module",
+    ["snouty_viewer", "snouty_viewer._reader", "scripts.split_positions"],
+)
+def test_import_budget(module):
+    times = import_times(module)
+    heavy = {name.split(".")[0] for name in times} & HEAVY_MODULES
+    assert not heavy
+    assert times[module] < IMPORT_BUDGET_US
@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import tifffile
+
+from snouty_viewer._tests.utils import expected_deskewed, make_snouty_dir
+from snouty_viewer.live import LiveAcquisition
+
+
+def test_live_acquisition_grows(tmp_path):
+    buffers = [
+        np.random.randint(0, 1000, (2, 4, 2, 16, 10)).astype(np.uint16)
+        for _ in range(3)
+    ]
+    make_snouty_dir(tmp_path, buffers[:1], channels=("488", "561"))
+    live = LiveAcquisition(str(tmp_path))
+    multichannel = live.layer_data[0][0]
+    assert multichannel.shape[:2] == (2, 2)
+    first_volume = multichannel.volume(1, 0)
+    assert not live.poll()
+
+    # a buffer that is only partly written isn't shown yet
+    tifffile.imwrite(str(tmp_path / "data" / "000001.tif"), buffers[1])
+    with open(tmp_path / "data" / "000001.tif", "rb") as f:
+        header = f.read(os.path.getsize(tmp_path / "data" / "000000.tif") // 2)
+    with open(tmp_path / "data" / "000002.tif", "wb") as f:
+        f.write(header)
+    assert live.poll()
+    assert live.num_t == 4
+    assert not live.poll()
+
+    tifffile.imwrite(str(tmp_path / "data" / "000002.tif"), buffers[2])
+    assert live.poll()
+    assert [data.shape[0] for data, _, _ in live.layer_data] == [6, 6, 6]
+    # earlier volumes aren't desheared again
+    assert multichannel.volume(1, 0) is first_volume
+    np.testing.assert_array_equal(
+        np.asarray(multichannel), expected_deskewed(buffers)
+    )
@@ -0,0 +1,46 @@
+import tifffile
+
+from snouty_viewer.im_loader import allocate_memory_return_memmap
+from snouty_viewer.ome_metadata import ome_metadata, read_snouty_metadata
+
+SNOUTY_METADATA = {
+    "channels_per_slice": "['488', '561']",
+    "sample_px_um": "0.4",
+    "voxel_aspect_ratio": "2.5",
+    "volumes_per_s": "10",
+    "buffer_time_s": "1",
+    "delay_s": "None",
+    "description": "test",
+}
+
+
+def test_ome_metadata_channels():
+    metadata = ome_metadata(SNOUTY_METADATA, "TCZYX", 1.1, num_c=2)
+    assert metadata["Channel"] == {
+        "Name": ["488", "561"],
+        "ExcitationWavelength": [488.0, 561.0],
+    }
+    # channel names that don't match the data are left out
+    assert "Channel" not in ome_metadata(SNOUTY_METADATA, "TZYX", 1.1)
+
+
+def test_allocate_writes_ome_metadata(tmp_path):
+    save_path = str(tmp_path / "deskewed.ome.tif")
+    im = allocate_memory_return_memmap(
+        "TCZYX", (2, 2, 3, 8, 6), SNOUTY_METADATA, save_path, "uint16"
+    )
+    assert im.shape == (2, 2, 3, 8, 6)
+
+    with tifffile.TiffFile(save_path) as tif:
+        ome_xml = tif.ome_metadata
+    ome = tifffile.xml2dict(ome_xml)["OME"]
+    pixels = ome["Image"]["Pixels"]
+    assert ome["Image"]["Description"] == "test"
+    assert pixels["PhysicalSizeX"] == 0.4
+    assert pixels["PhysicalSizeZ"] == 1.0
+    assert [ch["ExcitationWavelength"] for ch in pixels["Channel"]] == [
+        488.0,
+        561.0,
+    ]
+    # the Snouty metadata comes back as it was written
+    assert read_snouty_metadata(ome_xml) == SNOUTY_METADATA
@@ -0,0 +1,129 @@
+import os
+
+import numpy as np
+import tifffile
+
+from snouty_viewer import napari_get_reader
+from snouty_viewer._tests.utils import expected_deskewed, make_snouty_dir
+from snouty_viewer.batch import batch_deskew
+from snouty_viewer.im_loader import ImPathInfo
+from snouty_viewer.positions import (
+    POSITION_INDEX_NAME,
+    list_positions,
+    load_index,
+    virtual_path,
+)
+
+
+def make_multi_position_dir(path):
+    # two positions of two timepoints, in one acquisition directory
+    buffers = {}
+    make_snouty_dir(path, [np.zeros((1, 4, 1, 16, 10), np.uint16)])
+    os.remove(path / "data" / "000000.tif")
+    os.rename(
+        path / "metadata" / "000000.txt",
+        path / "metadata" / "000000_position000000_timepoint000000_burst0.txt",
+    )
+    for idx, (position, timepoint) in enumerate(
+        [(0, 0), (1, 0), (0, 1), (1, 1)]
+    ):
+        buffer = np.random.randint(0, 1000, (1, 4, 1, 16, 10)).astype(
+            np.uint16
+        )
+        name = (
+            f"{idx:06d}_position{position:06d}_timepoint{timepoint:06d}"
+            "_burst0.tif"
+        )
+        tifffile.imwrite(str(path / "data" / name), buffer)
+        buffers.setdefault(position, []).append(buffer)
+    return buffers
+
+
+def test_position_index(tmp_path):
+    snouty_dir = tmp_path / "acq"
+    make_multi_position_dir(snouty_dir)
+
+    index = load_index(str(snouty_dir), save=True)
+    assert index.positions() == [0, 1]
+    assert index.timepoints(position=1) == [0, 1]
+    assert [os.path.basename(f) for f in index.select("data", 1)] == [
+        "000001_position000001_timepoint000000_burst0.tif",
+        "000003_position000001_timepoint000001_burst0.tif",
+    ]
+    assert (snouty_dir / POSITION_INDEX_NAME).exists()
+    # unchanged folders reuse the index
+    assert load_index(str(snouty_dir)) is index
+
+    im_path_info = ImPathInfo(virtual_path(str(snouty_dir), position=1))
+    assert im_path_info.name == "acq-position1"
+    assert im_path_info.im_shape[0] == 2
+    assert list_positions([str(snouty_dir)], "timepoint") == [
+        virtual_path(str(snouty_dir), timepoint=0),
+        virtual_path(str(snouty_dir), timepoint=1),
+    ]
+
+
+def test_positions_read_and_deskewed_in_place(tmp_path):
+    snouty_dir = tmp_path / "acq"
+    buffers = make_multi_position_dir(snouty_dir)
+    files = sorted(os.listdir(snouty_dir / "data"))
+
+    reader = napari_get_reader(str(snouty_dir))
+    layers = reader(str(snouty_dir))
+    assert [add_kwargs["name"] for _, add_kwargs, _ in layers] == [
+        "acq-position0",
+        "acq-position1",
+    ]
+    np.testing.assert_array_equal(
+        np.asarray(layers[1][0]),
+        np.swapaxes(np.concatenate(buffers[1]), 1, 2)[:, 0, :, 8:],
+    )
+
+    path_out = tmp_path / "out"
+    path_out.mkdir()
+    results, failures = batch_deskew(
+        list_positions([str(snouty_dir)]), str(path_out)
+    )
+    assert not failures
+    for position, position_buffers in buffers.items():
+        np.testing.assert_array_equal(
+            tifffile.imread(
+                str(path_out / f"deskewed-acq-position{position}.ome.tif")
+            ),
+            np.squeeze(expected_deskewed(position_buffers)),
+        )
+    # nothing was copied or moved
+    assert sorted(os.listdir(snouty_dir / "data")) == files
+
+
+def test_positions_deskewed_next_to_the_buffers(tmp_path):
+    snouty_dir = tmp_path / "acq"
+    buffers = make_multi_position_dir(snouty_dir)
+
+    results, failures = batch_deskew(list_positions([str(snouty_dir)]), "")
+
+    assert not failures
+    for position, position_buffers in buffers.items():
+        save_path = snouty_dir / f"deskewed-acq-position{position}.ome.tif"
+        assert results[virtual_path(str(snouty_dir), position)] == str(
+            save_path
+        )
+        np.testing.assert_array_equal(
+            tifffile.imread(str(save_path)),
+            np.squeeze(expected_deskewed(position_buffers)),
+        )
+    assert (snouty_dir / "snouty_manifest.json").exists()
+
+
+def test_index_written_by_concurrent_writers(tmp_path):
+    from snouty_viewer._parallel import run_tasks
+    from snouty_viewer.manifest import read_json, write_json
+
+    # the workers of a split batch all write the index of the acquisition
+    path = str(tmp_path / POSITION_INDEX_NAME)
+    run_tasks(
+        write_json, [(path, {"writer": i}) for i in range(200)], workers=8
+    )
+
+    assert read_json(path)["writer"] in range(200)
+    assert os.listdir(tmp_path) == [POSITION_INDEX_NAME]
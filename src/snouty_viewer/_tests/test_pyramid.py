@@ -0,0 +1,36 @@
+import numpy as np
+
+from snouty_viewer.pyramid import (
+    auto_num_levels,
+    downsample,
+    level_shapes,
+    level_z_steps,
+)
+
+
+def test_level_z_steps():
+    # Z is only halved once the XY pixels have caught up with the planes
+    assert level_z_steps(4, voxel_aspect_ratio=1) == [2, 2, 2]
+    assert level_z_steps(4, voxel_aspect_ratio=2.5) == [1, 1, 2]
+    assert level_z_steps(4, voxel_aspect_ratio=1, z_downsample=False) == [
+        1,
+        1,
+        1,
+    ]
+    assert level_shapes((2, 1, 5, 9, 8), [2, 1]) == [
+        (2, 1, 5, 9, 8),
+        (2, 1, 3, 5, 4),
+        (2, 1, 3, 3, 2),
+    ]
+    assert auto_num_levels((3, 100, 1000)) == 1
+    assert auto_num_levels((3, 100, 3000)) == 3
+
+
+def test_downsample():
+    im = np.arange(3 * 5 * 4, dtype=np.uint16).reshape(3, 5, 4)
+    binned = downsample(im, z_step=2)
+    assert binned.shape == (2, 3, 2)
+    assert binned.dtype == im.dtype
+    assert binned[0, 0, 0] == np.rint(im[:2, :2, :2].mean())
+    # the odd last plane and row are averaged with themselves
+    assert binned[1, 2, 1] == np.rint(im[2, 4, 2:].mean())
@@ -79,9 +79,8 @@ def test_reader_multi_channel(tmp_path):
     assert isinstance(layer_data_list, list)
 
     # make sure it's the same as it started
-    modified_shape = (num_buffers, original_data.shape[1], original_data.shape[3]-8, original_data.shape[4])
+    modified_shape = (num_buffers, 2, original_data.shape[1], original_data.shape[3]-8, original_data.shape[4])
     assert modified_shape == layer_data_list[0][0].shape
-    assert modified_shape == layer_data_list[1][0].shape
 
 def test_reader_multi_channel_multi_file(tmp_path):
     """An example of how you might test your plugin."""
@@ -121,9 +120,8 @@ def test_reader_multi_channel_multi_file(tmp_path):
     assert isinstance(layer_data_list, list)
 
     # make sure it's the same as it started
-    modified_shape = (num_buffers, original_data0.shape[1], original_data0.shape[3]-8, original_data0.shape[4])
+    modified_shape = (num_buffers, 2, original_data0.shape[1], original_data0.shape[3]-8, original_data0.shape[4])
     assert modified_shape == layer_data_list[0][0].shape
-    assert modified_shape == layer_data_list[1][0].shape
 
 def test_reader_multi_channel_multi_vol(tmp_path):
     """An example of how you might test your plugin."""
@@ -164,9 +162,8 @@ def test_reader_multi_channel_multi_vol(tmp_path):
     assert isinstance(layer_data_list, list)
 
     # make sure it's the same as it started
-    modified_shape = (num_buffers*volumes_per_buffer, original_data0.shape[1], original_data0.shape[3] - 8, original_data0.shape[4])
+    modified_shape = (num_buffers*volumes_per_buffer, 2, original_data0.shape[1], original_data0.shape[3] - 8, original_data0.shape[4])
     assert modified_shape == layer_data_list[0][0].shape
-    assert modified_shape == layer_data_list[1][0].shape
 
 def test_reader_single_channel_multi_vol(tmp_path):
     """An example of how you might test your plugin."""
@@ -211,6 +208,158 @@ def test_reader_single_channel_multi_vol(tmp_path):
     assert modified_shape == layer_data_list[0][0].shape
 
 
+def test_reader_lazy_multi_channel_multi_vol(tmp_path):
+    metadata_directory = tmp_path / "metadata"
+    metadata_directory.mkdir()
+    data_directory = tmp_path / "data"
+    data_directory.mkdir()
+    my_test_file0 = str(data_directory / "000000.tif")
+    my_test_file1 = str(data_directory / "000001.tif")
+    my_test_meta = metadata_directory / "000000.txt"
+
+    volumes_per_buffer = 2
+    slices_per_volume = 5
+
+    needed_metadata = [
+        f'volumes_per_buffer: {volumes_per_buffer}',
+        'channels_per_slice: [\'488\', \'405\']',
+        f'slices_per_volume: {slices_per_volume}',
+    ]
+
+    with open(my_test_meta, 'w+') as f:
+        for line in needed_metadata:
+            f.write(line)
+            f.write('\n')
+
+    buffer_shape = (volumes_per_buffer, slices_per_volume, 2, 20, 20)
+    original_data0 = np.random.rand(*buffer_shape)
+    original_data1 = np.random.rand(*buffer_shape)
+    tifffile.imwrite(my_test_file0, original_data0)
+    tifffile.imwrite(my_test_file1, original_data1)
+
+    layer_data = napari_get_reader(tmp_path)(str(tmp_path))[0][0]
+
+    # buffers are ZCYX on disk, the layer is TCZYX with the header cropped
+    expected = np.concatenate([original_data0, original_data1])
+    expected = np.swapaxes(expected, 1, 2)[..., 8:, :]
+    np.testing.assert_array_equal(np.asarray(layer_data), expected)
+    np.testing.assert_array_equal(layer_data[3, 1], expected[3, 1])
+    np.testing.assert_array_equal(
+        layer_data[1:3, :, 2, ::2], expected[1:3, :, 2, ::2]
+    )
+
+    # no image gets written next to the raw data, only the small index
+    assert sorted(os.listdir(tmp_path)) == [
+        ".snouty_index",
+        "data",
+        "metadata",
+    ]
+
+
 def test_get_reader_pass():
     reader = napari_get_reader("fake.file")
     assert reader is None
+
+
+def test_get_reader_leaves_other_ome_files(tmp_path):
+    data = np.zeros((4, 16, 16), np.uint16)
+    path = str(tmp_path / "other.ome.tif")
+    tifffile.imwrite(path, data, compression="zlib", metadata={"axes": "ZYX"})
+    assert napari_get_reader(path) is None
+    # named like an output but compressed, so other readers get to try
+    path = str(tmp_path / "deskewed-other.ome.tif")
+    tifffile.imwrite(path, data, compression="zlib", metadata={"axes": "ZYX"})
+    assert napari_get_reader(path)(path) is None
+    # an OME-Zarr is recognized by its Snouty metadata, whatever its name
+    (tmp_path / "other.ome.zarr").mkdir()
+    assert napari_get_reader(str(tmp_path / "other.ome.zarr")) is None
+    (tmp_path / "renamed.ome.zarr").mkdir()
+    with open(tmp_path / "renamed.ome.zarr" / ".zattrs", "w") as f:
+        f.write('{"snouty_metadata": {}}')
+    assert napari_get_reader(str(tmp_path / "renamed.ome.zarr")) is not None
+
+
+def test_acquisition_index_is_reused(tmp_path, monkeypatch):
+    from snouty_viewer import im_loader
+    from snouty_viewer._tests.utils import make_snouty_dir
+
+    buffers = [np.zeros((1, 4, 1, 16, 10), np.uint16) for _ in range(2)]
+    make_snouty_dir(tmp_path, buffers)
+    assert im_loader.ImPathInfo(str(tmp_path)).num_buffers == 2
+    assert (tmp_path / ".snouty_index").exists()
+
+    opened = []
+    buffer_info = im_loader.buffer_info
+    monkeypatch.setattr(
+        im_loader,
+        "buffer_info",
+        lambda im_path: opened.append(im_path) or buffer_info(im_path),
+    )
+    # a fresh process reads the sidecar without opening any tif
+    im_loader._acquisition_cache.clear()
+    im_path_info = im_loader.ImPathInfo(str(tmp_path))
+    assert im_path_info.im_shape == (2, 1, 4, 8, 10)
+    assert opened == []
+
+    # a new buffer only opens itself and the previous latest
+    tifffile.imwrite(str(tmp_path / "data" / "000002.tif"), buffers[0])
+    assert im_loader.ImPathInfo(str(tmp_path)).num_buffers == 3
+    assert sorted(os.path.basename(f) for f in opened) == [
+        "000001.tif",
+        "000002.tif",
+    ]
+
+
+def test_buffers_mapped_at_first_buffer_offset(tmp_path, monkeypatch):
+    from snouty_viewer import im_loader
+    from snouty_viewer._tests.utils import make_snouty_dir
+
+    buffers = [
+        np.random.randint(0, 1000, (2, 4, 2, 16, 10)).astype(np.uint16)
+        for _ in range(2)
+    ]
+    make_snouty_dir(tmp_path, buffers, channels=("488", "561"))
+    # a buffer laid out differently isn't mapped at the same offset
+    tifffile.imwrite(
+        str(tmp_path / "data" / "000002.tif"),
+        buffers[0],
+        metadata={"axes": "TZCYX", "Comment": "longer header" * 10},
+    )
+    parsed = []
+    load_tif = im_loader.load_tif
+
+    def _load_tif(im_path, *args):
+        parsed.append(im_path)
+        return load_tif(im_path, *args)
+
+    monkeypatch.setattr(im_loader, "load_tif", _load_tif)
+
+    layer_data = im_loader.load_lazy(im_loader.ImPathInfo(str(tmp_path)))[0][0]
+    expected = np.swapaxes(np.concatenate(buffers + buffers[:1]), 1, 2)
+    np.testing.assert_array_equal(np.asarray(layer_data), expected[..., 8:, :])
+    assert [os.path.basename(f) for f in parsed] == ["000002.tif"]
+
+
+def test_load_full_in_blocks(tmp_path):
+    from snouty_viewer._tests.utils import make_snouty_dir
+    from snouty_viewer.im_loader import ImPathInfo, load_full, load_lazy
+
+    for channels in [("488",), ("488", "561")]:
+        acq = tmp_path / f"acq{len(channels)}"
+        shape = (2, 6, len(channels), 20, 10)
+        buffers = [
+            np.random.randint(0, 1000, shape).astype(np.uint16)
+            for _ in range(2)
+        ]
+        make_snouty_dir(acq, buffers, channels=channels)
+        im_path_info = ImPathInfo(str(acq))
+        expected = np.asarray(load_lazy(im_path_info)[0][0])
+        # whole timepoints, then z-bands of a timepoint over a tiny budget
+        for max_memory in [None, "4KB"]:
+            path_out = tmp_path / f"out-{len(channels)}-{max_memory}"
+            path_out.mkdir()
+            [(skewed, _, _)] = load_full(
+                im_path_info, str(path_out), max_memory
+            )
+            assert isinstance(skewed, np.memmap)
+            np.testing.assert_array_equal(skewed, expected)
@@ -0,0 +1,45 @@
+import numpy as np
+
+from snouty_viewer.reduction import bin_band, convert, rescales, sample_limits
+
+
+def test_bin_band():
+    im_band = np.arange(2 * 4 * 6, dtype=np.uint16).reshape(2, 4, 6)
+    np.testing.assert_array_equal(
+        bin_band(im_band, 2, 2, "sum"),
+        im_band.reshape(1, 2, 2, 2, 3, 2).sum(axis=(1, 3, 5)),
+    )
+    np.testing.assert_allclose(
+        bin_band(im_band, 1, 2), im_band.reshape(2, 2, 2, 3, 2).mean((2, 4))
+    )
+    assert bin_band(im_band, 2, 2).dtype == np.float32
+
+
+def test_rescales():
+    assert rescales(np.uint16, np.uint8)
+    assert not rescales(np.uint16, np.uint16)
+    assert not rescales(np.uint16, np.float32)
+    assert not rescales(np.uint8, np.uint16)
+
+
+def test_convert():
+    im = np.array([0, 100, 150, 200, 1000], np.uint16)
+    # the limits are mapped to the whole range, the rest is clipped
+    np.testing.assert_array_equal(
+        convert(im, np.uint8, (100, 200)), [0, 0, 128, 255, 255]
+    )
+    # sums that don't fit saturate instead of wrapping around
+    np.testing.assert_array_equal(
+        convert(np.array([70000.4, 3.6], np.float32), np.uint16),
+        [65535, 4],
+    )
+    assert convert(im, np.uint16) is im
+    np.testing.assert_array_equal(convert(im, np.float32), im)
+
+
+def test_sample_limits():
+    volumes = [np.full((40, 2, 2), value, np.uint16) for value in (10, 30)]
+    volumes[1][::3] = 1000
+    # only every third plane of 40 is read, all of them 1000 in the second
+    assert sample_limits(volumes, (0, 100)) == (10, 1000)
+    assert sample_limits(volumes, (50, 50)) == (505, 505)
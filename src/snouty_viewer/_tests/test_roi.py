@@ -0,0 +1,39 @@
+import pytest
+
+from snouty_viewer.roi import crop_slices, intersect, parse_crop
+
+
+def test_parse_crop():
+    assert parse_crop(None) == {}
+    assert parse_crop("z=10:50, x=:400,t=-2:") == {
+        "Z": (10, 50),
+        "X": (None, 400),
+        "T": (-2, None),
+    }
+    assert parse_crop({"y": slice(3, 9), "C": (1, 2)}) == {
+        "Y": (3, 9),
+        "C": (1, 2),
+    }
+    with pytest.raises(ValueError):
+        parse_crop("z=10")
+    with pytest.raises(ValueError):
+        parse_crop({"w": (0, 1)})
+    with pytest.raises(ValueError):
+        parse_crop({"x": slice(0, 10, 2)})
+
+
+def test_crop_slices():
+    shape = (3, 2, 10, 20, 30)
+    assert crop_slices(shape) == tuple(slice(0, size) for size in shape)
+    assert crop_slices(shape, "t=-1:,z=2:100,x=5:-5") == (
+        slice(2, 3),
+        slice(0, 2),
+        slice(2, 10),
+        slice(0, 20),
+        slice(5, 25),
+    )
+    with pytest.raises(ValueError):
+        crop_slices(shape, "y=15:10")
+    assert intersect(slice(5, 25), (0, 10)) == slice(5, 10)
+    with pytest.raises(ValueError):
+        intersect(slice(5, 25), (30, 40))
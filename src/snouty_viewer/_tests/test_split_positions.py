@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from scripts.split_positions import process_directory
+
+
+def make_positions(path):
+    # one acquisition with two timepoints of one buffer each
+    files = {}
+    for folder, ext in [("data", "tif"), ("metadata", "txt")]:
+        (path / "acq" / folder).mkdir(parents=True, exist_ok=True)
+        for timepoint in range(2):
+            name = f"000000_position000000_timepoint{timepoint:06d}_burst0"
+            file_path = path / "acq" / folder / f"{name}.{ext}"
+            file_path.write_bytes(os.urandom(64))
+            files[(folder, timepoint)] = file_path
+    return files
+
+
+@pytest.mark.parametrize("mode", ["copy", "hardlink", "symlink", "reflink"])
+def test_process_directory_modes(tmp_path, mode):
+    files = make_positions(tmp_path / "in")
+
+    process_directory(str(tmp_path / "in"), str(tmp_path), mode, workers=2)
+
+    splits = tmp_path / "in-position_splits"
+    for (folder, timepoint), src in files.items():
+        dst = splits / f"acq-{timepoint:06d}" / folder / src.name
+        # reflink falls back to a copy where clones aren't supported
+        assert dst.read_bytes() == src.read_bytes()
+        if mode == "hardlink":
+            assert os.path.samefile(src, dst)
+        assert dst.is_symlink() == (mode == "symlink")
+
+    # rerunning replaces the earlier split, also in another mode
+    rerun_mode = "symlink" if mode == "copy" else "copy"
+    process_directory(str(tmp_path / "in"), str(tmp_path), rerun_mode)
+    for (folder, timepoint), src in files.items():
+        dst = splits / f"acq-{timepoint:06d}" / folder / src.name
+        assert dst.read_bytes() == src.read_bytes()
+        assert dst.is_symlink() == (rerun_mode == "symlink")
+
+
+def test_process_directory_unknown_mode(tmp_path):
+    make_positions(tmp_path / "in")
+    with pytest.raises(ValueError):
+        process_directory(str(tmp_path / "in"), mode="move")
@@ -0,0 +1,56 @@
+import json
+import pstats
+
+from snouty_viewer._parallel import run_tasks
+from snouty_viewer.stats import (
+    merge_reports,
+    profiling,
+    recording,
+    stage,
+    summary,
+    write_report,
+)
+
+
+def _read():
+    with stage("read", 100):
+        pass
+
+
+def test_stages_are_recorded_per_run(tmp_path):
+    with recording() as outer:
+        with recording() as stats:
+            # from worker threads too
+            run_tasks(_read, [()] * 4, workers=4)
+            with stage("write", 10):
+                pass
+        with stage("write", 5):
+            pass
+
+    report = stats.report()
+    assert report["stages"]["read"]["calls"] == 4
+    assert report["stages"]["read"]["bytes"] == 400
+    assert report["stages"]["write"]["calls"] == 1
+    assert report["stages"]["write"]["bytes"] == 10
+    assert report["wall_seconds"] > 0
+    # a finished run adds up into the one around it
+    assert outer.report()["stages"]["write"]["bytes"] == 15
+
+    path = str(tmp_path / "report.json")
+    write_report(path, stats, snouty_dir="acq")
+    with open(path) as f:
+        assert json.load(f)["snouty_dir"] == "acq"
+    merged = merge_reports([path, path, str(tmp_path / "missing.json")], 2.0)
+    assert merged["stages"]["read"]["bytes"] == 800
+    assert merged["wall_seconds"] == 2.0
+    table = summary(merged)
+    assert "read" in table and "wall time" in table
+
+
+def test_profiling(tmp_path):
+    path = str(tmp_path / "run.prof")
+    with profiling(path, trace_memory=True):
+        sorted(range(1000), key=str)
+    assert pstats.Stats(path).total_calls > 0
+    with open(f"{path}.memory.txt") as f:
+        assert f.readline().startswith("peak traced memory")
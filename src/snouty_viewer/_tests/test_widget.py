@@ -1,6 +1,10 @@
+import os
+
 import numpy as np
+import tifffile
 
 from snouty_viewer import native_view
+from snouty_viewer._tests.utils import expected_deskewed, make_snouty_dir
 
 
 def test_3d_image(make_napari_viewer):
@@ -35,3 +39,133 @@ def test_4d_image(make_napari_viewer):
 
     # read captured output and check that it's as we expected
     assert output_layer[0].shape == out_size
+
+
+def test_lazy_multichannel_matches_eager(qtbot):
+    import napari
+
+    data = np.random.random((3, 2, 6, 10, 8))
+    metadata = {
+        "snouty_metadata": {
+            "scan_step_size_px": 2,
+            "channels_per_slice": "['488', '561']",
+        }
+    }
+    layer = napari.layers.Image(data, metadata=metadata)
+
+    lazy_layers = native_view()(layer)
+    eager_layers = native_view()(layer, lazy=False)
+
+    # one layer per channel plus the multichannel layer
+    assert len(lazy_layers) == 3
+    assert lazy_layers[0][0].shape == (3, 2, 6, 10 + 2 * 5, 8)
+    assert lazy_layers[1][0].shape == (3, 6, 10 + 2 * 5, 8)
+    np.testing.assert_array_equal(
+        np.asarray(lazy_layers[0][0]), np.asarray(eager_layers[0][0])
+    )
+    np.testing.assert_array_equal(lazy_layers[2][0][1], eager_layers[2][0][1])
+
+
+def test_parallel_deshear_matches_serial(qtbot):
+    import napari
+
+    from snouty_viewer._widget import ImInfo
+
+    metadata = {"snouty_metadata": {"scan_step_size_px": 2}}
+    # a single volume gets split into z-bands, many volumes are split whole
+    for shape in [(7, 10, 8), (3, 2, 7, 10, 8)]:
+        layer = napari.layers.Image(np.random.random(shape), metadata=metadata)
+        outputs = []
+        for workers in [1, 4]:
+            im_info = ImInfo(layer)
+            im_info.deshear_all_channels(workers=workers)
+            outputs.append(im_info.im_desheared)
+        np.testing.assert_array_equal(outputs[0], outputs[1])
+
+        im_info = ImInfo(layer)
+        im_info.deshear_all_channels(lazy=True, workers=4)
+        expected = outputs[0] if len(shape) == 3 else outputs[0][:, -1]
+        lazy_desheared = np.asarray(im_info.displayed_images[-1][0])
+        np.testing.assert_array_equal(
+            lazy_desheared.reshape(expected.shape), expected
+        )
+
+
+def test_deshear_falls_back_to_lazy_over_budget(qtbot):
+    import napari
+
+    from snouty_viewer._widget import ImInfo
+    from snouty_viewer.deshear import DeshearedArray
+
+    metadata = {"snouty_metadata": {"scan_step_size_px": 2}}
+    layer = napari.layers.Image(
+        np.random.random((4, 7, 10, 8)), metadata=metadata
+    )
+    eager = ImInfo(layer)
+    eager.deshear_all_channels(max_memory="1MB")
+    assert isinstance(eager.im_desheared, np.ndarray)
+
+    # the desheared image needs 4 * 7 * 22 * 8 * 8 bytes
+    im_info = ImInfo(layer)
+    im_info.deshear_all_channels(max_memory=20_000)
+    assert im_info.im_desheared is None
+    [(lazy, _, _)] = im_info.displayed_images
+    assert isinstance(lazy, DeshearedArray)
+    assert lazy.cache_size == 2
+    np.testing.assert_array_equal(np.asarray(lazy), eager.im_desheared)
+
+
+def test_batch_deskew_streams_from_raw_buffers(qtbot, tmp_path):
+    from snouty_viewer import _widget
+
+    buffers = [
+        np.random.randint(0, 1000, (2, 5, 2, 20, 12)).astype(np.uint16)
+        for _ in range(2)
+    ]
+    make_snouty_dir(tmp_path / "in" / "acq", buffers, channels=("488", "561"))
+    path_out = tmp_path / "out"
+    path_out.mkdir()
+
+    _widget.batch_deskew_and_save()(
+        path_in=str(tmp_path / "in"), path_out=str(path_out), workers=2
+    )
+
+    # only the deskewed output (its stage report and the batch manifest), no
+    # skewed intermediate
+    assert sorted(os.listdir(path_out)) == [
+        "deskewed-acq.ome.tif",
+        "deskewed-acq.ome.tif.stats.json",
+        "snouty_manifest.json",
+    ]
+    np.testing.assert_array_equal(
+        tifffile.imread(str(path_out / "deskewed-acq.ome.tif")),
+        expected_deskewed(buffers),
+    )
+
+
+def test_batch_deskew_layers_keep_output_metadata(qtbot, tmp_path):
+    from snouty_viewer import _widget
+    from snouty_viewer._writer import write_single_image
+
+    buffers = [np.random.randint(0, 1000, (2, 5, 1, 20, 12)).astype(np.uint16)]
+    make_snouty_dir(tmp_path / "in" / "acq", buffers)
+    path_out = tmp_path / "out"
+    path_out.mkdir()
+
+    [(data, add_kwargs, _)] = _widget.batch_deskew_and_save()(
+        path_in=str(tmp_path / "in"),
+        path_out=str(path_out),
+        show_deskewed_ims=True,
+        isotropic=True,
+    )
+
+    # the layer describes the isotropic output, not the raw acquisition
+    assert add_kwargs["name"] == "deskewed-acq"
+    np.testing.assert_allclose(add_kwargs["scale"], (0.4, 0.4, 0.4))
+    snouty_metadata = add_kwargs["metadata"]["snouty_metadata"]
+    assert float(snouty_metadata["voxel_aspect_ratio"]) == 1.0
+    # so saving it again keeps its pixel sizes
+    path = str(tmp_path / "resaved.ome.tif")
+    write_single_image(path, data, add_kwargs)
+    with tifffile.TiffFile(path) as tif:
+        assert 'PhysicalSizeZ="0.4"' in tif.ome_metadata
@@ -0,0 +1,151 @@
+import json
+
+import numpy as np
+import pytest
+import tifffile
+
+from snouty_viewer._writer import write_ome_zarr
+
+zarr = pytest.importorskip("zarr")
+
+
+def test_write_ome_zarr(tmp_path):
+    snouty_metadata = {
+        "sample_px_um": "0.4",
+        "voxel_aspect_ratio": "2.5",
+        "volumes_per_s": "10",
+        "buffer_time_s": "1",
+        "delay_s": "None",
+        "description": "test",
+    }
+    layer_data = np.zeros((3, 6, 40, 20), np.uint16)
+    layer_data[:, 1:3, 5:10, 5:10] = 1000
+    path = str(tmp_path / "deskewed.ome.zarr")
+
+    assert write_ome_zarr(
+        path, layer_data, {"metadata": {"snouty_metadata": snouty_metadata}}
+    ) == [path]
+
+    im = zarr.open_array(f"{path}/0", mode="r")
+    assert im.shape == (3, 1, 6, 40, 20)
+    np.testing.assert_array_equal(im[:, 0], layer_data)
+
+    with open(tmp_path / "deskewed.ome.zarr" / ".zattrs") as f:
+        multiscales = json.load(f)["multiscales"][0]
+    assert [axis["name"] for axis in multiscales["axes"]] == list("tczyx")
+    scale = multiscales["datasets"][0]["coordinateTransformations"][0]
+    np.testing.assert_allclose(scale["scale"], [1.1, 1, 1.0, 0.4, 0.4])
+
+
+def test_write_single_image_streams_planes(tmp_path):
+    from snouty_viewer._writer import write_single_image
+    from snouty_viewer.im_loader import LazyArray
+
+    class VolumeOnlyArray(LazyArray):
+        # hands out one TCZYX volume at a time, never the whole array
+        def __init__(self, data):
+            self.data = data
+            self.shape = data.shape
+            self.dtype = data.dtype
+            self.num_lead = 2
+
+        def volume(self, t, ch):
+            return self.data[t, ch]
+
+        def __array__(self, dtype=None, copy=None):
+            raise AssertionError("the whole layer was materialized")
+
+    snouty_metadata = {
+        "sample_px_um": "0.4",
+        "voxel_aspect_ratio": "2.5",
+        "volumes_per_s": "10",
+        "buffer_time_s": "1",
+        "delay_s": "None",
+        "description": "test",
+    }
+    data = np.random.randint(0, 1000, (2, 3, 4, 10, 12)).astype(np.uint16)
+    layer_data = VolumeOnlyArray(data)
+    path = str(tmp_path / "deskewed.ome.tif")
+
+    assert write_single_image(
+        path, layer_data, {"metadata": {"snouty_metadata": snouty_metadata}}
+    ) == [path]
+
+    with tifffile.TiffFile(path) as tif:
+        assert tif.series[0].axes == "TZCYX"
+        np.testing.assert_array_equal(tif.asarray(), np.swapaxes(data, 1, 2))
+        ome_xml = tif.ome_metadata
+    assert 'PhysicalSizeZ="1.0"' in ome_xml
+    assert 'TimeIncrement="1.1"' in ome_xml
+    assert "<Description>test</Description>" in ome_xml
+
+
+def test_write_single_image_pyramid_in_one_pass(tmp_path, monkeypatch):
+    import snouty_viewer._writer as writer
+    from snouty_viewer.im_loader import LazyArray
+    from snouty_viewer.pyramid import downsample
+
+    class CountingArray(LazyArray):
+        def __init__(self, data):
+            self.data = data
+            self.shape = data.shape
+            self.dtype = data.dtype
+            self.num_lead = 2
+            self.reads = 0
+
+        def volume(self, t, ch):
+            self.reads += 1
+            return self.data[t, ch]
+
+    monkeypatch.setattr(writer, "auto_num_levels", lambda shape: 3)
+    snouty_metadata = {
+        "sample_px_um": "0.4",
+        "voxel_aspect_ratio": "2.5",
+        "volumes_per_s": "10",
+        "buffer_time_s": "1",
+        "delay_s": "None",
+        "description": "test",
+    }
+    data = np.random.randint(0, 1000, (2, 2, 3, 13, 18)).astype(np.uint16)
+    layer_data = CountingArray(data)
+    path = str(tmp_path / "deskewed.ome.tif")
+
+    writer.write_single_image(
+        path, layer_data, {"metadata": {"snouty_metadata": snouty_metadata}}
+    )
+
+    # every plane is read once, not once per level
+    assert layer_data.reads == 2 * 2 * 3
+    with tifffile.TiffFile(path) as tif:
+        levels = tif.series[0].levels
+        assert len(levels) == 3
+        expected = np.swapaxes(data, 1, 2)
+        for level in levels:
+            np.testing.assert_array_equal(level.asarray(), expected)
+            expected = downsample(expected)
+    assert list(tmp_path.iterdir()) == [tmp_path / "deskewed.ome.tif"]
+
+
+def test_write_single_image_reads_back(tmp_path):
+    from snouty_viewer import napari_get_reader
+    from snouty_viewer._writer import write_single_image
+
+    snouty_metadata = {
+        "sample_px_um": "0.4",
+        "voxel_aspect_ratio": "2.5",
+        "volumes_per_s": "10",
+        "buffer_time_s": "1",
+        "delay_s": "None",
+        "description": "test",
+    }
+    data = np.random.randint(0, 1000, (2, 2, 3, 10, 12)).astype(np.uint16)
+    path = str(tmp_path / "deskewed-layer.ome.tif")
+    write_single_image(
+        path, data, {"metadata": {"snouty_metadata": snouty_metadata}}
+    )
+
+    # saved as TZCYX, read back as the TCZYX layer it was
+    [(layer_data, add_kwargs, _)] = napari_get_reader(path)(path)
+    assert isinstance(layer_data, np.memmap)
+    np.testing.assert_array_equal(layer_data, data)
+    np.testing.assert_allclose(add_kwargs["scale"], (1.0, 0.4, 0.4))
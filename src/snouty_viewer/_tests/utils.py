@@ -0,0 +1,43 @@
+import numpy as np
+import tifffile
+
+from snouty_viewer.deshear import deshear_volume
+
+
+def make_snouty_dir(path, buffers, channels=("488",), scan_step_size_px=2):
+    # buffers are (volumes_per_buffer, Z, C, Y, X) like the microscope writes
+    (path / "data").mkdir(parents=True)
+    (path / "metadata").mkdir()
+    needed_metadata = [
+        f"volumes_per_buffer: {buffers[0].shape[0]}",
+        f"channels_per_slice: {list(channels)}",
+        f"slices_per_volume: {buffers[0].shape[1]}",
+        f"scan_step_size_px: {scan_step_size_px}",
+        "sample_px_um: 0.4",
+        "voxel_aspect_ratio: 2.5",
+        "volumes_per_s: 10",
+        "buffer_time_s: 1",
+        "delay_s: None",
+        "description: test",
+    ]
+    with open(path / "metadata" / "000000.txt", "w+") as f:
+        for line in needed_metadata:
+            f.write(line)
+            f.write("\n")
+    for idx, buffer in enumerate(buffers):
+        tifffile.imwrite(str(path / "data" / f"{idx:06d}.tif"), buffer)
+
+
+def expected_deskewed(buffers, scan_step_size_px=2):
+    # TCZYX, header rows cropped
+    data = np.swapaxes(np.concatenate(buffers), 1, 2)[..., 8:, :]
+    max_deshear_shift = scan_step_size_px * (data.shape[2] - 1)
+    return np.stack(
+        [
+            [
+                deshear_volume(vol, scan_step_size_px, max_deshear_shift)
+                for vol in t_vol
+            ]
+            for t_vol in data
+        ]
+    )
@@ -1,298 +1,207 @@
-import ast
-import os
+import time
 from typing import List, Union
 
 import napari.layers
 import napari.types
-import numpy as np
+import napari.viewer
 from magicgui import magic_factory
-
-from scripts.split_positions import process_directory
-from snouty_viewer.im_loader import (
-    ImPathInfo,
-    allocate_memory_return_memmap,
-    load_full,
+from napari.utils.notifications import show_info
+from qtpy.QtCore import QTimer
+
+from scripts.split_positions import TRANSFER_MODES, process_directory
+from snouty_viewer._reader import deskewed_reader_function
+from snouty_viewer.batch import (
+    OUTPUT_FORMATS,
+    batch_deskew,
+    list_subdirectories,
 )
+from snouty_viewer.deshear import ImInfo, PseudoImage  # noqa: F401
+from snouty_viewer.live import LiveAcquisition
+from snouty_viewer.positions import SPLIT_BY, list_positions, virtual_name
+from snouty_viewer.reduction import BIN_METHODS, OUTPUT_DTYPES
+from snouty_viewer.stats import merge_reports, report_path, summary
 
 
-class PseudoImage:
-    def __init__(self, im_tuple: tuple):
-        self.data = im_tuple[0]
-        self.metadata = im_tuple[1]["metadata"]
-        self.name = im_tuple[1]["name"]
-        self.dtype = im_tuple[0].dtype
-
-
-class ImInfo:
-    def __init__(self, im, im_shape=None):
-        if im_shape is None:
-            im_shape = im.shape
-        (
-            self.num_t,
-            self.num_c,
-            self.num_z,
-            self.num_y,
-            self.num_x,
-        ) = im_shape
-        self.scan_step_size_px = int(
-            im.metadata["snouty_metadata"]["scan_step_size_px"]
-        )
-        self.max_deshear_shift = int(
-            np.rint(self.scan_step_size_px * (self.num_z - 1))
-        )
-        self.im_desheared_shape = (
-            self.num_t,
-            self.num_c,
-            self.num_z,
-            self.num_y + self.max_deshear_shift,
-            self.num_x,
-        )
-        self.im_desheared = None
-        # get desheared image memmap
-        # self.im_desheared = np.zeros(
-        #     (
-        #         self.num_t,
-        #         self.num_c,
-        #         self.num_z,
-        #         self.num_y + self.max_deshear_shift,
-        #         self.num_x,
-        #     ),
-        #     im.dtype,
-        # )
-        self.px_size = float(im.metadata["snouty_metadata"]["sample_px_um"])
-        self.z_px_size = self.px_size * float(
-            im.metadata["snouty_metadata"]["voxel_aspect_ratio"]
-        )
-        self.scale = (self.z_px_size, self.px_size, self.px_size)
-        self.dtype = im.dtype
-        self.metadata = im.metadata
-        self.data = im.data
-        self.wavelengths = ast.literal_eval(
-            im.metadata["snouty_metadata"]["channels_per_slice"]
-        )
-        self.name = im.name
-        self.displayed_images = []
-
-    # def _allocate_memory(self,
-    #                      path_im: str,
-    #                      dtype: Union[Type, str] = 'float', data = None,
-    #                      shape: tuple = None,
-    #                      description: str = 'No description.'):
-    #     axes = 'TCZYX'
-    #     if shape is None:
-    #
-    #
-    #     if data is None:
-    #         assert shape is not None
-    #         tifffile.imwrite(
-    #             path_im, shape=shape, dtype=dtype, bigtiff=True,
-    #             metadata={"axes": axes}
-    #         )
-    #     else:
-    #         tifffile.imwrite(
-    #             path_im, data, bigtiff=True, metadata={"axes": axes}
-    #         )
-    #     ome_xml = tifffile.tiffcomment(path_im)
-    #     ome = ome_types.from_xml(ome_xml, parser="lxml")
-    #     ome.images[0].pixels.physical_size_x = self.dim_sizes['X']
-    #     ome.images[0].pixels.physical_size_y = self.dim_sizes['Y']
-    #     ome.images[0].pixels.physical_size_z = self.dim_sizes['Z']
-    #     ome.images[0].pixels.time_increment = self.dim_sizes['T']
-    #     ome.images[0].description = description
-    #     ome.images[0].pixels.type = dtype
-    # note: numpy uses 8 bits as smallest, so 'bit' type does nothing for bool.
-    #     ome_xml = ome.to_xml()
-    #     tifffile.tiffcomment(path_im, ome_xml)
-
-    def _deshear_channel(self, ch_num):
-        # there's probably a more pythonic way to go about this following DRY,
-        # but whatever, it works.
-        if self.num_c == 1:
-            desheard_ch = self.im_desheared
-            if self.num_t > 1:
-                for z in range(self.num_z):
-                    deshear_shift = int(np.rint(z * self.scan_step_size_px))
-                    desheard_ch[
-                        :, z, deshear_shift : (deshear_shift + self.num_y), :
-                    ] = self.data[:, z, :, :]
-            else:
-                for z in range(self.num_z):
-                    deshear_shift = int(np.rint(z * self.scan_step_size_px))
-                    desheard_ch[
-                        z, deshear_shift : (deshear_shift + self.num_y), :
-                    ] = self.data[0, z, :, :]
-        else:
-            if self.num_t > 1:
-                desheard_ch = self.im_desheared[:, ch_num, :, :, :]
-                for z in range(self.num_z):
-                    deshear_shift = int(np.rint(z * self.scan_step_size_px))
-                    desheard_ch[
-                        :, z, deshear_shift : (deshear_shift + self.num_y), :
-                    ] = self.data[:, ch_num, z, :, :]
-            else:
-                desheard_ch = self.im_desheared[ch_num, :, :, :]
-                for z in range(self.num_z):
-                    deshear_shift = int(np.rint(z * self.scan_step_size_px))
-                    desheard_ch[
-                        z, deshear_shift : (deshear_shift + self.num_y), :
-                    ] = self.data[ch_num, z, :, :]
-        return desheard_ch
-
-    def _display_image(
-        self, im, wavelength=0, color="gray", multichannel=False
-    ):
-        if multichannel:
-            self.displayed_images.insert(
-                0,
-                (
-                    im,
-                    {
-                        "name": f"multichannel-{self.name}",
-                        "visible": False,
-                        "metadata": self.metadata,
-                        "scale": self.scale,
-                    },
-                    "image",
-                ),
-            )
-        else:
-            self.displayed_images.append(
-                (
-                    im,
-                    {
-                        "name": f"{wavelength}-{self.name}",
-                        "blending": "additive",
-                        "colormap": color,
-                        "metadata": self.metadata,
-                        "scale": self.scale,
-                    },
-                    "image",
-                )
-            )
-        return None
-
-    def deshear_all_channels(self, batch=False, show_multi=False):
-        for ch in range(self.num_c):
-            try:
-                wavelength = int(self.wavelengths[ch])
-            except ValueError:
-                wavelength = 0
-            if wavelength == 0:
-                color = "gray"
-            elif wavelength < 430:
-                color = "bop purple"
-            elif wavelength < 480:
-                color = "blue"
-            elif wavelength < 500:
-                color = "cyan"
-            elif wavelength < 570:
-                color = "green"
-            elif wavelength < 590:
-                color = "yellow"
-            elif wavelength < 630:
-                color = "bop orange"
-            elif wavelength < 700:
-                color = "red"
-            else:
-                color = "magenta"
-            ch_desheared = self._deshear_channel(ch)
-            if self.num_c > 1:
-                if self.num_t > 1:
-                    self.im_desheared[:, ch, ...] = ch_desheared[:, ...]
-                    ch_desheared = ch_desheared[:, ...]
-                else:
-                    self.im_desheared[ch, ...] = ch_desheared[:, ...]
-                    ch_desheared = ch_desheared[:, ...]
-            else:
-                self.im_desheared = ch_desheared
-            if not batch:
-                self._display_image(ch_desheared, wavelength, color)
-
-        if (self.num_c > 1 and not batch) or show_multi:
-            self._display_image(self.im_desheared, multichannel=True)
-        return None
-
-
-def list_subdirectories(path):
-    items = os.listdir(path)
-    subdirectories = [
-        item for item in items if os.path.isdir(os.path.join(path, item))
-    ]
-    # checks subdirectories to see if it contains a data and metadata folder
-    # (indication of Snouty folder)
-    snouty_subdirectories = [
-        os.path.join(path, subdirectory)
-        for subdirectory in subdirectories
-        if all(
-            dirs in os.listdir(os.path.join(path, subdirectory))
-            for dirs in ["data", "metadata"]
-        )
-    ]
-    return snouty_subdirectories
-
-
-@magic_factory(call_button="Position extraction")
+@magic_factory(
+    call_button="Position extraction",
+    mode={"choices": TRANSFER_MODES},
+)
 def position_extraction(
     path_in: str,
     path_out: str = "",
+    mode: str = "copy",
+    workers: int = 1,
 ) -> None:
     if path_out == "":
         path_out = path_in
-    process_directory(path_in, path_out)
+    process_directory(path_in, path_out, mode=mode, workers=workers)
     return None
 
 
-@magic_factory(call_button="Deskew and save")
+@magic_factory(
+    call_button="Deskew and save",
+    output_format={"choices": OUTPUT_FORMATS},
+    bin_method={"choices": BIN_METHODS},
+    dtype={"choices": OUTPUT_DTYPES},
+    split_by={"choices": SPLIT_BY},
+)
 def batch_deskew_and_save(
     path_in: str,
     path_out: str = "",
     show_deskewed_ims: bool = False,
     auto_save: bool = True,
     num_t: int = -1,
+    workers: int = 1,
+    processes: int = 1,
+    max_memory_gb: float = 0.0,
+    resume: bool = True,
+    output_format: str = "ome.tif",
+    pyramid_levels: int = 1,
+    subpixel: bool = False,
+    isotropic: bool = False,
+    coverslip: bool = False,
+    crop: str = "",
+    auto_crop: bool = False,
+    bin_xy: int = 1,
+    bin_z: int = 1,
+    bin_method: str = "mean",
+    dtype: str = "same",
+    split_by: str = "none",
 ) -> Union[List[napari.types.LayerDataTuple], None]:
-    snouty_dirs = list_subdirectories(path_in)
-    tuple_list = []
-    for snouty_dir in snouty_dirs:
-        # try:
-        if path_out == "":
-            path_out = snouty_dir
-        im_path_info = ImPathInfo(snouty_dir, num_t=num_t)
-        skewed_memmap = PseudoImage(load_full(im_path_info, path_out)[0])
-        im_info = ImInfo(skewed_memmap, im_path_info.im_shape)
-        name = im_path_info.path.rsplit(os.sep)[-1]
-        # skewed_memmap_path = os.path.join(path_out, f"skewed-{name}.ome.tif")
-        save_path = os.path.join(path_out, f"deskewed-{name}.ome.tif")
-        deskewed_memmap = allocate_memory_return_memmap(
-            "TCZYX",
-            im_info.im_desheared_shape,
-            im_path_info.metadata,
-            save_path,
-            im_info.dtype,
-        )
-        im_info.im_desheared = deskewed_memmap
-        im_info.deshear_all_channels(batch=True, show_multi=show_deskewed_ims)
-        if show_deskewed_ims:
-            tuple_list.append(im_info.displayed_images[0])
-        # if auto_save:
-        #     save_path = os.path.join(
-        #         path_out, f"deskewed-{im_info.name}.ome.tif"
-        #     )
-        #     attributes = {"metadata": im_info.metadata}
-        #     write_single_image(save_path, im_info.im_desheared, attributes)
-        # os.remove(skewed_memmap_path)
-        # except Exception as e:
-        #     print(f"Error in {snouty_dir}: {e}")
-        #     continue
+    # positions are deskewed in place, without splitting them on disk first
+    snouty_dirs = list_positions(
+        list_subdirectories(path_in), split_by, save=True
+    )
+    # 0 means no memory limit
+    max_memory = None
+    if max_memory_gb > 0:
+        max_memory = int(max_memory_gb * 1024**3)
+    start = time.time()
+    results, failures = batch_deskew(
+        snouty_dirs,
+        path_out,
+        num_t=num_t,
+        workers=workers,
+        processes=processes,
+        max_memory=max_memory,
+        resume=resume,
+        output_format=output_format,
+        pyramid_levels=pyramid_levels,
+        subpixel=subpixel,
+        isotropic=isotropic,
+        coverslip=coverslip,
+        crop=crop or None,
+        auto_crop=auto_crop,
+        bin_z=bin_z,
+        bin_xy=bin_xy,
+        bin_method=bin_method,
+        dtype=None if dtype == "same" else dtype,
+    )
+    # where the time went, from the stage reports of the converted outputs
+    report = merge_reports(
+        [report_path(save_path) for save_path in results.values()],
+        wall_seconds=time.time() - start,
+        since=start,
+    )
+    if report["stages"]:
+        show_info(summary(report))
     if show_deskewed_ims:
-        return tuple_list
+        return [
+            _deskewed_layer(snouty_dir, results[snouty_dir])
+            for snouty_dir in snouty_dirs
+            if snouty_dir in results
+        ]
     return None
 
 
-@magic_factory(call_button="Deskew")
+def _deskewed_layer(snouty_dir, save_path):
+    # the scale and metadata are those of the output, whose voxels may have
+    # been resampled or binned
+    [(data, add_kwargs, layer_type)] = deskewed_reader_function(save_path)
+    add_kwargs["name"] = f"deskewed-{virtual_name(snouty_dir)}"
+    return data, add_kwargs, layer_type
+
+
+@magic_factory(
+    call_button="Deskew",
+    bin_method={"choices": BIN_METHODS},
+    dtype={"choices": OUTPUT_DTYPES},
+)
 def native_view(
     im: "napari.layers.Image",
+    lazy: bool = True,
+    workers: int = 1,
+    max_memory_gb: float = 0.0,
+    subpixel: bool = False,
+    isotropic: bool = False,
+    coverslip: bool = False,
+    crop: str = "",
+    auto_crop: bool = False,
+    bin_xy: int = 1,
+    bin_z: int = 1,
+    bin_method: str = "mean",
+    dtype: str = "same",
 ) -> List[napari.types.LayerDataTuple]:
-    im_info = ImInfo(im)
-    im_info.deshear_all_channels(batch=False, show_multi=False)
+    # 0 means no memory limit, an image that doesn't fit is deskewed lazily
+    max_memory = None
+    if max_memory_gb > 0:
+        max_memory = int(max_memory_gb * 1024**3)
+    im_info = ImInfo(
+        im,
+        subpixel=subpixel,
+        isotropic=isotropic,
+        coverslip=coverslip,
+        crop=crop or None,
+        auto_crop=auto_crop,
+        bin_z=bin_z,
+        bin_xy=bin_xy,
+        bin_method=bin_method,
+        dtype=None if dtype == "same" else dtype,
+    )
+    im_info.deshear_all_channels(
+        batch=False,
+        show_multi=False,
+        lazy=lazy,
+        workers=workers,
+        max_memory=max_memory,
+    )
     im.visible = False
     return im_info.displayed_images
+
+
+# timers of the running live views, kept alive until their layers go away
+_live_timers = []
+
+
+@magic_factory(call_button="Start live view")
+def live_view(
+    viewer: "napari.viewer.Viewer",
+    path: str,
+    deskew: bool = True,
+    poll_interval_s: float = 2.0,
+    workers: int = 1,
+) -> None:
+    live = LiveAcquisition(path, deskew=deskew, workers=workers)
+    layers = [
+        viewer.add_image(data, **add_kwargs)
+        for data, add_kwargs, _ in live.layer_data
+    ]
+    timer = QTimer()
+    timer.setInterval(int(poll_interval_s * 1000))
+
+    def _poll():
+        if not all(layer in viewer.layers for layer in layers):
+            timer.stop()
+            _live_timers.remove(timer)
+            return
+        if live.poll():
+            for layer in layers:
+                # the arrays grew in place, make napari pick up their shape
+                layer.data = layer.data
+            # jump to the newest timepoint
+            viewer.dims.set_current_step(0, live.num_t - 1)
+
+    timer.timeout.connect(_poll)
+    timer.start()
+    _live_timers.append(timer)
+    return None
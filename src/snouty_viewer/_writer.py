@@ -1,29 +1,105 @@
+import os
+import tempfile
 from typing import Any, Dict, List
 
 import numpy as np
-import ome_types
 import tifffile
 
+from snouty_viewer.chunking import parse_size, plan_blocks
+from snouty_viewer.deshear import get_volume
+from snouty_viewer.ome_metadata import ome_metadata
+from snouty_viewer.ome_zarr import allocate_ome_zarr, write_volumes
+from snouty_viewer.pyramid import (
+    auto_num_levels,
+    downsample,
+    level_z_steps,
+    write_pyramid_volume,
+    z_band_multiple,
+)
+from snouty_viewer.stats import stage
+
+# memory budget (bytes or a string like "8GB") of the OME-Zarr writer, which
+# napari calls without options; None writes one (t, c) volume at a time
+WRITER_MAX_MEMORY = None
+
 
 def write_single_image(
     path: str, layer_data: Any, attributes: Dict
 ) -> List[str]:
-    if len(layer_data.shape) == 4:
-        layer_data = np.expand_dims(layer_data, axis=1)
-    layer_data = np.swapaxes(layer_data, 1, 2)
-    tifffile.imwrite(
-        path, layer_data, bigtiff=True, metadata={"axes": "TZCYX"}
+    # TCZYX, TZYX or ZYX layers are written as TZCYX, one plane at a time,
+    # so memmapped or lazy layers larger than RAM can be saved
+    shape = layer_data.shape
+    num_t = shape[0] if len(shape) > 3 else 1
+    num_c = shape[1] if len(shape) == 5 else 1
+    num_z, num_y, num_x = shape[-3:]
+    snouty_metadata = attributes["metadata"]["snouty_metadata"]
+    metadata = ome_metadata(
+        snouty_metadata, "TZCYX", _time_increment(snouty_metadata), num_c
     )
-    ome_xml = tifffile.tiffcomment(path)
-    ome = ome_types.from_xml(ome_xml, parser="lxml")
+    num_levels = auto_num_levels(shape)
+    level_shapes = [
+        (num_t, num_z, num_c, -(-num_y // 2**level), -(-num_x // 2**level))
+        for level in range(num_levels)
+    ]
+    nbytes = int(np.prod(shape)) * np.dtype(layer_data.dtype).itemsize
+    with stage("write.ome_tif", nbytes), tifffile.TiffWriter(
+        path, bigtiff=True
+    ) as tif, tempfile.TemporaryDirectory(
+        dir=os.path.dirname(os.path.abspath(path))
+    ) as spool_dir:
+        # large images get a YX pyramid in SubIFDs for faster browsing; the
+        # coarser planes are made from the full resolution ones as they are
+        # written, and spooled to disk until their SubIFDs follow
+        spools = [
+            np.memmap(
+                os.path.join(spool_dir, f"level{level}.dat"),
+                dtype=layer_data.dtype,
+                mode="w+",
+                shape=level_shape,
+            )
+            for level, level_shape in enumerate(level_shapes[1:], 1)
+        ]
+        options = {"metadata": metadata}
+        if spools:
+            options["subifds"] = len(spools)
+        tif.write(
+            _planes(layer_data, num_t, num_c, spools),
+            shape=level_shapes[0],
+            dtype=layer_data.dtype,
+            photometric="minisblack",
+            **options,
+        )
+        while spools:
+            # the memmaps have to be closed before their directory is removed
+            spool = spools.pop(0)
+            tif.write(
+                (spool[idx] for idx in np.ndindex(spool.shape[:3])),
+                shape=spool.shape,
+                dtype=layer_data.dtype,
+                photometric="minisblack",
+                subfiletype=1,
+            )
+            del spool
+    return [path]
+
+
+def _planes(layer_data, num_t, num_c, spools=()):
+    # YX planes in TZCYX order, each read once, with its downsampled planes
+    # stored in the spool of every coarser level on the way
+    num_z = layer_data.shape[-3]
+    for t in range(num_t):
+        for z in range(num_z):
+            for ch in range(num_c):
+                im_volume = get_volume(layer_data, t, ch, num_t, num_c)
+                plane = np.asarray(im_volume[z : z + 1])
+                level_plane = plane
+                for spool in spools:
+                    level_plane = downsample(level_plane)
+                    spool[t, z, ch] = level_plane[0]
+                yield plane[0]
 
-    snouty_metadata = attributes["metadata"]["snouty_metadata"]
-    px_size = float(snouty_metadata["sample_px_um"])
-    z_px_size = px_size * float(snouty_metadata["voxel_aspect_ratio"])
-    ome.images[0].pixels.physical_size_x = px_size
-    ome.images[0].pixels.physical_size_y = px_size
-    ome.images[0].pixels.physical_size_z = z_px_size
 
+def _time_increment(snouty_metadata):
     vps = float(snouty_metadata["volumes_per_s"])
     spb = float(snouty_metadata["buffer_time_s"])
     delay = snouty_metadata["delay_s"]
@@ -31,15 +107,48 @@ def write_single_image(
         delay = 0.0
     else:
         delay = float(delay)
-    time_increment = 1 / vps + spb + delay
-    ome.images[0].pixels.time_increment = time_increment
-
-    # todo fix datetime format to work
-    # acquisition_date = f"{snouty_metadata['Date']} - " \
-    #                    f"{snouty_metadata['Time']}"
-    # ome.images[0].acquisition_date = acquisition_date
-    description = snouty_metadata["description"]
-    ome.images[0].description = description
-    ome_xml = ome.to_xml()
-    tifffile.tiffcomment(path, ome_xml)
+    return 1 / vps + spb + delay
+
+
+def write_ome_zarr(path: str, layer_data: Any, attributes: Dict) -> List[str]:
+    shape = layer_data.shape
+    if len(shape) == 3:
+        shape = (1,) + shape
+    if len(shape) == 4:
+        shape = shape[:1] + (1,) + shape[1:]
+
+    snouty_metadata = attributes["metadata"]["snouty_metadata"]
+    px_size = float(snouty_metadata["sample_px_um"])
+    z_px_size = px_size * float(snouty_metadata["voxel_aspect_ratio"])
+    z_steps = level_z_steps(auto_num_levels(shape), z_px_size / px_size)
+    levels = allocate_ome_zarr(
+        path,
+        shape,
+        layer_data.dtype,
+        (z_px_size, px_size, px_size),
+        _time_increment(snouty_metadata),
+        name=attributes.get("name", ""),
+        snouty_metadata=snouty_metadata,
+        z_steps=z_steps,
+    )
+    num_t, num_c = shape[:2]
+    timepoint_nbytes = (
+        int(np.prod(shape[1:])) * np.dtype(layer_data.dtype).itemsize
+    )
+    for t_slice, z_slice in plan_blocks(
+        num_t,
+        shape[2],
+        timepoint_nbytes,
+        parse_size(WRITER_MAX_MEMORY),
+        z_multiple=z_band_multiple(levels, z_steps),
+    ):
+        block_nbytes = len(range(num_t)[t_slice]) * timepoint_nbytes
+        block_nbytes *= len(range(shape[2])[z_slice]) / shape[2]
+        with stage("write.ome_zarr", block_nbytes):
+            write_volumes(levels[0], layer_data, t_slice, z_slice)
+        for t in range(num_t)[t_slice]:
+            for ch in range(num_c):
+                write_pyramid_volume(
+                    levels, z_steps, t, ch, num_t, num_c, z_slice
+                )
     return [path]
@@ -0,0 +1,423 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from snouty_viewer._parallel import resolve_workers, run_tasks
+from snouty_viewer.chunking import parse_size, plan_blocks
+from snouty_viewer.deshear import ImInfo, PseudoImage
+from snouty_viewer.im_loader import (
+    ImPathInfo,
+    allocate_memory_return_memmap,
+    load_lazy,
+    memmap_levels,
+    time_increment,
+)
+from snouty_viewer.manifest import (
+    Manifest,
+    clear_progress,
+    fingerprint,
+    read_progress,
+    write_progress,
+)
+from snouty_viewer.ome_zarr import allocate_ome_zarr, open_ome_zarr
+from snouty_viewer.positions import split_virtual_path
+from snouty_viewer.pyramid import (
+    level_z_steps,
+    write_pyramid_volume,
+    z_band_multiple,
+)
+from snouty_viewer.reduction import PERCENTILES
+from snouty_viewer.roi import parse_crop
+from snouty_viewer.stats import recording, report_path, stage, write_report
+
+OUTPUT_FORMATS = ("ome.tif", "ome.zarr")
+
+
+def list_subdirectories(path):
+    items = os.listdir(path)
+    subdirectories = [
+        item for item in items if os.path.isdir(os.path.join(path, item))
+    ]
+    # checks subdirectories to see if it contains a data and metadata folder
+    # (indication of Snouty folder)
+    snouty_subdirectories = [
+        os.path.join(path, subdirectory)
+        for subdirectory in subdirectories
+        if all(
+            dirs in os.listdir(os.path.join(path, subdirectory))
+            for dirs in ["data", "metadata"]
+        )
+    ]
+    return snouty_subdirectories
+
+
+def default_dir_out(snouty_dir, path_out=""):
+    # outputs are saved next to the buffers by default, in the acquisition
+    # directory for a position (or timepoint) of one
+    if path_out == "":
+        return split_virtual_path(snouty_dir)[0]
+    return path_out
+
+
+def volume_nbytes(im_info: ImInfo):
+    # one skewed volume read plus one desheared volume written, before it is
+    # binned
+    num_skewed = im_info.num_z * im_info.num_y
+    num_desheared = int(np.prod(im_info.im_desheared_shape[2:4]))
+    num_desheared *= int(np.prod(im_info.bin_shape[:2]))
+    num_px = (num_skewed + num_desheared) * im_info.num_x
+    return num_px * im_info.in_dtype.itemsize
+
+
+def output_options(
+    *,
+    output_format="ome.tif",
+    chunks=None,
+    compressor="zstd",
+    pyramid_levels=1,
+    subpixel=False,
+    isotropic=False,
+    coverslip=False,
+    crop=None,
+    auto_crop=False,
+    bin_z=1,
+    bin_xy=1,
+    bin_method="mean",
+    dtype=None,
+    percentiles=PERCENTILES,
+):
+    # the options an output was written with, as they read back from JSON,
+    # so resuming only keeps outputs (and partial ones) written the same way
+    options = {
+        "output_format": output_format,
+        "chunks": chunks,
+        "compressor": compressor,
+        "pyramid_levels": pyramid_levels,
+        "subpixel": subpixel,
+        "isotropic": isotropic,
+        "coverslip": coverslip,
+        "crop": parse_crop(crop),
+        "auto_crop": auto_crop,
+        "bin_z": bin_z,
+        "bin_xy": bin_xy,
+        "bin_method": bin_method,
+        "dtype": None if dtype is None else np.dtype(dtype).name,
+        "percentiles": [float(p) for p in percentiles],
+    }
+    return json.loads(json.dumps(options))
+
+
+def deskew_and_save(
+    snouty_dir,
+    path_out="",
+    num_t=-1,
+    workers=1,
+    max_memory=None,
+    resume=True,
+    output_format="ome.tif",
+    chunks=None,
+    compressor="zstd",
+    pyramid_levels=1,
+    subpixel=False,
+    isotropic=False,
+    coverslip=False,
+    crop=None,
+    auto_crop=False,
+    bin_z=1,
+    bin_xy=1,
+    bin_method="mean",
+    dtype=None,
+    percentiles=PERCENTILES,
+):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unknown output format {output_format!r}, "
+            f"expected one of {OUTPUT_FORMATS}"
+        )
+    # every run leaves a report of its stages next to its output
+    with recording() as stats:
+        dir_out = default_dir_out(snouty_dir, path_out)
+        im_path_info = ImPathInfo(snouty_dir, num_t=num_t)
+        # stream straight from the raw buffers, one volume at a time, so no
+        # skewed intermediate file is written
+        skewed_im = PseudoImage(load_lazy(im_path_info)[0])
+        im_info = ImInfo(
+            skewed_im,
+            im_path_info.im_shape,
+            subpixel=subpixel,
+            isotropic=isotropic,
+            coverslip=coverslip,
+            crop=crop,
+            auto_crop=auto_crop,
+            bin_z=bin_z,
+            bin_xy=bin_xy,
+            bin_method=bin_method,
+            dtype=dtype,
+            percentiles=percentiles,
+        )
+        snouty_metadata = im_info.metadata["snouty_metadata"]
+        workers = resolve_workers(workers)
+        max_memory = parse_size(max_memory)
+        name = im_path_info.name
+        save_path = os.path.join(dir_out, f"deskewed-{name}.{output_format}")
+        files = fingerprint(snouty_dir)
+        options = output_options(
+            output_format=output_format,
+            chunks=chunks,
+            compressor=compressor,
+            pyramid_levels=pyramid_levels,
+            subpixel=subpixel,
+            isotropic=isotropic,
+            coverslip=coverslip,
+            crop=crop,
+            auto_crop=auto_crop,
+            bin_z=bin_z,
+            bin_xy=bin_xy,
+            bin_method=bin_method,
+            dtype=dtype,
+            percentiles=percentiles,
+        )
+        shape = im_info.im_desheared_shape
+        # OME-TIFF pyramid levels must keep every plane, so only zarr halves Z
+        z_steps = level_z_steps(
+            pyramid_levels,
+            im_info.z_px_size / im_info.px_size,
+            z_downsample=output_format == "ome.zarr",
+        )
+        start_t = 0
+        if resume:
+            start_t = read_progress(save_path, files, shape, options)
+        if start_t > 0:
+            # pick up the output of an interrupted run where it stopped
+            if output_format == "ome.zarr":
+                levels = open_ome_zarr(save_path)
+            else:
+                levels = memmap_levels(save_path)
+        elif output_format == "ome.zarr":
+            levels = allocate_ome_zarr(
+                save_path,
+                shape,
+                im_info.dtype,
+                im_info.scale,
+                time_increment(snouty_metadata),
+                name=name,
+                snouty_metadata=snouty_metadata,
+                chunks=chunks,
+                compressor=compressor,
+                z_steps=z_steps,
+            )
+        else:
+            allocate_memory_return_memmap(
+                "TCZYX",
+                shape,
+                snouty_metadata,
+                save_path,
+                im_info.dtype,
+                num_levels=pyramid_levels,
+            )
+            levels = memmap_levels(save_path)
+        im_info.im_desheared = levels[0]
+        # the timepoints (or z-bands of a timepoint) of a block are split among
+        # the threads, so the whole block fits in max_memory
+        for t_slice, z_band in plan_blocks(
+            im_info.num_t,
+            im_info.num_z_out,
+            im_info.num_c * volume_nbytes(im_info),
+            max_memory,
+            z_multiple=z_band_multiple(levels, z_steps),
+            start_t=start_t,
+        ):
+            num_t = im_info.num_t
+            timepoints = range(num_t)[t_slice]
+            im_info.deshear_timepoints(timepoints, workers, z_band)
+            if len(levels) > 1:
+                run_tasks(
+                    write_pyramid_volume,
+                    [
+                        (levels, z_steps, t, ch, num_t, im_info.num_c, z_band)
+                        for t in timepoints
+                        for ch in range(im_info.num_c)
+                    ],
+                    workers,
+                )
+            with stage("flush"):
+                for im_level in levels:
+                    if isinstance(im_level, np.memmap):
+                        im_level.flush()
+            if z_band.stop == im_info.num_z_out:
+                write_progress(save_path, files, shape, t_slice.stop, options)
+        clear_progress(save_path)
+    write_report(
+        report_path(save_path), stats, snouty_dir=os.path.abspath(snouty_dir)
+    )
+    return save_path
+
+
+def print_progress(snouty_dir, result, num_done, num_total):
+    if isinstance(result, Exception):
+        print(f"[{num_done}/{num_total}] Error in {snouty_dir}: {result}")
+    else:
+        print(f"[{num_done}/{num_total}] {snouty_dir} -> {result}")
+
+
+def batch_deskew(
+    snouty_dirs,
+    path_out="",
+    num_t=-1,
+    workers=1,
+    processes=1,
+    max_memory=None,
+    resume=True,
+    output_format="ome.tif",
+    chunks=None,
+    compressor="zstd",
+    pyramid_levels=1,
+    subpixel=False,
+    isotropic=False,
+    coverslip=False,
+    crop=None,
+    auto_crop=False,
+    bin_z=1,
+    bin_xy=1,
+    bin_method="mean",
+    dtype=None,
+    percentiles=PERCENTILES,
+    progress=print_progress,
+):
+    """Deskew and save every Snouty directory in `snouty_dirs`.
+
+    Directories are spread over `processes` worker processes (-1 for one per
+    core), each deshearing with `workers` threads. With `max_memory` (bytes
+    or a string like "8GB") per process, the work is planned in blocks of
+    timepoints, or z-bands of a timepoint, that fit in it. A failing
+    directory is reported and skipped instead of aborting the batch.
+
+    With `resume`, a manifest in each output directory records what has been
+    converted: directories whose buffers and output options haven't changed
+    since are skipped, and a partially written output continues from its
+    last finished volume.
+
+    `output_format` is "ome.tif" or "ome.zarr", the latter written with
+    `chunks` (ZYX) and a Blosc `compressor`. Outputs are saved as a pyramid
+    of `pyramid_levels` levels, each 2x coarser than the one before, for
+    fast browsing in napari.
+
+    With `subpixel` each plane is shifted by its exact, fractional, scan step
+    (interpolating along Y) instead of a whole number of rows, and with
+    `isotropic` Z is resampled to the XY pixel size in the same pass. With
+    `coverslip` the volumes are rotated into coverslip coordinates instead
+    (Y along the scan, Z away from the coverslip, isotropic voxels), also in
+    a single pass from the raw buffers.
+
+    `crop` keeps part of each output, as a dict of axis -> (start, stop) or
+    a string like "z=10:50,x=100:400" in output (TCZYX) coordinates, and
+    `auto_crop` trims the rows that aren't covered by every plane, the
+    padding of the desheared wedge. Only the raw data a crop needs is read.
+
+    Outputs can be made smaller while they are written: `bin_z` planes and
+    `bin_xy` x `bin_xy` pixels are summed or averaged (`bin_method`), and
+    `dtype` sets the output type. Integer types narrower than the raw data
+    (e.g. uint8) are scaled per channel from the `percentiles` of a few
+    sampled volumes, which are recorded in the output's metadata.
+
+    Returns a dict of directory -> saved path and one of directory ->
+    exception for the directories that failed.
+    """
+    results = {}
+    failures = {}
+    num_total = len(snouty_dirs)
+    # the options that shape an output, which the manifest records
+    output_kwargs = dict(
+        output_format=output_format,
+        chunks=chunks,
+        compressor=compressor,
+        pyramid_levels=pyramid_levels,
+        subpixel=subpixel,
+        isotropic=isotropic,
+        coverslip=coverslip,
+        crop=crop,
+        auto_crop=auto_crop,
+        bin_z=bin_z,
+        bin_xy=bin_xy,
+        bin_method=bin_method,
+        dtype=dtype,
+        percentiles=percentiles,
+    )
+    options = output_options(**output_kwargs)
+    kwargs = dict(
+        path_out=path_out,
+        num_t=num_t,
+        workers=workers,
+        max_memory=max_memory,
+        resume=resume,
+        **output_kwargs,
+    )
+    manifests = {}
+    dir_files = {}
+
+    def _manifest(snouty_dir):
+        dir_out = default_dir_out(snouty_dir, path_out)
+        if dir_out not in manifests:
+            manifests[dir_out] = Manifest(dir_out)
+        return manifests[dir_out]
+
+    def _record(snouty_dir, result):
+        files = dir_files[snouty_dir]
+        if isinstance(result, Exception):
+            failures[snouty_dir] = result
+            _manifest(snouty_dir).record(
+                snouty_dir, files, num_t, error=repr(result), options=options
+            )
+        else:
+            results[snouty_dir] = result
+            _manifest(snouty_dir).record(
+                snouty_dir,
+                files,
+                num_t,
+                output=result,
+                done=True,
+                options=options,
+            )
+        if progress is not None:
+            num_done = len(results) + len(failures)
+            progress(snouty_dir, result, num_done, num_total)
+
+    todo = []
+    for snouty_dir in snouty_dirs:
+        try:
+            dir_files[snouty_dir] = fingerprint(snouty_dir)
+        except OSError:
+            dir_files[snouty_dir] = {}
+        manifest = _manifest(snouty_dir)
+        if resume and manifest.is_done(
+            snouty_dir, dir_files[snouty_dir], num_t, options
+        ):
+            entry = manifest.directories[os.path.abspath(snouty_dir)]
+            _record(snouty_dir, entry["output"])
+        else:
+            todo.append(snouty_dir)
+
+    processes = min(resolve_workers(processes), len(todo))
+    if processes <= 1:
+        for snouty_dir in todo:
+            try:
+                result = deskew_and_save(snouty_dir, **kwargs)
+            except Exception as e:
+                result = e
+            _record(snouty_dir, result)
+        return results, failures
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {
+            executor.submit(deskew_and_save, snouty_dir, **kwargs): snouty_dir
+            for snouty_dir in todo
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = e
+            _record(futures[future], result)
+    return results, failures
@@ -0,0 +1,65 @@
+import re
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(size):
+    # bytes as a number, or a string like "512MB" / "8GB" / "1.5 TiB"
+    if size is None or isinstance(size, (int, float)):
+        return size
+    match = re.fullmatch(
+        r"\s*([\d.]+)\s*([KMGT]?)(?:i?B)?\s*", size, flags=re.IGNORECASE
+    )
+    if match is None:
+        raise ValueError(f"Can't parse memory size {size!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def fits(nbytes, max_memory=None):
+    return max_memory is None or nbytes <= max_memory
+
+
+def block_length(num, item_nbytes, max_memory=None, multiple=1):
+    # how many items (timepoints, planes) of item_nbytes fit in max_memory,
+    # rounded down to a multiple of `multiple` but never fewer than that
+    if max_memory is None:
+        return num
+    length = int(max_memory // max(item_nbytes, 1))
+    length = max(multiple, length - length % multiple)
+    return min(length, num)
+
+
+def blocks(num, length, start=0):
+    return [
+        slice(block_start, min(block_start + length, num))
+        for block_start in range(start, num, max(length, 1))
+    ]
+
+
+def plan_blocks(
+    num_t, num_z, timepoint_nbytes, max_memory=None, z_multiple=1, start_t=0
+):
+    """Split timepoints `start_t`..`num_t` into blocks that fit a budget.
+
+    Returns (t_slice, z_slice) blocks in TZ order. `timepoint_nbytes` is the
+    working memory needed for a whole timepoint: timepoints are grouped while
+    they fit in `max_memory` bytes, and a timepoint that doesn't fit on its
+    own is split into z-bands of a multiple of `z_multiple` planes. Without a
+    budget every timepoint is a block of its own.
+    """
+    all_z = slice(0, num_z)
+    if max_memory is None:
+        return [(slice(t, t + 1), all_z) for t in range(start_t, num_t)]
+    if fits(timepoint_nbytes, max_memory):
+        t_length = block_length(num_t, timepoint_nbytes, max_memory)
+        return [
+            (t_slice, all_z) for t_slice in blocks(num_t, t_length, start_t)
+        ]
+    z_length = block_length(
+        num_z, timepoint_nbytes / num_z, max_memory, z_multiple
+    )
+    return [
+        (slice(t, t + 1), z_slice)
+        for t in range(start_t, num_t)
+        for z_slice in blocks(num_z, z_length)
+    ]
@@ -0,0 +1,237 @@
+"""Deskew Snouty acquisitions without napari.
+
+Usage: snouty-deskew INPUT [INPUT ...] [-o OUTPUT] [--workers N] ...
+
+Each input is either a Snouty acquisition directory (holding data and
+metadata folders) or a directory of them.
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+from snouty_viewer.batch import (
+    OUTPUT_FORMATS,
+    batch_deskew,
+    list_subdirectories,
+)
+from snouty_viewer.manifest import write_json
+from snouty_viewer.positions import SPLIT_BY, list_positions
+from snouty_viewer.reduction import BIN_METHODS, OUTPUT_DTYPES, PERCENTILES
+from snouty_viewer.stats import merge_reports, profiling, report_path, summary
+
+
+def is_snouty_dir(path):
+    return all(
+        os.path.isdir(os.path.join(path, folder))
+        for folder in ["data", "metadata"]
+    )
+
+
+def find_snouty_dirs(paths):
+    snouty_dirs = []
+    for path in paths:
+        if is_snouty_dir(path):
+            snouty_dirs.append(path)
+        else:
+            snouty_dirs.extend(sorted(list_subdirectories(path)))
+    return snouty_dirs
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="snouty-deskew",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("inputs", nargs="+", metavar="INPUT")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="",
+        help="output directory (default: next to each acquisition)",
+    )
+    parser.add_argument(
+        "-f", "--format", choices=OUTPUT_FORMATS, default="ome.tif"
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="deshear threads per acquisition (-1 for all cores)",
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=1,
+        help="acquisitions converted at once (-1 for all cores)",
+    )
+    parser.add_argument(
+        "--num-t",
+        type=int,
+        default=-1,
+        help="only convert the first NUM_T buffers (-1 for all)",
+    )
+    parser.add_argument(
+        "--max-memory",
+        help='memory per process, e.g. "8GB", the work is split into blocks '
+        "of timepoints or z-bands that fit",
+    )
+    parser.add_argument("--pyramid-levels", type=int, default=1)
+    parser.add_argument(
+        "--chunks",
+        type=int,
+        nargs=3,
+        metavar=("Z", "Y", "X"),
+        help="OME-Zarr chunk shape",
+    )
+    parser.add_argument(
+        "--compressor",
+        default="zstd",
+        help='OME-Zarr Blosc codec, "none" for no compression',
+    )
+    parser.add_argument(
+        "--subpixel",
+        action="store_true",
+        help="shift planes by their exact, fractional, scan step",
+    )
+    parser.add_argument(
+        "--isotropic",
+        action="store_true",
+        help="resample Z to the XY pixel size",
+    )
+    parser.add_argument(
+        "--coverslip",
+        action="store_true",
+        help="rotate into coverslip coordinates, with isotropic voxels",
+    )
+    parser.add_argument(
+        "--crop",
+        help='keep part of each output, e.g. "t=0:10,z=20:80,x=100:400" '
+        "(output TCZYX coordinates)",
+    )
+    parser.add_argument(
+        "--auto-crop",
+        action="store_true",
+        help="trim the rows that aren't covered by every plane",
+    )
+    parser.add_argument(
+        "--bin-xy",
+        type=int,
+        default=1,
+        help="bin this many pixels along Y and X",
+    )
+    parser.add_argument(
+        "--bin-z", type=int, default=1, help="bin this many planes"
+    )
+    parser.add_argument("--bin-method", choices=BIN_METHODS, default="mean")
+    parser.add_argument(
+        "--dtype",
+        choices=OUTPUT_DTYPES,
+        default="same",
+        help="output type, narrower integer types are scaled per channel",
+    )
+    parser.add_argument(
+        "--percentiles",
+        type=float,
+        nargs=2,
+        default=PERCENTILES,
+        metavar=("LOW", "HIGH"),
+        help="intensity percentiles scaled to the range of --dtype",
+    )
+    parser.add_argument(
+        "--split-by",
+        choices=SPLIT_BY,
+        default="none",
+        help="convert each position (or timepoint) separately",
+    )
+    parser.add_argument(
+        "--no-resume",
+        dest="resume",
+        action="store_false",
+        help="convert everything again, ignoring the manifest",
+    )
+    parser.add_argument(
+        "--stats",
+        metavar="PATH",
+        help="save the timings and bytes of every stage of the run as JSON",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="profile the run with cProfile and save the stats to PATH",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="with --profile, also save the top allocations to "
+        "PATH.memory.txt",
+    )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="don't print progress or the stage summary",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    snouty_dirs = list_positions(
+        find_snouty_dirs(args.inputs), args.split_by, save=True
+    )
+    if not snouty_dirs:
+        print("No Snouty acquisition found", file=sys.stderr)
+        return 1
+    kwargs = {}
+    if args.quiet:
+        kwargs["progress"] = None
+    compressor = None if args.compressor == "none" else args.compressor
+    profile = contextlib.nullcontext()
+    if args.profile:
+        profile = profiling(args.profile, trace_memory=args.trace_memory)
+    start = time.time()
+    with profile:
+        results, failures = batch_deskew(
+            snouty_dirs,
+            args.output,
+            num_t=args.num_t,
+            workers=args.workers,
+            processes=args.processes,
+            max_memory=args.max_memory,
+            resume=args.resume,
+            output_format=args.format,
+            chunks=args.chunks,
+            compressor=compressor,
+            pyramid_levels=args.pyramid_levels,
+            subpixel=args.subpixel,
+            isotropic=args.isotropic,
+            coverslip=args.coverslip,
+            crop=args.crop,
+            auto_crop=args.auto_crop,
+            bin_z=args.bin_z,
+            bin_xy=args.bin_xy,
+            bin_method=args.bin_method,
+            dtype=None if args.dtype == "same" else args.dtype,
+            percentiles=tuple(args.percentiles),
+            **kwargs,
+        )
+    # the directories converted by this run, skipped ones have older reports
+    report = merge_reports(
+        [report_path(save_path) for save_path in results.values()],
+        wall_seconds=time.time() - start,
+        since=start,
+    )
+    if args.stats:
+        write_json(args.stats, report)
+    if not args.quiet and report["stages"]:
+        print(summary(report))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""Deskew raw Snouty volumes straight into coverslip coordinates.
+
+Every raw plane is a light sheet image, `scan_step_size_px` rows further
+along the sheet and `voxel_aspect_ratio` pixels further away from it than
+the plane before, so the two give the tilt of the sheet against the scan
+(and coverslip). An output voxel (z, y) of the coverslip frame, in pixels,
+sits on raw row z / sin(tilt) of raw plane (y sin(tilt) - z cos(tilt)) /
+voxel_aspect_ratio, where it is interpolated bilinearly.
+
+A whole output plane comes from the same two raw rows of every raw plane,
+so the output is computed in Z-bands that only read the matching Y-band
+of the raw volume.
+"""
+import numpy as np
+
+
+def tilt(scan_step_size_px, voxel_aspect_ratio):
+    # radians between the scan direction and the light sheet
+    return float(np.arctan2(voxel_aspect_ratio, scan_step_size_px))
+
+
+def coverslip_shape(num_z, num_y, scan_step_size_px, voxel_aspect_ratio):
+    # output planes and rows, at the XY pixel size
+    angle = tilt(scan_step_size_px, voxel_aspect_ratio)
+    depth = (num_y - 1) * np.sin(angle)
+    length = (num_z - 1) * voxel_aspect_ratio / np.sin(angle)
+    length += (num_y - 1) * np.cos(angle)
+    return int(np.floor(depth + 1e-6)) + 1, int(np.floor(length + 1e-6)) + 1
+
+
+def coverslip_rows(
+    num_z, num_y, scan_step_size_px, voxel_aspect_ratio, z_slice=None
+):
+    # the (start, stop) output rows that every plane of z_slice (all planes
+    # by default) has data in, the box inside the rotated volume
+    angle = tilt(scan_step_size_px, voxel_aspect_ratio)
+    num_z_out = coverslip_shape(
+        num_z, num_y, scan_step_size_px, voxel_aspect_ratio
+    )[0]
+    start, stop, _ = (z_slice or slice(None)).indices(num_z_out)
+    first = (stop - 1) * np.cos(angle) / np.sin(angle)
+    last = (num_z - 1) * voxel_aspect_ratio + start * np.cos(angle)
+    last /= np.sin(angle)
+    return int(np.ceil(first - 1e-6)), int(np.floor(last + 1e-6)) + 1
+
+
+def rotate_to_coverslip(
+    im_volume,
+    scan_step_size_px,
+    voxel_aspect_ratio,
+    z_slice=slice(None),
+    y_slice=slice(None),
+):
+    """The planes of z_slice of a raw ZYX volume in coverslip coordinates.
+
+    Returns a (planes, rows, X) array of the input dtype, with Y along the
+    scan and Z away from the coverslip, both at the XY pixel size, cropped to
+    the rows of y_slice. Voxels outside the scanned volume are zero. Only
+    the raw planes and rows the output needs are read.
+    """
+    num_z, num_y, num_x = im_volume.shape
+    angle = tilt(scan_step_size_px, voxel_aspect_ratio)
+    num_z_out, num_y_out = coverslip_shape(
+        num_z, num_y, scan_step_size_px, voxel_aspect_ratio
+    )
+    start, stop, _ = z_slice.indices(num_z_out)
+    y_start, y_stop, _ = y_slice.indices(num_y_out)
+    im_band = np.empty(
+        (stop - start, y_stop - y_start, num_x), im_volume.dtype
+    )
+    y_out = np.arange(y_start, y_stop) * np.sin(angle)
+    for k in range(start, stop):
+        # the raw plane of every output row, vectorized over Y and X
+        z_raw = (y_out - k * np.cos(angle)) / voxel_aspect_ratio
+        inside = (z_raw > -1e-6) & (z_raw < num_z - 1 + 1e-6)
+        z_raw = np.clip(z_raw, 0, num_z - 1)
+        z_below = np.floor(z_raw).astype(int)
+        z_above = np.minimum(z_below + 1, num_z - 1)
+        z_weight = (z_raw - z_below).astype(np.float32)[:, np.newaxis]
+        # and the raw row of this output plane, blended from the two around
+        # it in the raw planes in between only
+        z_first, z_last = z_below[0], z_above[-1] + 1
+        y_raw = k / np.sin(angle)
+        y_below = min(int(np.floor(y_raw + 1e-6)), num_y - 1)
+        y_weight = max(y_raw - y_below, 0.0)
+        rows = im_volume[z_first:z_last, y_below].astype(np.float32)
+        rows *= 1 - y_weight
+        if y_weight > 1e-6 and y_below + 1 < num_y:
+            rows += (
+                np.float32(y_weight) * im_volume[z_first:z_last, y_below + 1]
+            )
+        z_below -= z_first
+        z_above -= z_first
+        plane = rows[z_below] * (1 - z_weight) + rows[z_above] * z_weight
+        plane[~inside] = 0
+        if np.issubdtype(im_band.dtype, np.integer):
+            info = np.iinfo(im_band.dtype)
+            np.clip(np.rint(plane, out=plane), info.min, info.max, out=plane)
+        im_band[k - start] = plane
+    return im_band
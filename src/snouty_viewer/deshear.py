@@ -0,0 +1,818 @@
+import ast
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from snouty_viewer._parallel import resolve_workers, run_tasks
+from snouty_viewer.chunking import fits, parse_size, plan_blocks
+from snouty_viewer.coverslip import (
+    coverslip_rows,
+    coverslip_shape,
+    rotate_to_coverslip,
+)
+from snouty_viewer.im_loader import LazyArray
+from snouty_viewer.reduction import (
+    BIN_METHODS,
+    PERCENTILES,
+    bin_band,
+    convert,
+    rescales,
+    sample_limits,
+)
+from snouty_viewer.roi import crop_slices, intersect
+from snouty_viewer.stats import stage
+
+
+def volume_index(data, t, ch, num_t, num_c):
+    # data may have its singleton T and/or C axes squeezed away, the same way
+    # tifffile.memmap squeezes them when reading an allocated ome.tif back.
+    idx = []
+    if data.ndim == 5 or num_t > 1 or (data.ndim == 4 and num_c == 1):
+        idx.append(t)
+    if data.ndim == 5 or num_c > 1:
+        idx.append(ch)
+    return tuple(idx)
+
+
+def get_volume(data, t, ch, num_t, num_c):
+    idx = volume_index(data, t, ch, num_t, num_c)
+    if isinstance(data, LazyArray):
+        # the volume of a lazy array is a view (e.g. of a buffer memmap), so
+        # don't materialize a copy of it
+        return data.volume(*idx[: data.num_lead])[idx[data.num_lead :]]
+    return data[idx]
+
+
+def get_channel(data, ch, num_t, num_c):
+    if num_c == 1:
+        return data
+    if data.ndim == 5 or num_t > 1:
+        return data[:, ch]
+    return data[ch]
+
+
+def _sheared_views(im_desheared, num_y, step):
+    # With an integer step, plane z starts `step` rows further into the
+    # output than plane z-1 ended, so all planes (and all the padding between
+    # them) sit at a constant stride in the flat output volume. That lets the
+    # whole volume be written with one strided assignment each, in increasing
+    # address order, instead of one slice-assign per z.
+    num_z, num_y_out, num_x = im_desheared.shape
+    row_stride, x_stride = im_desheared.strides[1:]
+    z_stride = row_stride * (num_y_out + step)
+    data_view = np.lib.stride_tricks.as_strided(
+        im_desheared,
+        shape=(num_z, num_y, num_x),
+        strides=(z_stride, row_stride, x_stride),
+    )
+    pad_view = np.lib.stride_tricks.as_strided(
+        im_desheared[0, num_y:],
+        shape=(num_z - 1, num_y_out + step - num_y, num_x),
+        strides=(z_stride, row_stride, x_stride),
+    )
+    return data_view, pad_view
+
+
+def deshear_volume(
+    im_volume,
+    scan_step_size_px,
+    max_deshear_shift,
+    im_desheared=None,
+    zero_fill=True,
+    z_slice=slice(None),
+):
+    # z_slice restricts the work to a band of planes of the volume, so a
+    # single volume can be split across threads
+    num_z, num_y, num_x = im_volume.shape
+    if im_desheared is None:
+        im_desheared = np.zeros(
+            (num_z, num_y + max_deshear_shift, num_x), im_volume.dtype
+        )
+        zero_fill = False
+    step = scan_step_size_px
+    linear_shift = float(step).is_integer() and step >= 0
+    if linear_shift:
+        linear_shift = int(step) * (num_z - 1) == max_deshear_shift
+    if linear_shift and im_desheared.flags.c_contiguous:
+        data_view, pad_view = _sheared_views(im_desheared, num_y, int(step))
+        data_view[z_slice] = im_volume[z_slice]
+        if zero_fill:
+            pad_view[z_slice] = 0
+        return im_desheared
+    for z in range(num_z)[z_slice]:
+        deshear_shift = int(np.rint(z * step))
+        if zero_fill:
+            im_desheared[z, :deshear_shift, :] = 0
+            im_desheared[z, (deshear_shift + num_y) :, :] = 0
+        im_desheared[
+            z, deshear_shift : (deshear_shift + num_y), :
+        ] = im_volume[z]
+    return im_desheared
+
+
+def deshear_band(
+    im_volume,
+    scan_step_size_px,
+    max_deshear_shift,
+    z_slice,
+    y_slice=slice(None),
+):
+    # the desheared planes of z_slice only, for outputs that are written a
+    # band at a time instead of desheared in place; with y_slice only the
+    # raw rows that land in those output rows are read
+    start, stop, _ = z_slice.indices(im_volume.shape[0])
+    num_y, num_x = im_volume.shape[1:]
+    y_start, y_stop, _ = y_slice.indices(num_y + max_deshear_shift)
+    im_band = np.zeros(
+        (stop - start, y_stop - y_start, num_x), im_volume.dtype
+    )
+    for z in range(start, stop):
+        deshear_shift = int(np.rint(z * scan_step_size_px))
+        first = max(y_start - deshear_shift, 0)
+        last = min(y_stop - deshear_shift, num_y)
+        if first >= last:
+            continue
+        im_band[
+            z - start,
+            first + deshear_shift - y_start : last + deshear_shift - y_start,
+        ] = im_volume[z, first:last]
+    return im_band
+
+
+def resampled_shape(num_z, num_y, scan_step_size_px, z_scale=1.0):
+    # planes and rows of deshear_resample's output, the small tolerances
+    # keep float round-off from adding a plane or row
+    num_z_out = int(np.floor((num_z - 1) * z_scale + 1e-6)) + 1
+    max_shift = int(np.ceil(scan_step_size_px * (num_z - 1) - 1e-6))
+    return num_z_out, num_y + max_shift
+
+
+def covered_rows(num_z, num_y, scan_step_size_px, z_scale=1.0, z_slice=None):
+    # the (start, stop) output rows that every plane of z_slice (all planes
+    # by default) has data in, the box inside the desheared wedge
+    num_z_out = resampled_shape(num_z, num_y, scan_step_size_px, z_scale)[0]
+    start, stop, _ = (z_slice or slice(None)).indices(num_z_out)
+    # an output plane between two raw planes is interpolated from both
+    z_first = int(np.floor(start / z_scale + 1e-6))
+    z_last = min(int(np.ceil((stop - 1) / z_scale - 1e-6)), num_z - 1)
+    first = int(np.ceil(z_last * scan_step_size_px - 1e-6))
+    last = int(np.floor(z_first * scan_step_size_px + 1e-6)) + num_y
+    return first, last
+
+
+def _round_into(im_out, im):
+    # in place, im is a float32 scratch plane
+    if np.issubdtype(im_out.dtype, np.integer):
+        info = np.iinfo(im_out.dtype)
+        np.rint(im, out=im)
+        np.clip(im, info.min, info.max, out=im)
+    im_out[...] = im
+
+
+def deshear_resample(
+    im_volume,
+    scan_step_size_px,
+    num_y_out,
+    z_scale=1.0,
+    z_slice=slice(None),
+    y_slice=slice(None),
+):
+    """Deshear with fractional shifts and resample Z, in a single pass.
+
+    Output plane k lies at input plane k / z_scale, and is interpolated
+    linearly between the two input planes around it, each shifted by its
+    exact `z * scan_step_size_px` rows with linear interpolation along Y.
+    Every plane is computed whole (vectorized over Y and X) in float32, and
+    only the planes of z_slice and rows of y_slice are returned, as a
+    (planes, rows, X) array of the input dtype. Only the input rows that
+    land in y_slice are read.
+    """
+    num_z, num_y, num_x = im_volume.shape
+    num_z_out = resampled_shape(num_z, num_y, scan_step_size_px, z_scale)[0]
+    start, stop, _ = z_slice.indices(num_z_out)
+    y_start, y_stop, _ = y_slice.indices(num_y_out)
+    im_band = np.empty(
+        (stop - start, y_stop - y_start, num_x), im_volume.dtype
+    )
+    plane = np.empty((y_stop - y_start, num_x), np.float32)
+    weighted = np.empty((num_y, num_x), np.float32)
+    for k in range(start, stop):
+        z = k / z_scale
+        z_below = min(int(z), num_z - 1)
+        z_weight = z - z_below
+        plane[:] = 0
+        for z_in, weight in [(z_below, 1 - z_weight), (z_below + 1, z_weight)]:
+            if weight < 1e-6 or z_in >= num_z:
+                continue
+            shift = z_in * scan_step_size_px
+            row = int(np.floor(shift + 1e-6))
+            frac = max(shift - row, 0.0)
+            # input row y lands on output rows row + y and row + 1 + y
+            for offset, part in [(0, 1 - frac), (1, frac)]:
+                first = max(y_start - row - offset, 0)
+                last = min(y_stop - row - offset, num_y)
+                if part < 1e-6 or first >= last:
+                    continue
+                out = weighted[: last - first]
+                np.multiply(
+                    im_volume[z_in, first:last], weight * part, out=out
+                )
+                first += row + offset - y_start
+                plane[first : first + len(out)] += out
+        _round_into(im_band[k - start], plane)
+    return im_band
+
+
+def z_bands(num_z, num_bands, start=0):
+    # planes start..num_z split into num_bands bands of about the same size
+    num_bands = min(num_bands, num_z - start)
+    bounds = np.linspace(start, num_z, num_bands + 1).astype(int)
+    return [slice(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def split_volumes(volumes, num_z, workers, z_slice=slice(None)):
+    # whole volumes (or the z_slice of them) per task when there are enough
+    # of them to keep every worker busy, z-bands of each volume otherwise
+    start, stop, _ = z_slice.indices(num_z)
+    num_bands = -(-resolve_workers(workers) // max(len(volumes), 1))
+    return [
+        volume + (band,)
+        for volume in volumes
+        for band in z_bands(stop, num_bands, start)
+    ]
+
+
+class DeshearedArray(LazyArray):
+    """Lazy desheared view of the data of an `ImInfo`.
+
+    Only the (t, c) volumes that are indexed get desheared, and the most
+    recently used ones are kept in a small LRU cache, so browsing costs one
+    volume of compute and memory per slider step. With `ch` set the array is
+    a single TZYX channel, otherwise it is TCZYX.
+    """
+
+    def __init__(self, im_info, ch=None, cache_size=4, workers=1):
+        self.im_info = im_info
+        self.ch = ch
+        self.workers = workers
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        t_shape = (im_info.num_t,)
+        c_shape = (im_info.num_c,) if ch is None else ()
+        self.shape = t_shape + c_shape + im_info.im_desheared_shape[2:]
+        self.num_lead = len(t_shape + c_shape)
+        self.dtype = np.dtype(im_info.dtype)
+
+    def extend(self):
+        # the desheared volumes of earlier timepoints stay cached
+        self.shape = (self.im_info.num_t,) + self.shape[1:]
+
+    def volume(self, t, ch=None):
+        if ch is None:
+            ch = self.ch
+        key = (int(t), int(ch))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        im_info = self.im_info
+        im_volume = im_info.raw_volume(*key)
+        if not im_info.cropped:
+            im_volume = np.asarray(im_volume)
+        im_desheared = np.zeros(im_info.im_desheared_shape[2:], self.dtype)
+        with stage("deshear.lazy", im_desheared.nbytes):
+            run_tasks(
+                lambda z_slice: im_info.deshear_into(
+                    im_volume, im_desheared, z_slice, key[1]
+                ),
+                [
+                    (z_slice,)
+                    for z_slice in z_bands(
+                        im_info.num_z_out, resolve_workers(self.workers)
+                    )
+                ],
+                self.workers,
+            )
+        with self._lock:
+            self._cache[key] = im_desheared
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return im_desheared
+
+
+class PseudoImage:
+    def __init__(self, im_tuple: tuple):
+        self.data = im_tuple[0]
+        self.metadata = im_tuple[1]["metadata"]
+        self.name = im_tuple[1]["name"]
+        self.dtype = im_tuple[0].dtype
+
+
+class ImInfo:
+    def __init__(
+        self,
+        im,
+        im_shape=None,
+        subpixel=False,
+        isotropic=False,
+        coverslip=False,
+        crop=None,
+        auto_crop=False,
+        bin_z=1,
+        bin_xy=1,
+        bin_method="mean",
+        dtype=None,
+        percentiles=PERCENTILES,
+    ):
+        # subpixel keeps the fractional part of the shear and isotropic
+        # resamples Z to the XY pixel size, both through deshear_resample;
+        # coverslip rotates into coverslip coordinates instead, see
+        # snouty_viewer.coverslip
+        if bin_method not in BIN_METHODS:
+            raise ValueError(
+                f"Unknown bin method {bin_method!r}, "
+                f"expected one of {BIN_METHODS}"
+            )
+        if im_shape is None:
+            im_shape = im.data.shape
+        # single channel and single timepoint layers come without C / T axes
+        if len(im_shape) == 3:
+            im_shape = (1,) + tuple(im_shape)
+        if len(im_shape) == 4:
+            im_shape = im_shape[:1] + (1,) + tuple(im_shape[1:])
+        (
+            self.num_t,
+            self.num_c,
+            self.num_z,
+            self.num_y,
+            self.num_x,
+        ) = im_shape
+        snouty_metadata = im.metadata["snouty_metadata"]
+        self.scan_step_size_px = float(snouty_metadata["scan_step_size_px"])
+        if not (subpixel or coverslip):
+            self.scan_step_size_px = int(self.scan_step_size_px)
+        voxel_aspect_ratio = float(
+            snouty_metadata.get("voxel_aspect_ratio", 1)
+        )
+        self.voxel_aspect_ratio = voxel_aspect_ratio
+        self.coverslip = coverslip
+        self.resample = subpixel or isotropic or coverslip
+        isotropic = isotropic or coverslip
+        self.z_scale = voxel_aspect_ratio if isotropic else 1.0
+        if coverslip:
+            self.num_z_out, num_y_out = coverslip_shape(
+                self.num_z,
+                self.num_y,
+                self.scan_step_size_px,
+                voxel_aspect_ratio,
+            )
+        else:
+            self.num_z_out, num_y_out = resampled_shape(
+                self.num_z, self.num_y, self.scan_step_size_px, self.z_scale
+            )
+        self.max_deshear_shift = num_y_out - self.num_y
+        self.wavelengths = ast.literal_eval(
+            snouty_metadata.get("channels_per_slice", str(["0"] * self.num_c))
+        )
+        # crop is in output coordinates (see snouty_viewer.roi), auto_crop
+        # also trims the rows that not every kept plane has data in. Only
+        # the raw volumes, planes, rows and columns a crop needs are read.
+        full_shape = (
+            self.num_t,
+            self.num_c,
+            self.num_z_out,
+            num_y_out,
+            self.num_x,
+        )
+        self.roi = crop_slices(full_shape, crop)
+        if auto_crop:
+            y_slice = intersect(self.roi[3], self.covered_rows())
+            self.roi = self.roi[:3] + (y_slice,) + self.roi[4:]
+        cropped_shape = tuple(axis.stop - axis.start for axis in self.roi)
+        self.cropped = cropped_shape != full_shape
+        # the output is binned after cropping, leftover planes, rows and
+        # columns that don't fill a bin are dropped
+        self.bin_shape = (int(bin_z), int(bin_xy), int(bin_xy))
+        self.bin_method = bin_method
+        self.im_desheared_shape = cropped_shape[:2] + tuple(
+            size // bin_size
+            for size, bin_size in zip(cropped_shape[2:], self.bin_shape)
+        )
+        if 0 in self.im_desheared_shape:
+            raise ValueError(
+                f"Bins of {self.bin_shape} (ZYX) don't fit in the "
+                f"{cropped_shape[2:]} output"
+            )
+        # num_t and num_c are those of the output from here on
+        self._num_t_in, self._num_c_in = self.num_t, self.num_c
+        self.num_t, self.num_c, self.num_z_out = self.im_desheared_shape[:3]
+        self.wavelengths = self.wavelengths[self.roi[1]]
+        self.im_desheared = None
+        # get desheared image memmap
+        # self.im_desheared = np.zeros(
+        #     (
+        #         self.num_t,
+        #         self.num_c,
+        #         self.num_z,
+        #         self.num_y + self.max_deshear_shift,
+        #         self.num_x,
+        #     ),
+        #     im.dtype,
+        # )
+        self.px_size = float(snouty_metadata.get("sample_px_um", 1))
+        self.z_px_size = self.px_size * voxel_aspect_ratio / self.z_scale
+        # so a cropped layer sits where it was cropped from
+        self.translate = tuple(
+            axis.start * size
+            for axis, size in zip(
+                self.roi[2:], (self.z_px_size, self.px_size, self.px_size)
+            )
+        )
+        self.z_px_size *= bin_z
+        self.px_size *= bin_xy
+        self.scale = (self.z_px_size, self.px_size, self.px_size)
+        self.in_dtype = np.dtype(im.dtype)
+        self.dtype = self.in_dtype if dtype is None else np.dtype(dtype)
+        self.reduced = (
+            self.bin_shape != (1, 1, 1) or self.dtype != self.in_dtype
+        )
+        self.metadata = im.metadata
+        if isotropic or self.bin_shape != (1, 1, 1):
+            # so the outputs (and layers) get the resampled or binned sizes
+            snouty_metadata = dict(
+                snouty_metadata,
+                sample_px_um=self.px_size,
+                voxel_aspect_ratio=self.z_px_size / self.px_size,
+            )
+        if self.roi[1] != slice(0, self._num_c_in):
+            # and the names of the channels that are kept
+            snouty_metadata = dict(
+                snouty_metadata, channels_per_slice=str(self.wavelengths)
+            )
+        if snouty_metadata is not im.metadata["snouty_metadata"]:
+            self.metadata = dict(im.metadata, snouty_metadata=snouty_metadata)
+        self.data = im.data
+        self.limits = None
+        if rescales(self.in_dtype, self.dtype):
+            self.limits = self.sample_limits(percentiles)
+            # what the output intensities were scaled from, per channel
+            self.metadata = dict(
+                self.metadata,
+                snouty_metadata=dict(
+                    self.metadata["snouty_metadata"],
+                    intensity_limits=str(self.limits),
+                ),
+            )
+        self.name = im.name
+        self.displayed_images = []
+
+    # def _allocate_memory(self,
+    #                      path_im: str,
+    #                      dtype: Union[Type, str] = 'float', data = None,
+    #                      shape: tuple = None,
+    #                      description: str = 'No description.'):
+    #     axes = 'TCZYX'
+    #     if shape is None:
+    #
+    #
+    #     if data is None:
+    #         assert shape is not None
+    #         tifffile.imwrite(
+    #             path_im, shape=shape, dtype=dtype, bigtiff=True,
+    #             metadata={"axes": axes}
+    #         )
+    #     else:
+    #         tifffile.imwrite(
+    #             path_im, data, bigtiff=True, metadata={"axes": axes}
+    #         )
+    #     ome_xml = tifffile.tiffcomment(path_im)
+    #     ome = ome_types.from_xml(ome_xml, parser="lxml")
+    #     ome.images[0].pixels.physical_size_x = self.dim_sizes['X']
+    #     ome.images[0].pixels.physical_size_y = self.dim_sizes['Y']
+    #     ome.images[0].pixels.physical_size_z = self.dim_sizes['Z']
+    #     ome.images[0].pixels.time_increment = self.dim_sizes['T']
+    #     ome.images[0].description = description
+    #     ome.images[0].pixels.type = dtype
+    # note: numpy uses 8 bits as smallest, so 'bit' type does nothing for bool.
+    #     ome_xml = ome.to_xml()
+    #     tifffile.tiffcomment(path_im, ome_xml)
+
+    def covered_rows(self):
+        # the output rows every kept plane has data in, see auto_crop
+        if self.coverslip:
+            return coverslip_rows(
+                self.num_z,
+                self.num_y,
+                self.scan_step_size_px,
+                self.voxel_aspect_ratio,
+                self.roi[2],
+            )
+        return covered_rows(
+            self.num_z,
+            self.num_y,
+            self.scan_step_size_px,
+            self.z_scale,
+            self.roi[2],
+        )
+
+    def _unbinned(self, axis, start, stop):
+        # the cropped, unbinned output range of output range start..stop
+        # of an axis (2, 3, 4 for Z, Y, X)
+        offset = self.roi[axis].start
+        bin_size = self.bin_shape[axis - 2]
+        return slice(offset + start * bin_size, offset + stop * bin_size)
+
+    def raw_volume(self, t, ch):
+        # the raw ZYX volume of output timepoint t and channel ch, a view
+        # cropped to the output's columns
+        t_slice, c_slice = self.roi[:2]
+        im_volume = get_volume(
+            self.data,
+            t_slice.start + t,
+            c_slice.start + ch,
+            self._num_t_in,
+            self._num_c_in,
+        )
+        x_slice = self._unbinned(4, 0, self.im_desheared_shape[4])
+        if x_slice == slice(0, self.num_x):
+            return im_volume
+        return im_volume[..., x_slice]
+
+    def sample_limits(self, percentiles=PERCENTILES, num_samples=4):
+        # per channel intensity percentiles of a few evenly spaced volumes,
+        # what outputs of a narrower dtype are scaled from; summed bins are
+        # that many voxels' worth of intensity
+        timepoints = np.unique(
+            np.linspace(0, self.num_t - 1, num_samples).astype(int)
+        )
+        bin_size = 1
+        if self.bin_method == "sum":
+            bin_size = int(np.prod(self.bin_shape))
+        with stage("sample_limits"):
+            limits = [
+                sample_limits(
+                    [self.raw_volume(t, ch) for t in timepoints], percentiles
+                )
+                for ch in range(self.num_c)
+            ]
+        return [(low * bin_size, high * bin_size) for low, high in limits]
+
+    def deshear_band(self, im_volume, z_slice=slice(None), ch=0):
+        # the desheared planes of z_slice of channel ch, for outputs written
+        # a band at a time; z_slice and the returned band are cropped (and
+        # binned) like the output
+        start, stop, _ = z_slice.indices(self.num_z_out)
+        im_band = self._deshear_band(
+            im_volume,
+            self._unbinned(2, start, stop),
+            self._unbinned(3, 0, self.im_desheared_shape[3]),
+        )
+        if not self.reduced:
+            return im_band
+        if self.bin_shape != (1, 1, 1):
+            im_band = bin_band(im_band, *self.bin_shape[:2], self.bin_method)
+        limits = None if self.limits is None else self.limits[ch]
+        return convert(im_band, self.dtype, limits)
+
+    def _deshear_band(self, im_volume, z_slice, y_slice):
+        if self.coverslip:
+            return rotate_to_coverslip(
+                im_volume,
+                self.scan_step_size_px,
+                self.voxel_aspect_ratio,
+                z_slice,
+                y_slice,
+            )
+        if self.resample:
+            return deshear_resample(
+                im_volume,
+                self.scan_step_size_px,
+                self.num_y + self.max_deshear_shift,
+                self.z_scale,
+                z_slice,
+                y_slice,
+            )
+        return deshear_band(
+            im_volume,
+            self.scan_step_size_px,
+            self.max_deshear_shift,
+            z_slice,
+            y_slice,
+        )
+
+    def deshear_into(self, im_volume, im_out, z_slice=slice(None), ch=0):
+        # im_out is a freshly allocated (zeros) output volume, so the padding
+        # doesn't need to be written
+        if self.resample or self.cropped or self.reduced:
+            im_out[z_slice] = self.deshear_band(im_volume, z_slice, ch)
+            return None
+        deshear_volume(
+            im_volume,
+            self.scan_step_size_px,
+            self.max_deshear_shift,
+            im_out,
+            zero_fill=False,
+            z_slice=z_slice,
+        )
+        return None
+
+    def _deshear_volume(self, t, ch, z_slice=slice(None)):
+        im_volume = self.raw_volume(t, ch)
+        if not isinstance(self.im_desheared, np.ndarray):
+            # e.g. a zarr array: deshear the band in memory and store it
+            idx = volume_index(
+                self.im_desheared, t, ch, self.num_t, self.num_c
+            )
+            self.im_desheared[idx + (z_slice,)] = self.deshear_band(
+                im_volume, z_slice, ch
+            )
+            return None
+        self.deshear_into(
+            im_volume,
+            get_volume(self.im_desheared, t, ch, self.num_t, self.num_c),
+            z_slice,
+            ch,
+        )
+        return None
+
+    def deshear_timepoints(self, timepoints, workers=1, z_slice=slice(None)):
+        # TCZYX order, so the output is written front to back
+        volumes = [(t, ch) for t in timepoints for ch in range(self.num_c)]
+        # only arrays we can write views of can be split into z-bands, a
+        # chunked store needs each volume (or z_slice, aligned to its chunks)
+        # written by a single thread
+        split_workers = workers
+        if not isinstance(self.im_desheared, np.ndarray):
+            split_workers = 1
+        num_z = self.num_z_out
+        num_planes = len(volumes) * len(range(num_z)[z_slice])
+        plane_nbytes = self.desheared_nbytes() // self.num_t // self.num_c
+        plane_nbytes //= num_z
+        with stage("deshear", num_planes * plane_nbytes):
+            run_tasks(
+                self._deshear_volume,
+                split_volumes(volumes, num_z, split_workers, z_slice),
+                workers,
+            )
+
+    def extend(self, num_t):
+        # more timepoints of a still growing acquisition, which is never
+        # cropped
+        self._num_t_in = self.num_t = num_t
+        self.roi = (slice(0, num_t),) + self.roi[1:]
+        self.im_desheared_shape = (num_t,) + self.im_desheared_shape[1:]
+
+    def _display_image(
+        self, im, wavelength=0, color="gray", multichannel=False
+    ):
+        if multichannel:
+            self.displayed_images.insert(
+                0,
+                (
+                    im,
+                    {
+                        "name": f"multichannel-{self.name}",
+                        "visible": False,
+                        "metadata": self.metadata,
+                        "scale": self.scale,
+                        "translate": self.translate,
+                    },
+                    "image",
+                ),
+            )
+        else:
+            self.displayed_images.append(
+                (
+                    im,
+                    {
+                        "name": f"{wavelength}-{self.name}",
+                        "blending": "additive",
+                        "colormap": color,
+                        "metadata": self.metadata,
+                        "scale": self.scale,
+                        "translate": self.translate,
+                    },
+                    "image",
+                )
+            )
+        return None
+
+    def _channel_color(self, ch):
+        try:
+            wavelength = int(self.wavelengths[ch])
+        except ValueError:
+            wavelength = 0
+        if wavelength == 0:
+            color = "gray"
+        elif wavelength < 430:
+            color = "bop purple"
+        elif wavelength < 480:
+            color = "blue"
+        elif wavelength < 500:
+            color = "cyan"
+        elif wavelength < 570:
+            color = "green"
+        elif wavelength < 590:
+            color = "yellow"
+        elif wavelength < 630:
+            color = "bop orange"
+        elif wavelength < 700:
+            color = "red"
+        else:
+            color = "magenta"
+        return wavelength, color
+
+    def _allocate_desheared(self):
+        # squeezed like tifffile.memmap would return an allocated ome.tif
+        shape = tuple(
+            size
+            for axis, size in enumerate(self.im_desheared_shape)
+            if axis > 1 or size > 1
+        )
+        self.im_desheared = np.zeros(shape, self.dtype)
+
+    def desheared_nbytes(self):
+        itemsize = np.dtype(self.dtype).itemsize
+        return int(np.prod(self.im_desheared_shape)) * itemsize
+
+    def deshear_all_channels(
+        self,
+        batch=False,
+        show_multi=False,
+        lazy=False,
+        workers=1,
+        max_memory=None,
+    ):
+        # with a max_memory budget (bytes) that the desheared image doesn't
+        # fit in, it is desheared lazily with the volume caches sized to fit
+        max_memory = parse_size(max_memory)
+        if self.im_desheared is None and not fits(
+            self.desheared_nbytes(), max_memory
+        ):
+            lazy = True
+        if lazy:
+            return self._deshear_all_channels_lazy(
+                batch, show_multi, workers, max_memory
+            )
+        if self.im_desheared is None:
+            self._allocate_desheared()
+        volume_nbytes = self.desheared_nbytes() // self.num_t // self.num_c
+        for t_slice, z_slice in plan_blocks(
+            self.num_t,
+            self.num_z_out,
+            self.num_c * volume_nbytes,
+            max_memory,
+            z_multiple=self._z_multiple(),
+        ):
+            self.deshear_timepoints(
+                range(self.num_t)[t_slice], workers, z_slice
+            )
+        for ch in range(self.num_c):
+            wavelength, color = self._channel_color(ch)
+            ch_desheared = get_channel(
+                self.im_desheared, ch, self.num_t, self.num_c
+            )
+            if not batch:
+                self._display_image(ch_desheared, wavelength, color)
+
+        if (self.num_c > 1 and not batch) or show_multi:
+            self._display_image(self.im_desheared, multichannel=True)
+        return None
+
+    def _z_multiple(self):
+        # z-bands of a chunked output are aligned to its chunks, so no two
+        # threads ever write the same chunk
+        if isinstance(self.im_desheared, np.ndarray):
+            return 1
+        return getattr(self.im_desheared, "chunks", (1,) * 3)[-3]
+
+    def _deshear_all_channels_lazy(
+        self, batch=False, show_multi=False, workers=1, max_memory=None
+    ):
+        num_arrays = int(not batch) * self.num_c
+        if (self.num_c > 1 and not batch) or show_multi:
+            num_arrays += 1
+        cache_size = 4
+        if max_memory is not None and num_arrays:
+            # the budget is shared by the volume caches of all the layers
+            volume_nbytes = self.desheared_nbytes() // self.num_t // self.num_c
+            cache_size = max(1, max_memory // num_arrays // volume_nbytes)
+            cache_size = min(cache_size, 4)
+        if not batch:
+            for ch in range(self.num_c):
+                wavelength, color = self._channel_color(ch)
+                self._display_image(
+                    DeshearedArray(
+                        self, ch=ch, cache_size=cache_size, workers=workers
+                    ),
+                    wavelength,
+                    color,
+                )
+        if (self.num_c > 1 and not batch) or show_multi:
+            self._display_image(
+                DeshearedArray(self, cache_size=cache_size, workers=workers),
+                multichannel=True,
+            )
+        return None
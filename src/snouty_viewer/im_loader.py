@@ -1,33 +1,76 @@
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Type, Union
 
 import numpy as np
-import ome_types
 import tifffile
 
+from snouty_viewer.chunking import parse_size, plan_blocks
+from snouty_viewer.manifest import read_json, write_json
+from snouty_viewer.ome_metadata import ome_metadata
+from snouty_viewer.positions import (
+    load_index,
+    split_virtual_path,
+    virtual_name,
+)
+from snouty_viewer.stats import stage
+
+ACQUISITION_INDEX_NAME = ".snouty_index"
+ACQUISITION_INDEX_VERSION = 2
+
+_acquisition_cache = {}
+
 
 class ImPathInfo:
     def __init__(self, path, num_t=-1):
+        # path may select a position and/or timepoint of an acquisition
+        # directory (see positions.virtual_path), read in place
         self.path = path
-        self.data_path = os.path.join(path, "data")
-        self.metadata_dir = os.path.join(path, "metadata")
-        metadata_files = [
-            f for f in os.listdir(self.metadata_dir) if f.endswith(".txt")
-        ]
-        self.metadata_files = [
-            os.path.join(self.metadata_dir, f) for f in metadata_files
-        ]
+        self.name = virtual_name(path)
+        snouty_dir, position, timepoint = split_virtual_path(path)
+        self.data_path = os.path.join(snouty_dir, "data")
+        self.metadata_dir = os.path.join(snouty_dir, "metadata")
+        # buffer list, shapes and metadata, cached in a .snouty_index sidecar
+        acquisition = load_acquisition_index(snouty_dir)
+        self.buffers = acquisition["buffers"]
+        metadata = None
+        if position is None and timepoint is None:
+            self.metadata_files = [
+                os.path.join(self.metadata_dir, f)
+                for f in acquisition["metadata_files"]
+            ]
+            metadata = acquisition["metadata"]
+            # self.data_tifs.sort()
+            # sort by date
+            data_tifs = sorted(
+                self.buffers, key=lambda f: self.buffers[f]["mtime"]
+            )
+            self.data_tifs = [
+                os.path.join(self.data_path, f) for f in data_tifs
+            ]
+        else:
+            # the selection's own metadata first, else any of the
+            # acquisition's; buffers are already in acquisition order
+            index = load_index(snouty_dir)
+            metadata_files = index.select("metadata", position, timepoint)
+            metadata_files += index.select("metadata")
+            self.metadata_files = [
+                f for f in metadata_files if f.endswith(".txt")
+            ]
+            self.data_tifs = [
+                f
+                for f in index.select("data", position, timepoint)
+                if f.endswith(".tif")
+            ]
+        if not self.metadata_files:
+            raise ValueError(f"No metadata found for {path}")
         self.metadata_path = self.metadata_files[0]
 
-        self.metadata = load_metadata(self.metadata_path)
+        if metadata is None:
+            metadata = load_metadata(self.metadata_path)
+        self.metadata = dict(metadata)
 
-        data_tifs = [
-            f for f in os.listdir(self.data_path) if f.endswith(".tif")
-        ]
-        self.data_tifs = [os.path.join(self.data_path, f) for f in data_tifs]
-        # self.data_tifs.sort()
-        # sort by date
-        self.data_tifs.sort(key=os.path.getmtime)
         if num_t != -1:
             self.data_tifs = self.data_tifs[:num_t]
 
@@ -36,9 +79,19 @@ class ImPathInfo:
         if self.num_buffers == 0:
             raise ValueError(f"No tifs found in {self.data_path}")
 
-        with tifffile.TiffFile(self.data_tifs[0]) as tif:
-            self.xy_shape = tif.pages[0].shape
-            self.im_dtype = tif.pages[0].dtype
+        first_buffer = self.buffers[os.path.basename(self.data_tifs[0])]
+        self.xy_shape = tuple(first_buffer["page_shape"])
+        self.im_dtype = np.dtype(first_buffer["dtype"])
+        # the microscope writes every buffer the same way, so the data of
+        # any buffer of the first one's size sits at the same offset
+        self.buffer_layout = None
+        if first_buffer["offset"] is not None:
+            self.buffer_layout = (
+                first_buffer["size"],
+                first_buffer["offset"],
+                tuple(first_buffer["shape"]),
+                first_buffer["dtype"],
+            )
 
         self.vols_per_buffer = int(self.metadata["volumes_per_buffer"])
         self.num_volumes = self.vols_per_buffer * self.num_buffers
@@ -56,22 +109,154 @@ class ImPathInfo:
         self.axes = "TCZYX"
 
 
+def buffer_info(im_path):
+    stat = os.stat(im_path)
+    with stage("index.buffer_info"), tifffile.TiffFile(im_path) as tif:
+        series = tif.series[0]
+        return {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "shape": list(series.shape),
+            "page_shape": list(tif.pages[0].shape),
+            "dtype": str(series.dtype),
+            # None unless the pages are stored contiguous and uncompressed
+            "offset": series.dataoffset,
+        }
+
+
+def _try_buffer_info(im_path):
+    try:
+        return buffer_info(im_path)
+    except (OSError, ValueError):
+        return None
+
+
+@stage("index")
+def load_acquisition_index(snouty_dir, workers=8):
+    """Buffers and metadata of an acquisition directory, cached on disk.
+
+    The index holds the size, mtime, shape, dtype and data offset of every
+    buffer plus the parsed metadata, in a `.snouty_index` sidecar of the
+    directory. It is reused as long as the data and metadata folders are
+    unmodified; when buffers are added or removed only the new ones (and the
+    latest, which may have still been written to) are read. Acquisitions
+    that can't be written to keep their index in memory only.
+    """
+    snouty_dir = os.path.abspath(snouty_dir)
+    data_path = os.path.join(snouty_dir, "data")
+    metadata_dir = os.path.join(snouty_dir, "metadata")
+    mtimes = [
+        os.stat(data_path).st_mtime_ns,
+        os.stat(metadata_dir).st_mtime_ns,
+    ]
+    index_path = os.path.join(snouty_dir, ACQUISITION_INDEX_NAME)
+    index = _acquisition_cache.get(snouty_dir) or read_json(index_path)
+    if index is not None and index.get("version") != ACQUISITION_INDEX_VERSION:
+        index = None
+    if index is not None and index["mtimes"] == mtimes:
+        if not index["pending"]:
+            _acquisition_cache[snouty_dir] = index
+            return index
+
+    buffers = {}
+    if index is not None:
+        buffers = dict(index["buffers"])
+        if buffers:
+            latest = max(buffers, key=lambda f: buffers[f]["mtime"])
+            del buffers[latest]
+    names = [f for f in os.listdir(data_path) if f.endswith(".tif")]
+    buffers = {f: buffers[f] for f in names if f in buffers}
+    new_names = [f for f in names if f not in buffers]
+    # opening thousands of tifs is mostly waiting on the filesystem
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        new_buffers = executor.map(
+            _try_buffer_info,
+            [os.path.join(data_path, f) for f in new_names],
+        )
+        buffers.update(zip(new_names, new_buffers))
+    # buffers the microscope is still writing can't be parsed yet, they are
+    # retried every time the index is loaded until they can
+    pending = [f for f in names if buffers[f] is None]
+    buffers = {f: info for f, info in buffers.items() if info is not None}
+    metadata_files = [
+        f for f in os.listdir(metadata_dir) if f.endswith(".txt")
+    ]
+    metadata = None
+    if metadata_files:
+        metadata = load_metadata(os.path.join(metadata_dir, metadata_files[0]))
+    index = {
+        "version": ACQUISITION_INDEX_VERSION,
+        "mtimes": mtimes,
+        "metadata_files": metadata_files,
+        "metadata": metadata,
+        "buffers": buffers,
+        "pending": pending,
+    }
+    try:
+        write_json(index_path, index)
+    except OSError:
+        pass
+    _acquisition_cache[snouty_dir] = index
+    return index
+
+
+@stage("allocate")
 def allocate_memory_return_memmap(
     axes,
     shape,
     snouty_metadata,
     save_path: str,
     dtype: Union[Type, str] = "float",
+    num_levels: int = 1,
 ):
-    tifffile.imwrite(
-        save_path,
-        shape=shape,
-        dtype=dtype,
-        bigtiff=True,
-        metadata={"axes": axes},
+    num_c = shape[axes.index("C")] if "C" in axes else 1
+    metadata = ome_metadata(
+        snouty_metadata, axes, time_increment(snouty_metadata), num_c
     )
-    ome_xml = tifffile.tiffcomment(save_path)
-    ome = ome_types.from_xml(ome_xml, parser="lxml")
+    # note: numpy uses 8 bits as smallest, so 'bit' type does nothing for bool.
+    if num_levels > 1:
+        # pyramid levels are stored as SubIFDs, halved in YX only since
+        # every level needs the same planes
+        with tifffile.TiffWriter(save_path, bigtiff=True) as tif:
+            tif.write(
+                shape=shape,
+                dtype=dtype,
+                subifds=num_levels - 1,
+                photometric="minisblack",
+                metadata=metadata,
+            )
+            level_shape = tuple(shape)
+            for _ in range(num_levels - 1):
+                level_shape = level_shape[:-2] + tuple(
+                    -(-size // 2) for size in level_shape[-2:]
+                )
+                tif.write(
+                    shape=level_shape,
+                    dtype=dtype,
+                    subfiletype=1,
+                    photometric="minisblack",
+                )
+    else:
+        tifffile.imwrite(
+            save_path,
+            shape=shape,
+            dtype=dtype,
+            bigtiff=True,
+            metadata=metadata,
+        )
+    return tifffile.memmap(save_path, mode="r+")
+
+
+def memmap_levels(save_path, mode="r+"):
+    with tifffile.TiffFile(save_path) as tif:
+        num_levels = len(tif.series[0].levels)
+    return [
+        tifffile.memmap(save_path, series=0, level=level, mode=mode)
+        for level in range(num_levels)
+    ]
+
+
+def time_increment(snouty_metadata):
     # try to get delay, if not, set to 0
     delay = snouty_metadata.get("delay_s", None)
     if delay is None or delay == "None":
@@ -89,19 +274,7 @@ def allocate_memory_return_memmap(
     # else:
     #     delay = float(delay)
     vps = float(snouty_metadata["volumes_per_s"])
-    px_size = float(snouty_metadata["sample_px_um"])
-    ome.images[0].pixels.physical_size_x = px_size
-    ome.images[0].pixels.physical_size_y = px_size
-    ome.images[0].pixels.physical_size_z = px_size * float(
-        snouty_metadata["voxel_aspect_ratio"]
-    )
-    ome.images[0].pixels.time_increment = vps + delay
-    ome.images[0].description = snouty_metadata["description"]
-    # ome.images[0].pixels.type = dtype
-    # note: numpy uses 8 bits as smallest, so 'bit' type does nothing for bool.
-    ome_xml = ome.to_xml()
-    tifffile.tiffcomment(save_path, ome_xml)
-    return tifffile.memmap(save_path, mode="r+")
+    return vps + delay
 
 
 def load_channel(im_path_info, ch):
@@ -112,14 +285,23 @@ def load_channel(im_path_info, ch):
     for idx, tif_frame in enumerate(im_path_info.data_tifs):
         start = im_path_info.vols_per_buffer * idx
         end = start + im_path_info.vols_per_buffer
-        im_channel[start:end, ...] = load_tif(
-            tif_frame, ch, im_path_info.num_channels
+        im_buffer = load_buffer(
+            tif_frame,
+            im_path_info.vols_per_buffer,
+            im_path_info.num_channels,
+            im_path_info.buffer_layout,
         )
+        if im_path_info.num_channels > 1:
+            im_buffer = im_buffer[:, :, ch]
+        im_channel[start:end, ...] = im_buffer
     return im_channel
 
 
-def load_full(im_path_info: ImPathInfo, path_out):
-    name = im_path_info.path.rsplit(os.sep)[-1]
+def load_full(im_path_info: ImPathInfo, path_out, max_memory=None):
+    # copied into the skewed ome.tif in blocks of timepoints (or z-bands of
+    # a timepoint) that fit in max_memory bytes, one timepoint at a time
+    # without a budget
+    name = im_path_info.name
     save_path = os.path.join(path_out, f"skewed-{name}.ome.tif")
     skewed_memmap = allocate_memory_return_memmap(
         im_path_info.axes,
@@ -128,22 +310,41 @@ def load_full(im_path_info: ImPathInfo, path_out):
         save_path,
         im_path_info.im_dtype,
     )
-    for ch_num in range(im_path_info.num_channels):
-        if im_path_info.num_channels > 1:
-            if im_path_info.num_volumes > 1:
-                skewed_memmap[:, ch_num, ...] = load_channel(
-                    im_path_info, ch_num
-                )
+    # the unsqueezed TCZYX view of the same file
+    im_full = skewed_memmap.reshape(im_path_info.im_shape)
+    skewed_array = SkewedArray(im_path_info)
+    num_t, num_c, num_z = im_path_info.im_shape[:3]
+    timepoint_nbytes = im_full[0].nbytes
+    for t_slice, z_slice in plan_blocks(
+        num_t, num_z, timepoint_nbytes, parse_size(max_memory)
+    ):
+        block_nbytes = im_full[t_slice, :, z_slice].nbytes
+        with stage("load_full.read", block_nbytes):
+            if im_path_info.num_channels > 1:
+                im_block = skewed_array[t_slice, :, z_slice]
             else:
-                skewed_memmap[ch_num, ...] = load_channel(im_path_info, ch_num)
-            # ch_desheared = ch_desheared[:, ...]
-        else:
-            # self.im_desheared = ch_desheared
-            skewed_memmap = load_channel(im_path_info, ch_num)
-    px_size = float(im_path_info.metadata["sample_px_um"])
-    z_px_size = px_size * float(im_path_info.metadata["voxel_aspect_ratio"])
+                im_block = skewed_array[t_slice, z_slice][:, np.newaxis]
+        with stage("load_full.write", block_nbytes):
+            im_full[t_slice, :, z_slice] = im_block
+    skewed_memmap.flush()
+    im_tuple = [(skewed_memmap, layer_kwargs(im_path_info), "image")]
+    return im_tuple
+
+
+def load_lazy(im_path_info: ImPathInfo):
+    skewed_array = SkewedArray(im_path_info)
+    im_tuple = [(skewed_array, layer_kwargs(im_path_info), "image")]
+    return im_tuple
+
+
+def layer_kwargs(im_path_info: ImPathInfo):
+    name = im_path_info.name
+    # fall back to unit voxels for metadata that is missing the pixel sizes
+    px_size = float(im_path_info.metadata.get("sample_px_um", 1))
+    z_px_size = px_size * float(
+        im_path_info.metadata.get("voxel_aspect_ratio", 1)
+    )
     scale = (z_px_size, px_size, px_size)
-    layer_type = "image"
     add_kwargs = {
         "name": name,
         "metadata": {
@@ -152,8 +353,7 @@ def load_full(im_path_info: ImPathInfo, path_out):
         },
         "scale": scale,
     }
-    im_tuple = [(skewed_memmap, add_kwargs, layer_type)]
-    return im_tuple
+    return add_kwargs
 
 
 def load_tif(im_path, ch, num_channels=1):
@@ -164,6 +364,148 @@ def load_tif(im_path, ch, num_channels=1):
     return im_frame
 
 
+def load_buffer(im_path, vols_per_buffer, num_channels=1, layout=None):
+    # the open memmaps are cached per file version, so a rewritten buffer is
+    # never read through a stale mapping
+    stat = os.stat(im_path)
+    if layout is not None and layout[0] != stat.st_size:
+        # not laid out like the first buffer, let tifffile parse it
+        layout = None
+    return _load_buffer(
+        im_path,
+        stat.st_mtime_ns,
+        stat.st_size,
+        vols_per_buffer,
+        num_channels,
+        layout,
+    )
+
+
+@functools.lru_cache(maxsize=8)
+@stage("open_buffer")
+def _load_buffer(
+    im_path, mtime_ns, size, vols_per_buffer, num_channels, layout=None
+):
+    # all channels of a buffer as (volume, Z, [C,] Y, X), whether or not
+    # tifffile kept the singleton volume / channel axes
+    if layout is None:
+        im_buffer = load_tif(im_path, slice(None), num_channels)
+    else:
+        # map the pixel data straight from its offset, without parsing the
+        # TIFF structure (and its thousands of pages) again
+        _, offset, shape, dtype = layout
+        im_buffer = np.memmap(
+            im_path, dtype=dtype, mode="r", offset=offset, shape=shape
+        )[..., 8:, :]
+    channel_shape = () if num_channels == 1 else (num_channels,)
+    return im_buffer.reshape(
+        (vols_per_buffer, -1) + channel_shape + im_buffer.shape[-2:]
+    )
+
+
+def _expand_key(key, ndim):
+    if not isinstance(key, tuple):
+        key = (key,)
+    for idx, k in enumerate(key):
+        if k is Ellipsis:
+            fill = (slice(None),) * (ndim - len(key) + 1)
+            key = key[:idx] + fill + key[idx + 1 :]
+            break
+    return key + (slice(None),) * (ndim - len(key))
+
+
+class LazyArray:
+    """Read-only array-like assembled from independently loaded volumes.
+
+    Subclasses set `shape`, `dtype` and `num_lead` (the number of leading
+    axes that select a volume) and implement `volume(*idx)`. Indexing only
+    computes the volumes that are actually requested.
+    """
+
+    num_lead = 1
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        im = self[...]
+        if dtype is not None:
+            im = im.astype(dtype, copy=False)
+        return im
+
+    def volume(self, *idx):
+        raise NotImplementedError
+
+    def __getitem__(self, key):
+        key = _expand_key(key, self.ndim)
+        lead_key, vol_key = key[: self.num_lead], key[self.num_lead :]
+        lead_idx = [
+            np.arange(num)[k]
+            for num, k in zip(self.shape[: self.num_lead], lead_key)
+        ]
+        # zero-strided stand-in to get the output shape without reading
+        vol_shape = np.broadcast_to(
+            np.zeros((), self.dtype), self.shape[self.num_lead :]
+        )[vol_key].shape
+        lead_shape = tuple(len(np.atleast_1d(idx)) for idx in lead_idx)
+        im = np.empty(lead_shape + vol_shape, self.dtype)
+        for pos in np.ndindex(lead_shape):
+            vol_idx = [np.atleast_1d(idx)[p] for idx, p in zip(lead_idx, pos)]
+            im[pos] = self.volume(*vol_idx)[vol_key]
+        # drop the axes that were indexed with an integer
+        out_shape = tuple(
+            num for num, idx in zip(lead_shape, lead_idx) if idx.ndim
+        )
+        return im.reshape(out_shape + vol_shape)
+
+
+class SkewedArray(LazyArray):
+    """Lazy, read-only array over the raw buffers of an acquisition.
+
+    Volumes are read from the buffer tifs on demand (with the header rows
+    cropped), so opening an acquisition costs nothing regardless of its size
+    and no intermediate file is written. The shape matches `load_full`:
+    TZYX for single channel data, TCZYX otherwise.
+    """
+
+    def __init__(self, im_path_info: ImPathInfo):
+        self.im_path_info = im_path_info
+        self.num_channels = im_path_info.num_channels
+        self.vols_per_buffer = im_path_info.vols_per_buffer
+        shape = im_path_info.im_shape
+        if self.num_channels == 1:
+            shape = shape[:1] + shape[2:]
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(im_path_info.im_dtype)
+
+    def extend(self, im_path_info: ImPathInfo):
+        # follow a newer snapshot of the same, still growing, acquisition
+        self.im_path_info = im_path_info
+        self.shape = (im_path_info.im_shape[0],) + self.shape[1:]
+
+    def volume(self, t):
+        buffer_num, vol_num = divmod(int(t), self.vols_per_buffer)
+        im_buffer = load_buffer(
+            self.im_path_info.data_tifs[buffer_num],
+            self.vols_per_buffer,
+            self.num_channels,
+            self.im_path_info.buffer_layout,
+        )
+        im_volume = im_buffer[vol_num]
+        if self.num_channels > 1:
+            # buffers are stored ZCYX
+            im_volume = np.moveaxis(im_volume, 1, 0)
+        return im_volume
+
+
 def load_metadata(metadata_path):
     with open(metadata_path) as f:
         lines = f.readlines()
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+
+from snouty_viewer.deshear import DeshearedArray, ImInfo, PseudoImage
+from snouty_viewer.im_loader import ImPathInfo, load_lazy
+
+
+def num_complete_buffers(im_path_info: ImPathInfo):
+    # only the newest buffer can still be being written, it's complete once
+    # the file holds all of its pixel data
+    num_buffers = im_path_info.num_buffers
+    layout = im_path_info.buffer_layout
+    if layout is None:
+        # no way to tell, wait for the next buffer to start
+        return num_buffers - 1
+    _, offset, shape, dtype = layout
+    data_end = offset + int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if os.stat(im_path_info.data_tifs[-1]).st_size < data_end:
+        return num_buffers - 1
+    return num_buffers
+
+
+class LiveAcquisition:
+    """Follows an acquisition while the microscope is still writing it.
+
+    `poll` looks for newly completed buffers and grows the T axis of the
+    arrays in `layer_data` in place. Everything stays lazy, so a poll costs a
+    listing of the data folder, and only the timepoints that get looked at
+    are read (and desheared with `deskew`).
+    """
+
+    def __init__(self, path, deskew=True, workers=1):
+        self.path = path
+        self.deskew = deskew
+        self.workers = workers
+        im_path_info = ImPathInfo(path)
+        self.num_buffers = num_complete_buffers(im_path_info)
+        if self.num_buffers == 0:
+            raise ValueError(f"No complete buffer in {path} yet")
+        im_path_info = ImPathInfo(path, num_t=self.num_buffers)
+        im_tuple = load_lazy(im_path_info)[0]
+        self.skewed = im_tuple[0]
+        if not deskew:
+            self.layer_data = [im_tuple]
+            return
+        self.im_info = ImInfo(PseudoImage(im_tuple), im_path_info.im_shape)
+        self.im_info.deshear_all_channels(lazy=True, workers=workers)
+        self.layer_data = self.im_info.displayed_images
+
+    @property
+    def num_t(self):
+        return self.skewed.shape[0]
+
+    def poll(self):
+        """Add the buffers completed since the last poll, True if any."""
+        im_path_info = ImPathInfo(self.path)
+        num_buffers = num_complete_buffers(im_path_info)
+        if num_buffers <= self.num_buffers:
+            return False
+        self.num_buffers = num_buffers
+        self.skewed.extend(ImPathInfo(self.path, num_t=num_buffers))
+        if self.deskew:
+            self.im_info.extend(self.num_t)
+            for data, _, _ in self.layer_data:
+                if isinstance(data, DeshearedArray):
+                    data.extend()
+        return True
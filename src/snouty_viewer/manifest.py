@@ -0,0 +1,134 @@
+import json
+import os
+import tempfile
+
+MANIFEST_NAME = "snouty_manifest.json"
+
+# the umask can only be read by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def fingerprint(snouty_dir):
+    # size and mtime of every buffer and metadata file, enough to tell
+    # whether an acquisition changed since it was converted
+    from snouty_viewer.positions import load_index, split_virtual_path
+
+    snouty_dir, position, timepoint = split_virtual_path(snouty_dir)
+    files = {}
+    for folder in ["data", "metadata"]:
+        if position is None and timepoint is None:
+            paths = [
+                entry.path
+                for entry in os.scandir(os.path.join(snouty_dir, folder))
+            ]
+        else:
+            paths = load_index(snouty_dir).select(folder, position, timepoint)
+        for path in paths:
+            if path.endswith((".tif", ".txt")):
+                stat = os.stat(path)
+                name = os.path.basename(path)
+                files[f"{folder}/{name}"] = [stat.st_size, stat.st_mtime]
+    return files
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, obj):
+    # write then rename, so a crash never leaves a half written file; the
+    # temporary file is unique, as processes may write the same index at once
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f"{os.path.basename(path)}.",
+        suffix=".tmp",
+        dir=os.path.dirname(os.path.abspath(path)),
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(obj, f, indent=2)
+        # mkstemp files are private, the others get the usual permissions
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class Manifest:
+    """Record of the directories a batch has converted into `path_out`."""
+
+    def __init__(self, path_out):
+        self.path = os.path.join(path_out, MANIFEST_NAME)
+        manifest = read_json(self.path) or {}
+        self.directories = manifest.get("directories", {})
+
+    def is_done(self, snouty_dir, files, num_t=-1, options=None):
+        # done with the same buffers and output options, and still there
+        entry = self.directories.get(os.path.abspath(snouty_dir))
+        if entry is None or not entry["done"]:
+            return False
+        if entry["files"] != files or entry["num_t"] != num_t:
+            return False
+        if entry.get("options") != options:
+            return False
+        return os.path.exists(entry["output"])
+
+    def record(
+        self,
+        snouty_dir,
+        files,
+        num_t=-1,
+        output=None,
+        done=False,
+        error=None,
+        options=None,
+    ):
+        self.directories[os.path.abspath(snouty_dir)] = {
+            "files": files,
+            "num_t": num_t,
+            "options": options,
+            "output": output,
+            "done": done,
+            "error": error,
+        }
+        write_json(self.path, {"directories": self.directories})
+
+
+def progress_path(save_path):
+    return f"{save_path}.progress.json"
+
+
+def read_progress(save_path, files, shape, options=None):
+    # number of timepoints already written to save_path by an interrupted run
+    # with the same buffers and output options
+    progress = read_json(progress_path(save_path))
+    if progress is None or not os.path.exists(save_path):
+        return 0
+    if progress["files"] != files or progress["shape"] != list(shape):
+        return 0
+    if progress.get("options") != options:
+        return 0
+    return progress["completed_volumes"]
+
+
+def write_progress(save_path, files, shape, completed_volumes, options=None):
+    write_json(
+        progress_path(save_path),
+        {
+            "files": files,
+            "shape": list(shape),
+            "options": options,
+            "completed_volumes": completed_volumes,
+        },
+    )
+
+
+def clear_progress(save_path):
+    if os.path.exists(progress_path(save_path)):
+        os.remove(progress_path(save_path))
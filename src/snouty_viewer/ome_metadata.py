@@ -0,0 +1,68 @@
+import ast
+import xml.etree.ElementTree as ElementTree
+
+# the OME-TIFF outputs keep their Snouty metadata in a MapAnnotation of it
+SNOUTY_NAMESPACE = "snouty_metadata"
+
+
+def channel_names(snouty_metadata, num_c=1):
+    channels = snouty_metadata.get("channels_per_slice", None)
+    try:
+        return [str(channel) for channel in ast.literal_eval(channels)]
+    except (ValueError, SyntaxError):
+        return [str(ch) for ch in range(num_c)]
+
+
+def ome_metadata(snouty_metadata, axes, time_increment, num_c=1):
+    """OME metadata of a deskewed image, as tifffile's `metadata` argument.
+
+    tifffile writes it as the OME-XML of the first page while the file is
+    created, so there is no need to read the XML back, parse it and rewrite
+    it afterwards.
+    """
+    px_size = float(snouty_metadata.get("sample_px_um", 1))
+    z_px_size = px_size * float(snouty_metadata.get("voxel_aspect_ratio", 1))
+    metadata = {
+        "axes": axes,
+        "PhysicalSizeX": px_size,
+        "PhysicalSizeY": px_size,
+        "PhysicalSizeZ": z_px_size,
+        "TimeIncrement": time_increment,
+        "Description": snouty_metadata.get("description", ""),
+        # that of the output, e.g. with its resampled or binned pixel sizes
+        "MapAnnotation": {
+            "Namespace": SNOUTY_NAMESPACE,
+            "Value": {
+                key: str(value) for key, value in snouty_metadata.items()
+            },
+        },
+    }
+    # todo fix datetime format to work
+    # acquisition_date = f"{snouty_metadata['Date']} - " \
+    #                    f"{snouty_metadata['Time']}"
+    names = channel_names(snouty_metadata, num_c)
+    if len(names) == num_c:
+        metadata["Channel"] = {"Name": names}
+        # channels are named after their excitation laser line
+        if all(name.isdigit() for name in names):
+            metadata["Channel"]["ExcitationWavelength"] = [
+                float(name) for name in names
+            ]
+    return metadata
+
+
+def read_snouty_metadata(ome_xml):
+    # the Snouty metadata of an output from its OME-XML, None if it has none;
+    # parsed as is, tifffile.xml2dict would turn the values into numbers
+    root = ElementTree.fromstring(ome_xml)
+    for annotation in root.iter():
+        if not annotation.tag.endswith("}MapAnnotation"):
+            continue
+        if annotation.get("Namespace") != SNOUTY_NAMESPACE:
+            continue
+        return {
+            item.get("K"): item.text or ""
+            for item in annotation.iter()
+            if item.tag.endswith("}M")
+        }
+    return None
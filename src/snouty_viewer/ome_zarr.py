@@ -0,0 +1,146 @@
+import numpy as np
+
+from snouty_viewer.deshear import get_volume
+from snouty_viewer.pyramid import level_factors, level_shapes
+from snouty_viewer.stats import stage
+
+# NGFF 0.4 axes of every array we write
+AXES = [
+    {"name": "t", "type": "time", "unit": "second"},
+    {"name": "c", "type": "channel"},
+    {"name": "z", "type": "space", "unit": "micrometer"},
+    {"name": "y", "type": "space", "unit": "micrometer"},
+    {"name": "x", "type": "space", "unit": "micrometer"},
+]
+DEFAULT_CHUNKS = (64, 256, 256)
+
+
+def _import_zarr():
+    try:
+        import numcodecs
+        import zarr
+    except ImportError as e:
+        raise ImportError(
+            "Writing OME-Zarr needs zarr, install it with "
+            "`pip install snouty-viewer[zarr]`"
+        ) from e
+    return zarr, numcodecs
+
+
+def _zarr_v3(zarr):
+    return int(zarr.__version__.split(".")[0]) >= 3
+
+
+def ngff_multiscales(name, scale, time_increment, factors=((1, 1, 1),)):
+    # scale is (z, y, x), factors the (z, y, x) downsampling of every level
+    datasets = []
+    for level, level_factor in enumerate(factors):
+        level_scale = [time_increment, 1.0] + [
+            float(size) * factor for size, factor in zip(scale, level_factor)
+        ]
+        datasets.append(
+            {
+                "path": str(level),
+                "coordinateTransformations": [
+                    {"type": "scale", "scale": level_scale}
+                ],
+            }
+        )
+    return [
+        {"version": "0.4", "name": name, "axes": AXES, "datasets": datasets}
+    ]
+
+
+@stage("allocate")
+def allocate_ome_zarr(
+    save_path,
+    shape,
+    dtype,
+    scale,
+    time_increment,
+    name="",
+    snouty_metadata=None,
+    chunks=None,
+    compressor="zstd",
+    clevel=5,
+    z_steps=(),
+):
+    """Create an empty TCZYX OME-Zarr image and return its arrays.
+
+    Every chunk holds part of a single (t, c) volume, `chunks` being its ZYX
+    shape. Chunks that stay zero (such as the deshear padding) are never
+    written. `compressor` is a Blosc codec name, or None for no compression.
+    One array is returned per pyramid level, each level halving YX and Z by
+    its `z_steps` entry.
+    """
+    zarr, numcodecs = _import_zarr()
+    if chunks is None:
+        chunks = DEFAULT_CHUNKS
+    if compressor is not None:
+        compressor = numcodecs.Blosc(
+            cname=compressor,
+            clevel=clevel,
+            shuffle=numcodecs.Blosc.BITSHUFFLE,
+        )
+    if _zarr_v3(zarr):
+        root = zarr.open_group(save_path, mode="w", zarr_format=2)
+    else:
+        root = zarr.open_group(save_path, mode="w")
+    levels = []
+    for level, level_shape in enumerate(level_shapes(shape, z_steps)):
+        level_chunks = (1, 1) + tuple(
+            min(int(chunk), size)
+            for chunk, size in zip(chunks, level_shape[2:])
+        )
+        if _zarr_v3(zarr):
+            im = root.create_array(
+                str(level),
+                shape=level_shape,
+                chunks=level_chunks,
+                dtype=dtype,
+                compressors=compressor,
+                fill_value=0,
+                chunk_key_encoding={"name": "v2", "separator": "/"},
+            )
+        else:
+            im = root.create_dataset(
+                str(level),
+                shape=level_shape,
+                chunks=level_chunks,
+                dtype=dtype,
+                compressor=compressor,
+                fill_value=0,
+                dimension_separator="/",
+                write_empty_chunks=False,
+            )
+        levels.append(im)
+    root.attrs["multiscales"] = ngff_multiscales(
+        name, scale, time_increment, level_factors(z_steps)
+    )
+    if snouty_metadata is not None:
+        root.attrs["snouty_metadata"] = dict(snouty_metadata)
+    return levels
+
+
+def open_ome_zarr(save_path, mode="r+"):
+    # all the pyramid levels of an image, full resolution first
+    zarr, _ = _import_zarr()
+    root = zarr.open_group(save_path, mode=mode)
+    datasets = root.attrs["multiscales"][0]["datasets"]
+    return [root[dataset["path"]] for dataset in datasets]
+
+
+def read_attrs(save_path):
+    zarr, _ = _import_zarr()
+    return dict(zarr.open_group(save_path, mode="r").attrs)
+
+
+def write_volumes(im, im_data, t_slice=slice(None), z_slice=slice(None)):
+    # volume by volume (or the z_slice of each), so memory stays bounded by
+    # one (t, c) volume
+    num_t, num_c = im.shape[:2]
+    for t in range(num_t)[t_slice]:
+        for ch in range(num_c):
+            im_volume = get_volume(im_data, t, ch, num_t, num_c)
+            im[t, ch, z_slice] = np.asarray(im_volume[z_slice])
+    return im
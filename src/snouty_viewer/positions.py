@@ -0,0 +1,176 @@
+import os
+import re
+
+from snouty_viewer.manifest import read_json, write_json
+
+# buffer, metadata and preview files of multi-position acquisitions
+FILE_PATTERN = re.compile(r"(\d+)_position(\d+)_timepoint(\d+)_burst(\d+)")
+FOLDERS = ("data", "metadata", "preview")
+POSITION_INDEX_NAME = ".snouty_positions.json"
+# a position and/or timepoint of an acquisition directory, opened in place
+# as if it had been split into its own directory
+VIRTUAL_SEP = "::"
+SELECTION_PATTERN = re.compile(r"(?:position(\d+))?_?(?:timepoint(\d+))?")
+SPLIT_BY = ("none", "position", "timepoint")
+
+_index_cache = {}
+
+
+def virtual_path(snouty_dir, position=None, timepoint=None):
+    selection = []
+    if position is not None:
+        selection.append(f"position{position}")
+    if timepoint is not None:
+        selection.append(f"timepoint{timepoint}")
+    if not selection:
+        return snouty_dir
+    return f"{snouty_dir}{VIRTUAL_SEP}{'_'.join(selection)}"
+
+
+def split_virtual_path(path):
+    # (acquisition directory, position, timepoint), None when not selected
+    snouty_dir, sep, selection = path.partition(VIRTUAL_SEP)
+    if not sep:
+        return path, None, None
+    match = SELECTION_PATTERN.fullmatch(selection)
+    if match is None or not selection:
+        raise ValueError(f"Can't parse position selection {selection!r}")
+    position, timepoint = (
+        None if group is None else int(group) for group in match.groups()
+    )
+    return snouty_dir, position, timepoint
+
+
+def virtual_name(path):
+    snouty_dir, position, timepoint = split_virtual_path(path)
+    name = os.path.basename(os.path.normpath(snouty_dir))
+    if position is not None:
+        name = f"{name}-position{position}"
+    if timepoint is not None:
+        name = f"{name}-timepoint{timepoint}"
+    return name
+
+
+def _folder_mtimes(snouty_dir):
+    mtimes = {}
+    for folder in FOLDERS:
+        try:
+            mtimes[folder] = os.stat(
+                os.path.join(snouty_dir, folder)
+            ).st_mtime_ns
+        except FileNotFoundError:
+            pass
+    return mtimes
+
+
+class PositionIndex:
+    """Position / timepoint table of the files of an acquisition directory.
+
+    Files are grouped by the position and timepoint in their
+    `<index>_position<p>_timepoint<t>_burst<b>` names, without copying or
+    moving anything. Files that don't follow the pattern aren't indexed.
+    """
+
+    def __init__(self, snouty_dir, mtimes=None, files=None):
+        self.snouty_dir = snouty_dir
+        self.mtimes = _folder_mtimes(snouty_dir) if mtimes is None else mtimes
+        # folder -> [[index, position, timepoint, burst, file name], ...]
+        self.files = self.scan() if files is None else files
+
+    def scan(self):
+        files = {}
+        for folder in self.mtimes:
+            entries = []
+            for name in os.listdir(os.path.join(self.snouty_dir, folder)):
+                match = FILE_PATTERN.match(name)
+                if match:
+                    entries.append([int(g) for g in match.groups()] + [name])
+            # acquisition order
+            entries.sort()
+            files[folder] = entries
+        return files
+
+    def positions(self):
+        return sorted({entry[1] for entry in self.files.get("data", [])})
+
+    def timepoints(self, position=None):
+        return sorted(
+            {
+                entry[2]
+                for entry in self.files.get("data", [])
+                if position is None or entry[1] == position
+            }
+        )
+
+    def select(self, folder, position=None, timepoint=None):
+        selected = []
+        for _, entry_position, entry_timepoint, _, name in self.files.get(
+            folder, []
+        ):
+            if position not in (None, entry_position):
+                continue
+            if timepoint not in (None, entry_timepoint):
+                continue
+            selected.append(os.path.join(self.snouty_dir, folder, name))
+        return selected
+
+    def virtual_paths(self, split_by="position"):
+        if split_by == "position":
+            return [
+                virtual_path(self.snouty_dir, position=position)
+                for position in self.positions()
+            ]
+        if split_by == "timepoint":
+            return [
+                virtual_path(self.snouty_dir, timepoint=timepoint)
+                for timepoint in self.timepoints()
+            ]
+        return [self.snouty_dir]
+
+    def to_json(self):
+        return {"mtimes": self.mtimes, "files": self.files}
+
+
+def load_index(snouty_dir, save=False):
+    """Position index of `snouty_dir`, only rescanned when its files change.
+
+    The index is kept in memory and, with `save` (or once it has been saved),
+    in a `.snouty_positions.json` next to the data folder, both validated
+    against the modification times of the data, metadata and preview
+    folders.
+    """
+    snouty_dir = os.path.abspath(snouty_dir)
+    mtimes = _folder_mtimes(snouty_dir)
+    index = _index_cache.get(snouty_dir)
+    if index is not None and index.mtimes == mtimes:
+        return index
+    index_path = os.path.join(snouty_dir, POSITION_INDEX_NAME)
+    saved = read_json(index_path)
+    if saved is not None and saved["mtimes"] == mtimes:
+        index = PositionIndex(snouty_dir, mtimes, saved["files"])
+    else:
+        index = PositionIndex(snouty_dir, mtimes)
+        if save or saved is not None:
+            try:
+                write_json(index_path, index.to_json())
+            except OSError:
+                # e.g. a read-only acquisition, keep it in memory only
+                pass
+    _index_cache[snouty_dir] = index
+    return index
+
+
+def list_positions(snouty_dirs, split_by="position", save=False):
+    # every position (or timepoint) of each directory as a virtual path,
+    # directories without position file names are kept whole
+    if split_by not in SPLIT_BY:
+        raise ValueError(
+            f"Unknown split {split_by!r}, expected one of {SPLIT_BY}"
+        )
+    if split_by == "none":
+        return list(snouty_dirs)
+    paths = []
+    for snouty_dir in snouty_dirs:
+        virtual_paths = load_index(snouty_dir, save).virtual_paths(split_by)
+        paths.extend(virtual_paths or [snouty_dir])
+    return paths
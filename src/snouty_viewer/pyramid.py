@@ -0,0 +1,99 @@
+import numpy as np
+
+from snouty_viewer.deshear import volume_index
+from snouty_viewer.stats import stage
+
+# levels are added until the largest YX size of the coarsest fits this
+AUTO_LEVEL_SIZE = 1024
+MAX_LEVELS = 8
+
+
+def auto_num_levels(shape, level_size=AUTO_LEVEL_SIZE):
+    num_levels = 1
+    yx_size = max(shape[-2:])
+    while yx_size > level_size and num_levels < MAX_LEVELS:
+        yx_size = -(-yx_size // 2)
+        num_levels += 1
+    return num_levels
+
+
+def level_z_steps(num_levels, voxel_aspect_ratio=1.0, z_downsample=True):
+    # every level halves YX; Z is only halved once the planes are no longer
+    # coarser than the new XY pixels, keeping the voxels close to isotropic
+    z_steps = []
+    z_factor = 1
+    for level in range(1, num_levels):
+        z_step = 1
+        if z_downsample and voxel_aspect_ratio * z_factor * 2 <= 2**level:
+            z_step = 2
+        z_factor *= z_step
+        z_steps.append(z_step)
+    return z_steps
+
+
+def level_factors(z_steps):
+    # (z, y, x) downsampling of every level relative to full resolution
+    factors = [(1, 1, 1)]
+    for z_step in z_steps:
+        z, y, x = factors[-1]
+        factors.append((z * z_step, y * 2, x * 2))
+    return factors
+
+
+def level_shapes(shape, z_steps):
+    shapes = [tuple(shape)]
+    for z_step in z_steps:
+        *lead, num_z, num_y, num_x = shapes[-1]
+        shapes.append(
+            tuple(lead) + (-(-num_z // z_step), -(-num_y // 2), -(-num_x // 2))
+        )
+    return shapes
+
+
+def downsample(im, z_step=1):
+    # 2x mean binning of the last two axes (and of the third to last with
+    # z_step 2), odd sizes are padded by repeating the last row / plane
+    factors = (z_step, 2, 2)
+    pad = [(0, 0)] * (im.ndim - 3) + [
+        (0, -size % factor) for size, factor in zip(im.shape[-3:], factors)
+    ]
+    if any(after for _, after in pad):
+        im = np.pad(im, pad, mode="edge")
+    *lead, num_z, num_y, num_x = im.shape
+    binned = im.reshape(
+        tuple(lead) + (num_z // z_step, z_step, num_y // 2, 2, num_x // 2, 2)
+    ).mean(axis=(-5, -3, -1), dtype=np.float32)
+    if np.issubdtype(im.dtype, np.integer):
+        binned = np.rint(binned)
+    return binned.astype(im.dtype)
+
+
+def z_band_multiple(levels, z_steps):
+    # z-bands starting at multiples of this downsample to whole planes of
+    # every level and, for chunked levels, to whole chunks
+    multiple = factor = 1
+    for im_level, z_step in zip(levels, (1,) + tuple(z_steps)):
+        factor *= z_step
+        chunk_z = getattr(im_level, "chunks", None)
+        chunk_z = chunk_z[-3] if isinstance(chunk_z, tuple) else 1
+        multiple = int(np.lcm(multiple, factor * chunk_z))
+    return multiple
+
+
+def write_pyramid_volume(
+    levels, z_steps, t, ch, num_t, num_c, z_slice=slice(None)
+):
+    # fills the coarser levels of one (t, c) volume (or of a z_slice of it,
+    # see z_band_multiple) from the just written full resolution one, which
+    # is still hot in the page cache
+    start, stop, _ = z_slice.indices(levels[0].shape[-3])
+    idx = volume_index(levels[0], t, ch, num_t, num_c)
+    im_volume = np.asarray(levels[0][idx + (slice(start, stop),)])
+    with stage("pyramid", im_volume.nbytes):
+        for im_level, z_step in zip(levels[1:], z_steps):
+            im_volume = downsample(im_volume, z_step)
+            start //= z_step
+            idx = volume_index(im_level, t, ch, num_t, num_c)
+            band = slice(start, start + len(im_volume))
+            im_level[idx + (band,)] = im_volume
+    return None
@@ -0,0 +1,66 @@
+"""Smaller outputs: binning and reduced precision, applied band by band.
+
+Desheared bands are binned (by summing or averaging blocks of bin_z planes
+and bin_xy x bin_xy pixels) and converted to the output dtype as they are
+computed, so a reduced output is written in the same pass as a full one.
+Integer outputs narrower than the input are rescaled per channel, from
+intensity percentiles of a few sampled volumes.
+"""
+import numpy as np
+
+BIN_METHODS = ("mean", "sum")
+OUTPUT_DTYPES = ("same", "uint8", "uint16", "float32")
+PERCENTILES = (0.1, 99.9)
+
+
+def bin_band(im_band, bin_z=1, bin_xy=1, method="mean"):
+    # a float32 band of whole bins, the sizes are multiples of the bins
+    num_z, num_y, num_x = im_band.shape
+    blocks = im_band.reshape(
+        num_z // bin_z,
+        bin_z,
+        num_y // bin_xy,
+        bin_xy,
+        num_x // bin_xy,
+        bin_xy,
+    )
+    if method == "sum":
+        return blocks.sum(axis=(1, 3, 5), dtype=np.float32)
+    return blocks.mean(axis=(1, 3, 5), dtype=np.float32)
+
+
+def rescales(in_dtype, out_dtype):
+    # narrower integer outputs use their whole range, others keep values
+    in_dtype, out_dtype = np.dtype(in_dtype), np.dtype(out_dtype)
+    return out_dtype.kind in "ui" and out_dtype.itemsize < in_dtype.itemsize
+
+
+def sample_limits(volumes, percentiles=PERCENTILES, max_planes=16):
+    """The (low, high) intensity percentiles of some ZYX volumes.
+
+    Only up to `max_planes` evenly spaced planes of each volume are read.
+    """
+    samples = []
+    for im_volume in volumes:
+        z_step = max(1, -(-im_volume.shape[0] // max_planes))
+        samples.append(np.asarray(im_volume[::z_step]).ravel())
+    low, high = np.percentile(np.concatenate(samples), percentiles)
+    return float(low), float(high)
+
+
+def convert(im, dtype, limits=None):
+    """`im` as `dtype`, with `limits` (low, high) mapped to 0..dtype max.
+
+    Integer outputs are rounded and clipped to the range of the dtype, so
+    sums over large bins saturate instead of wrapping around.
+    """
+    dtype = np.dtype(dtype)
+    if limits is not None:
+        low, high = limits
+        im = im.astype(np.float32)
+        im -= low
+        im *= np.iinfo(dtype).max / max(high - low, 1e-6)
+    if dtype.kind in "ui" and im.dtype != dtype:
+        info = np.iinfo(dtype)
+        im = np.clip(np.rint(im), info.min, info.max)
+    return im.astype(dtype, copy=False)
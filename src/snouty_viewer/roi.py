@@ -0,0 +1,60 @@
+AXES = "TCZYX"
+
+
+def parse_crop(crop):
+    """A crop as a dict of axis -> (start, stop), in output coordinates.
+
+    `crop` is None, a dict of axis ("T", "C", "Z", "Y" or "X") -> (start,
+    stop) or slice, or a string like "z=10:50,x=100:400". Start and stop
+    follow slice semantics: either may be left out and negative values count
+    from the end.
+    """
+    if crop is None:
+        return {}
+    if isinstance(crop, str):
+        ranges = {}
+        for item in filter(None, crop.replace(" ", "").split(",")):
+            axis, sep, bounds = item.partition("=")
+            start, colon, stop = bounds.partition(":")
+            if not sep or not colon:
+                raise ValueError(
+                    f"Can't parse crop {item!r}, expected e.g. 'z=10:50'"
+                )
+            ranges[axis] = (
+                int(start) if start else None,
+                int(stop) if stop else None,
+            )
+        crop = ranges
+    parsed = {}
+    for axis, bounds in crop.items():
+        if axis.upper() not in AXES:
+            raise ValueError(
+                f"Unknown crop axis {axis!r}, expected one of {AXES}"
+            )
+        if isinstance(bounds, slice):
+            if bounds.step not in (None, 1):
+                raise ValueError(f"Crops can't be strided, got {bounds}")
+            bounds = (bounds.start, bounds.stop)
+        parsed[axis.upper()] = tuple(bounds)
+    return parsed
+
+
+def crop_slices(shape, crop=None):
+    # one slice with explicit bounds per TCZYX axis of shape
+    crop = parse_crop(crop)
+    slices = []
+    for axis, size in zip(AXES, shape):
+        start, stop, _ = slice(*crop.get(axis, (None, None))).indices(size)
+        if stop <= start:
+            raise ValueError(f"The {axis} crop of {crop[axis]} is empty")
+        slices.append(slice(start, stop))
+    return tuple(slices)
+
+
+def intersect(outer, inner):
+    # inner (start, stop) bounds limited to the outer slice
+    start = max(outer.start, inner[0])
+    stop = min(outer.stop, inner[1])
+    if stop <= start:
+        raise ValueError(f"Nothing is left of {outer} within {inner}")
+    return slice(start, stop)
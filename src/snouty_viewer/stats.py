@@ -0,0 +1,157 @@
+"""Per-stage timings and bytes moved, cheap enough to always be on.
+
+Code that reads, deshears or writes wraps each unit of work (a buffer, a
+volume, a block) in `stage(name, nbytes)`, which adds to the `Stats` of the
+current `recording()`. The stages of a run are reported as JSON and as a
+summary table; `profiling()` is the opt-in deep dive with cProfile and
+tracemalloc.
+"""
+import cProfile
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from snouty_viewer.manifest import read_json, write_json
+
+
+class Stats:
+    """Calls, seconds and bytes of every stage of a run, thread-safe."""
+
+    def __init__(self):
+        self.stages = {}
+        self.wall_seconds = 0.0
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds=0.0, nbytes=0, calls=1):
+        with self._lock:
+            entry = self.stages.setdefault(
+                name, {"calls": 0, "seconds": 0.0, "bytes": 0}
+            )
+            entry["calls"] += calls
+            entry["seconds"] += seconds
+            entry["bytes"] += int(nbytes)
+
+    def merge(self, report):
+        # the stages of another run, e.g. a report read back from JSON
+        for name, entry in report["stages"].items():
+            self.add(name, entry["seconds"], entry["bytes"], entry["calls"])
+        self.wall_seconds += report["wall_seconds"]
+
+    def stop(self):
+        self.wall_seconds = time.perf_counter() - self._start
+
+    def report(self):
+        stages = {}
+        with self._lock:
+            for name, entry in sorted(self.stages.items()):
+                stages[name] = dict(entry)
+                if entry["seconds"] > 0 and entry["bytes"] > 0:
+                    mb_per_s = entry["bytes"] / entry["seconds"] / 1e6
+                    stages[name]["mb_per_s"] = round(mb_per_s, 1)
+        return {"wall_seconds": self.wall_seconds, "stages": stages}
+
+
+_current = Stats()
+
+
+@contextmanager
+def stage(name, nbytes=0):
+    # stages run in worker threads too, so their seconds can add up to more
+    # than the wall time of the run
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current.add(name, time.perf_counter() - start, nbytes)
+
+
+@contextmanager
+def recording():
+    # collect the stages of a run separately, they are added to the
+    # enclosing recording once it is done
+    global _current
+    previous, _current = _current, Stats()
+    stats = _current
+    try:
+        yield stats
+    finally:
+        stats.stop()
+        _current = previous
+        previous.merge(stats.report())
+
+
+def report_path(save_path):
+    # the report of a deskewed output sits next to it
+    return f"{save_path}.stats.json"
+
+
+def write_report(path, stats, **info):
+    write_json(path, dict(info, **stats.report()))
+
+
+def merge_reports(paths, wall_seconds=None, since=None):
+    # one report of the stages of several runs, leaving out reports written
+    # before `since` (a time.time()) such as those of skipped directories
+    stats = Stats()
+    for path in paths:
+        report = read_json(path)
+        if report is None:
+            continue
+        if since is not None and os.path.getmtime(path) < since:
+            continue
+        stats.merge(report)
+    if wall_seconds is not None:
+        stats.wall_seconds = wall_seconds
+    return stats.report()
+
+
+def summary(report):
+    # a table of the stages, slowest first
+    lines = [
+        f"{'stage':<24} {'calls':>7} {'s':>9} {'MB':>10} {'MB/s':>8}",
+    ]
+    stages = sorted(
+        report["stages"].items(), key=lambda item: -item[1]["seconds"]
+    )
+    for name, entry in stages:
+        mb_per_s = entry.get("mb_per_s", "")
+        if mb_per_s:
+            mb_per_s = f"{mb_per_s:.1f}"
+        lines.append(
+            f"{name:<24} {entry['calls']:>7} {entry['seconds']:>9.3f} "
+            f"{entry['bytes'] / 1e6:>10.1f} {mb_per_s:>8}"
+        )
+    lines.append(f"{'wall time':<24} {'':>7} {report['wall_seconds']:>9.3f}")
+    return "\n".join(lines)
+
+
+@contextmanager
+def profiling(path, trace_memory=False, top=25):
+    """Profile the calling thread with cProfile, saving the stats to `path`.
+
+    The stats are in pstats format (`python -m pstats path`, snakeviz...).
+    With `trace_memory` the `top` allocation sites are also written to
+    `path` + ".memory.txt", which slows the run down considerably. Worker
+    threads and processes aren't profiled, so use a single worker to see
+    inside the deshear.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            with open(f"{path}.memory.txt", "w") as f:
+                f.write(f"peak traced memory: {peak / 1e6:.1f} MB\n")
+                for line in snapshot.statistics("lineno")[:top]:
+                    f.write(f"{line}\n")